@@ -0,0 +1,70 @@
+'''
+Helpers for averaging repeated readings.
+'''
+import time
+import numpy as np
+
+
+def sample_std(readings):
+    '''
+    Sample standard deviation (ddof = 1), NaN for a single reading.
+    '''
+    if len(readings) < 2:
+        return np.nan
+    return np.std(readings, ddof = 1) #ddof - delta degrees of freedom. set to 1 for sample std
+
+
+class RunningStats(object):
+    '''
+    Running mean and sample standard deviation of a stream of readings (Welford's algorithm).
+    '''
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0. # sum of squared deviations from the mean
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def std(self):
+        '''
+        Sample standard deviation (ddof = 1), NaN below two readings.
+        '''
+        return np.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.nan
+
+    @property
+    def sem(self):
+        '''
+        Standard error of the mean, NaN below two readings.
+        '''
+        return self.std / np.sqrt(self.n) if self.n > 1 else np.nan
+
+
+def average_until(read, rel_error, abs_error = 0, min_samples = 2, max_samples = 10, delay = 0, channel = 0):
+    '''
+    Average repeated readings until the mean is known well enough.
+    read -- returns one reading per channel, e.g. (gate current, drain current)
+    Sampling stops once the standard error of the mean of read()[channel] is within rel_error * |mean| or
+    abs_error, whichever is larger, after at least min_samples and at most max_samples readings.
+    delay [sec]: sleep between readings
+    Returns a RunningStats per channel.
+    '''
+    min_samples = max(int(min_samples), 2)
+    max_samples = max(int(max_samples), min_samples)
+    stats = None
+    for i in range(max_samples):
+        if i: time.sleep(delay)
+        readings = read()
+        if stats is None:
+            stats = [RunningStats() for _ in readings]
+        for s, x in zip(stats, readings):
+            s.add(x)
+        s = stats[channel]
+        if s.n >= min_samples and s.sem <= max(rel_error * abs(s.mean), abs_error):
+            break
+    return stats
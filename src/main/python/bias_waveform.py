@@ -0,0 +1,137 @@
+'''
+Bias waveforms for transient measurements.
+
+A waveform is a list of Segments, each holding the gate and drain at fixed levels for a while.
+step_response(), ramp() and pulse_train() build the usual shapes, load_table() reads one from a file,
+and lists are joined with + and repeated with *. schedule() resolves a waveform into the level changes
+and their offsets from the start, which run_schedule() applies on time while sampling in between.
+'''
+import time
+import numpy as np
+
+GATE_MODES = ('VOLT', 'CURR')
+
+
+class Segment(object):
+    '''
+    Hold the gate and drain at fixed levels for duration [sec].
+    gate, drain -- levels [V, or A for a gate sourcing current], None keeps the level before
+    gate_mode -- 'VOLT' or 'CURR', how the gate is sourced, None keeps the mode before
+    '''
+    __slots__ = ('duration', 'gate', 'drain', 'gate_mode')
+
+    def __init__(self, duration, gate = None, drain = None, gate_mode = None):
+        if duration < 0:
+            raise ValueError('Segment duration must not be negative, got {}'.format(duration))
+        if gate_mode not in GATE_MODES + (None,):
+            raise ValueError('Gate mode must be VOLT or CURR, not {}'.format(gate_mode))
+        self.duration = duration
+        self.gate = gate
+        self.drain = drain
+        self.gate_mode = gate_mode
+
+    def __repr__(self):
+        return 'Segment({}, gate = {}, drain = {}, gate_mode = {})'.format(self.duration, self.gate, self.drain, self.gate_mode)
+
+
+def step_response(initial, setpoint, delay, width, total, bias, step_gate = True, gate_mode = None):
+    '''
+    One cycle of the step response: the stepped terminal at initial for delay [sec], at setpoint for
+    width [sec], and back at initial until total [sec], while the other terminal stays at bias.
+    '''
+    levels = [initial, setpoint, initial]
+    durations = [delay, width, max(total - delay - width, 0)]
+    if step_gate:
+        return [Segment(d, gate = level, drain = bias, gate_mode = gate_mode) for d, level in zip(durations, levels)]
+    return [Segment(d, gate = bias, drain = level, gate_mode = gate_mode) for d, level in zip(durations, levels)]
+
+
+def ramp(duration, start, stop, steps, terminal = 'gate'):
+    '''
+    Staircase from start to stop in steps equal segments taking duration [sec] in all.
+    terminal -- 'gate' or 'drain'
+    '''
+    return [Segment(duration / steps, **{terminal: level}) for level in np.linspace(start, stop, steps)]
+
+
+def pulse_train(count, high, low, width, period, terminal = 'gate'):
+    '''
+    count pulses to high lasting width [sec], one every period [sec], at low in between.
+    terminal -- 'gate' or 'drain'
+    '''
+    if width > period:
+        raise ValueError('Pulse width {} is longer than the period {}'.format(width, period))
+    return [Segment(width, **{terminal: high}), Segment(period - width, **{terminal: low})] * count
+
+
+def load_table(filename):
+    '''
+    Read a waveform from a text file, one segment per line:
+    duration [sec], gate level, drain level and optionally the gate mode (VOLT or CURR),
+    separated by tabs or spaces. '-' keeps the level or mode of the line before; '#' starts a comment.
+    '''
+    segments = []
+    with open(filename) as f:
+        for n, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) not in (3, 4):
+                raise ValueError('{} line {}: expected duration, gate, drain [, gate mode]'.format(filename, n))
+            values = [None if v == '-' else float(v) for v in fields[:3]]
+            gate_mode = fields[3].upper() if len(fields) == 4 and fields[3] != '-' else None
+            segments.append(Segment(values[0], values[1], values[2], gate_mode))
+    return segments
+
+
+def schedule(segments, gate = 0., drain = 0., gate_mode = 'VOLT'):
+    '''
+    Offsets [sec] at which the levels change, starting from gate, drain and gate_mode.
+    Returns (events, duration [sec]), where events is a list of (offset, gate, drain, gate_mode) with all
+    levels filled in. The first event is at 0; later ones only where something changes.
+    '''
+    events = [(0., gate, drain, gate_mode)]
+    t = 0.
+    for segment in segments:
+        gate = gate if segment.gate is None else segment.gate
+        drain = drain if segment.drain is None else segment.drain
+        gate_mode = gate_mode if segment.gate_mode is None else segment.gate_mode
+        if (gate, drain, gate_mode) != events[-1][1:]:
+            if events[-1][0] == t:
+                events[-1] = (t, gate, drain, gate_mode)
+            else:
+                events.append((t, gate, drain, gate_mode))
+        t += segment.duration
+    return events, t
+
+
+def run_schedule(events, duration, apply, sample, interrupted = lambda: False):
+    '''
+    Run events from schedule(): apply(event) once at each event's deadline, and sample(event) with the
+    event in force as often as possible in between. Deadlines are offsets from the start on the
+    perf_counter clock, so a late sample never pushes the later changes back. When the next change is due
+    before another sample could finish, judging by the recent sample times, waits for it instead.
+    Stops after duration [sec] or once interrupted() returns True.
+    Returns the lateness [sec] of every change.
+    '''
+    t0 = time.perf_counter()
+    sample_time = 0.
+    lateness = []
+    k = 0
+    while not interrupted():
+        now = time.perf_counter() - t0
+        if k < len(events) and events[k][0] <= now:
+            apply(events[k])
+            lateness.append(now - events[k][0])
+            k += 1
+            continue
+        deadline = events[k][0] if k < len(events) else duration
+        if now >= duration:
+            break
+        if now + sample_time > deadline:
+            time.sleep(max(deadline - (time.perf_counter() - t0), 0))
+            continue
+        t_sample = time.perf_counter()
+        sample(events[k - 1])
+        sample_time = max(time.perf_counter() - t_sample, .9 * sample_time)
+    return lateness
@@ -0,0 +1,79 @@
+'''
+Progress of a measurement sequence, kept on disk so an interrupted sequence can be resumed.
+'''
+import json
+import os
+
+
+class Checkpoint(object):
+    '''
+    Completed curves and the points measured so far of the curve in progress.
+    The JSON file is rewritten after every change, replacing the old one only once the new one is complete.
+    '''
+
+    def __init__(self, filename, **sequence):
+        '''
+        sequence -- what is needed to run the same sequence again (pixel, number of curves, biases, ...)
+        '''
+        self.filename = filename
+        self.sequence = sequence
+        self.completed = [] # names of the finished curves
+        self.curve = None # curve in progress: name, voltages, constant bias and measured rows
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            state = json.load(f)
+        checkpoint = cls(filename, **state['sequence'])
+        checkpoint.completed = state['completed']
+        checkpoint.curve = state['curve']
+        return checkpoint
+
+    def save(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'sequence': self.sequence, 'completed': self.completed, 'curve': self.curve}, f)
+        os.replace(tmp, self.filename)
+
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def partial_rows(self, name, voltages, v_constant):
+        '''
+        Rows measured before an interruption of curve name, if it was sweeping the same voltages at the same
+        constant bias. Otherwise an empty list.
+        '''
+        curve = self.curve
+        if curve is None or curve['name'] != name or curve['v_constant'] != float(v_constant) or \
+                curve['voltages'] != [float(v) for v in voltages]:
+            return []
+        return curve['rows']
+
+    def start_curve(self, name, voltages, v_constant, rows = ()):
+        '''
+        Begin curve name, sweeping voltages at constant bias v_constant, with rows already measured.
+        '''
+        self.curve = {'name': name, 'voltages': [float(v) for v in voltages], 'v_constant': float(v_constant),
+                      'rows': [list(r) for r in rows]}
+        self.save()
+
+    def add_point(self, row, values):
+        '''
+        Record the values saved in row of the curve in progress.
+        '''
+        self.add_points(row, [values])
+
+    def add_points(self, row, values):
+        '''
+        Record rows of values saved from row on (e.g. a segment of a hardware sweep), with one write of the file.
+        '''
+        rows = self.curve['rows']
+        del rows[row:]
+        rows.extend([float(v) for v in r] for r in values)
+        self.save()
+
+    def end_curve(self):
+        self.completed.append(self.curve['name'])
+        self.curve = None
+        self.save()
@@ -0,0 +1,203 @@
+'''
+Growable table of measured rows with bounded memory.
+
+Rows go into fixed size blocks. Once the completed blocks held in memory pass a cap, the oldest ones are
+written to .npy files and read back memory mapped when needed, so a run of any length keeps memory flat.
+'''
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+
+def load_block(block):
+    '''
+    A block in memory, or the memory mapped file of a spilled one.
+    '''
+    return np.load(block, mmap_mode = 'r') if isinstance(block, str) else block
+
+
+class ChunkedStore(object):
+    '''
+    Float table with a fixed number of columns, appended to by one thread and read by any.
+    '''
+
+    def __init__(self, n_columns, block_rows = 4096, memory_cap = 256e6, directory = None):
+        '''
+        block_rows -- rows per block
+        memory_cap [bytes]: completed blocks beyond this are spilled to disk (the block being filled always stays)
+        directory -- where the spill directory is created, None for the system temp directory
+        '''
+        self.n_columns = n_columns
+        self.block_rows = block_rows
+        self.memory_blocks = max(int(memory_cap // (block_rows * n_columns * 8)), 1)
+        self.directory = directory
+        self.spill_dir = None
+        self.blocks = [] # completed blocks, arrays in memory or names of spilled files
+        self.in_memory = 0
+        self.block = np.empty((block_rows, n_columns))
+        self.fill = 0
+        self.rows = 0
+        self.frozen = False
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, row):
+        '''
+        Add one row, a sequence of n_columns values.
+        '''
+        with self.lock:
+            self.check_frozen()
+            self.block[self.fill] = row
+            self.fill += 1
+            self.rows += 1
+            if self.fill == self.block_rows:
+                self.complete_block()
+
+    def extend(self, rows):
+        '''
+        Add a 2D array of rows.
+        '''
+        rows = np.asarray(rows, dtype = float).reshape(-1, self.n_columns)
+        with self.lock:
+            self.check_frozen()
+            start = 0
+            while start < rows.shape[0]:
+                n = min(self.block_rows - self.fill, rows.shape[0] - start)
+                self.block[self.fill:self.fill + n] = rows[start:start + n]
+                self.fill += n
+                self.rows += n
+                start += n
+                if self.fill == self.block_rows:
+                    self.complete_block()
+
+    def freeze(self):
+        '''
+        Refuse any further rows, e.g. once the store is handed to the writer thread to be saved.
+        '''
+        with self.lock:
+            self.frozen = True
+
+    def check_frozen(self):
+        if self.frozen:
+            raise ValueError('Rows added to a frozen store')
+
+    def complete_block(self):
+        self.blocks.append(self.block)
+        self.in_memory += 1
+        self.block = np.empty((self.block_rows, self.n_columns))
+        self.fill = 0
+        if self.in_memory > self.memory_blocks:
+            self.spill()
+
+    def spill(self):
+        '''
+        Write the oldest block still in memory to disk.
+        '''
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix = 'chunked_store_', dir = self.directory)
+        i = self.in_memory_index()
+        filename = os.path.join(self.spill_dir, 'block_%06d.npy' % i)
+        np.save(filename, self.blocks[i])
+        self.blocks[i] = filename
+        self.in_memory -= 1
+
+    def in_memory_index(self):
+        for i, block in enumerate(self.blocks):
+            if not isinstance(block, str):
+                return i
+
+    def pieces(self):
+        '''
+        The blocks holding all rows so far, in order, spilled ones memory mapped.
+        '''
+        with self.lock:
+            blocks = list(self.blocks)
+            partial = self.block[:self.fill].copy()
+        return [load_block(b) for b in blocks] + [partial]
+
+    def array(self, columns = None):
+        '''
+        Contiguous copy of all rows, or of the given column indices only.
+        '''
+        pieces = self.pieces()
+        if columns is not None:
+            pieces = [p[:, columns] for p in pieces]
+        return np.concatenate(pieces)
+
+    def between(self, column, lo, hi, rows = None):
+        '''
+        Rows whose value in column (increasing down the table) is within lo..hi, with one more row on each side
+        so a line drawn through them reaches the edges. Only the first rows rows are considered, all if None.
+        The first block in the range is found by bisection, blocks outside the range are not read.
+        '''
+        with self.lock:
+            pieces = list(self.blocks) + [self.block[:self.fill].copy()]
+        if rows == 0:
+            return np.empty((0, self.n_columns))
+        if rows is not None:
+            pieces = pieces[:-(-rows // self.block_rows)]
+            pieces[-1] = load_block(pieces[-1])[:rows - (len(pieces) - 1) * self.block_rows]
+        # first piece whose last value reaches lo, the last piece if none
+        first, last = 0, len(pieces) - 1
+        while first < last:
+            middle = (first + last) // 2
+            piece = load_block(pieces[middle])
+            if piece.shape[0] and piece[-1, column] >= lo:
+                last = middle
+            else:
+                first = middle + 1
+        selected = []
+        for i in range(first, len(pieces)):
+            piece = load_block(pieces[i])
+            start = np.searchsorted(piece[:, column], lo)
+            stop = np.searchsorted(piece[:, column], hi, side = 'right')
+            if i == first and start == 0 and first > 0:
+                selected.append(load_block(pieces[first - 1])[-1:]) # row before the range
+            selected.append(piece[max(start - 1, 0):stop + 1])
+            if stop < piece.shape[0]:
+                break
+        selected = [s for s in selected if s.shape[0]]
+        if not selected:
+            return np.empty((0, self.n_columns))
+        return np.concatenate(selected)
+
+    def last(self):
+        '''
+        The last row, None if there is none.
+        '''
+        with self.lock:
+            if self.fill:
+                return self.block[self.fill - 1].copy()
+            if self.blocks:
+                return np.array(load_block(self.blocks[-1])[-1])
+        return None
+
+    def savetxt(self, filename, fmt = '%.10f', delimiter = '\t', header = '', footer = '', comments = ''):
+        '''
+        Write all rows as text like numpy.savetxt, one block at a time.
+        '''
+        pieces = self.pieces()
+        with open(filename, 'w') as f:
+            if header:
+                f.write(comments + header.replace('\n', '\n' + comments) + '\n')
+            for piece in pieces:
+                np.savetxt(f, piece, fmt = fmt, delimiter = delimiter)
+            if footer:
+                f.write(comments + footer.replace('\n', '\n' + comments) + '\n')
+
+    def close(self):
+        '''
+        Delete the spilled blocks. The store is empty afterwards.
+        '''
+        with self.lock:
+            if self.spill_dir is not None:
+                shutil.rmtree(self.spill_dir, ignore_errors = True)
+                self.spill_dir = None
+            self.blocks = []
+            self.in_memory = 0
+            self.fill = 0
+            self.rows = 0
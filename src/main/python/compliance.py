@@ -0,0 +1,66 @@
+'''
+What to do when a sourcemeter reading hits its compliance limit or is over range.
+
+The keithleys return a status word with every reading when status reporting is on (see
+Keithley2400SourceMeter.write_status_reporting). A ComplianceGuard checks the status words of each point
+against the policy of the measurement:
+off -- no status is read
+warn -- print the first problem of the curve, keep measuring
+skip sweep -- stop the sweep (or acquisition) after the point, keeping what was measured
+abort -- raise ComplianceError: the keithleys are turned off, and a TestDevice batch moves on to the next pixel
+'''
+import numpy as np
+from keithley2400_sourcemeter_interface import Keithley2400SourceMeter
+
+POLICIES = ('off', 'warn', 'skip sweep', 'abort')
+
+
+class ComplianceError(RuntimeError):
+    pass
+
+
+def status_problems(name, status):
+    '''
+    Problems in status, status words of readings of the device called name, e.g. ['DS in compliance'].
+    '''
+    status = np.bitwise_or.reduce(np.atleast_1d(status).astype(int), initial = 0)
+    problems = []
+    if status & Keithley2400SourceMeter.STATUS_COMPLIANCE:
+        problems.append('%s in compliance' % name)
+    if status & Keithley2400SourceMeter.STATUS_OVERFLOW:
+        problems.append('%s over range' % name)
+    return problems
+
+
+class ComplianceGuard(object):
+    '''
+    Applies a policy of POLICIES to the status words of the points of one curve or acquisition.
+    '''
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.tripped = False # a point failed under 'skip sweep', the rest of the sweep is skipped
+        self.warned = False
+
+    def check(self, where, **statuses):
+        '''
+        Apply the policy to statuses, status words of the readings of each device at where (e.g. 'V_G = 0.4 V').
+        Status words of devices not read may be None.
+        '''
+        if self.policy == 'off':
+            return
+        problems = []
+        for name, status in sorted(statuses.items()):
+            if status is not None:
+                problems += status_problems(name, status)
+        if not problems:
+            return
+        message = '%s at %s' % (', '.join(problems), where)
+        if self.policy == 'abort':
+            raise ComplianceError(message)
+        if self.policy == 'skip sweep':
+            self.tripped = True
+            print('Compliance:', message, '- skipping the rest')
+        elif not self.warned:
+            print('Compliance:', message)
+        self.warned = True
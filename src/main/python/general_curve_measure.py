@@ -6,7 +6,17 @@ from PyQt5 import *
 import numpy as np
 import time
 import os.path
-from relay_ft245r import FT245R
+from relay_ft245r import FT245R, relay_mask
+from averaging import sample_std, average_until
+from keithley2400_sourcemeter_hc import read_synchronized
+from instrument_executor import InstrumentExecutor
+from io_stats import IOStats
+from settling import wait_settled
+from sweep_grid import refine_points
+from h5_sink import H5Sink
+from save_service import SaveService, snapshot, write_text
+from live_plot import LiveCurve, PlotFeed
+from compliance import POLICIES, ComplianceGuard, ComplianceError
 
 class GeneralCurveMeasure(Measurement):
     #class variables determining vhich device's voltage will go through a sweep and which will be constant
@@ -17,6 +27,9 @@ class GeneralCurveMeasure(Measurement):
     #class variable determining numbering of measurement output file. useful in auto_measure for multiple outputs and transfers 
     READ_NUMBER = 0
 
+    h5 = None # H5Sink of the running measurement, if saving to HDF5
+    checkpoint = None # Checkpoint recording each point, see TestDeviceMeasure
+
     def setup(self):
         """
         Runs once during App initialization.
@@ -42,6 +55,10 @@ class GeneralCurveMeasure(Measurement):
         self.settings.New('dimension', str, choices = self.dimension_choice.keys(), initial = '4000 x 10')
         self.settings.New('thickness', unit = "nm", initial = 50)
         self.settings.New('num_cycles', int, initial=1)
+        self.settings.New('io_stats', bool, initial = False)
+        self.settings.New('save_h5', bool, initial = True)
+        self.settings.New('save_txt', bool, initial = True)
+        self.saver = SaveService() # text files are written off the acquisition thread
         
         self.ui.setRelaysGenCurveButton.clicked.connect(self.set_relay)
         self.ui.resetRelaysGenCurveButton.clicked.connect(self.reset_relay)
@@ -56,12 +73,15 @@ class GeneralCurveMeasure(Measurement):
 
         self.setup_relay()
 
-    def setup_relay(self):
-        
+    def setup_relay(self, usb_core = None):
+        '''
+        Connect the drain and source relay boards.
+        usb_core -- passed to FT245R, e.g. relay_ft245r_sim.SimulatedUSB() to run without the boards
+        '''
         # Connect the relay
         try:
-            self.relay_d = FT245R()
-            self.relay_s = FT245R()
+            self.relay_d = FT245R(usb_core)
+            self.relay_s = FT245R(usb_core)
             drain = self.relay_d.list_dev()[0]
             source = self.relay_s.list_dev()[1]
             
@@ -77,29 +97,23 @@ class GeneralCurveMeasure(Measurement):
     def set_relay(self):
         """Mostly a copy of the Test_device_measure function to set the relays
         You should set them manually if you want to be sure"""
-        _dimension = self.pixels[self.settings['dimension']]
-        print(_dimension)
-        for k, v in self.pixels.items():
-            if k == _dimension:
-                self.relay_d.switchon(v)
-                self.relay_s.switchon(v)
-            else:
-                self.relay_d.switchoff(v)
-                self.relay_s.switchoff(v)
-        
+        if self.relay_exists:
+            _relay = self.pixels[self.settings['dimension']]
+            self.switch_relays([_relay], [_relay])
 
     def reset_relay(self):
         """Sets the relays to all be off"""
-        
-        
-        for k, v in self.pixels.items():
-            
-            self.relay_d.switchoff(v)
-            self.relay_s.switchoff(v)
-            
-        # To error check for EIS relay accidentally open
-        self.relay_d.switchoff(1)
-        self.relay_s.switchoff(1)
+        # Relay 1 is off too, to error check for EIS relay accidentally open
+        if self.relay_exists:
+            self.switch_relays([], [])
+
+    def switch_relays(self, drain_relays, source_relays):
+        '''
+        Switch the drain and source boards so that only the relays numbered in drain_relays and source_relays are on.
+        Each board is written in one USB transfer, and only if its relays change.
+        '''
+        self.relay_d.setmask(relay_mask(drain_relays))
+        self.relay_s.setmask(relay_mask(source_relays))
 
     def create_settings(self):
                 # Measurement Specific Settings
@@ -115,6 +129,26 @@ class GeneralCurveMeasure(Measurement):
         self.settings.New('%s_sweep_first_bias_settle' % self.SWEEP, unit = 'ms', si = True, initial = 2000)
         
         self.settings.New('%s_sweep_return_sweep' % self.SWEEP, bool, initial = True)
+        self.settings.New('%s_sweep_hardware_sweep' % self.SWEEP, bool, initial = False)
+        self.settings.New('%s_sweep_averaging' % self.SWEEP, str, choices = ('burst', 'filter', 'software', 'adaptive'), initial = 'burst')
+        # adaptive averaging: stop once the standard error of I_DS is within either target
+        self.settings.New('%s_sweep_target_rel_error' % self.SWEEP, initial = 0.001, spinbox_decimals = 4, spinbox_step = 0.001)
+        self.settings.New('%s_sweep_target_abs_error' % self.SWEEP, unit = 'A', si = True, initial = 1e-11)
+        self.settings.New('%s_sweep_min_averages' % self.SWEEP, int, initial = 2, vmin = 2)
+        self.settings.New('%s_sweep_max_averages' % self.SWEEP, int, initial = 20, vmin = 2)
+        self.settings.New('%s_sweep_synchronized' % self.SWEEP, bool, initial = False)
+        # adaptive settle: preread_delay becomes the longest wait, see settling.wait_settled
+        self.settings.New('%s_sweep_adaptive_settle' % self.SWEEP, bool, initial = False)
+        self.settings.New('%s_sweep_settle_tolerance' % self.SWEEP, initial = 0.005, spinbox_decimals = 4, spinbox_step = 0.001)
+        self.settings.New('%s_sweep_settle_abs_tolerance' % self.SWEEP, unit = 'A', si = True, initial = 1e-9)
+        self.settings.New('%s_sweep_settle_interval' % self.SWEEP, unit = 'ms', si = True, initial = 100)
+        # adaptive grid: bisect the steep and curved intervals of the coarse sweep, see sweep_grid.refine_points
+        self.settings.New('%s_sweep_adaptive_grid' % self.SWEEP, bool, initial = False)
+        self.settings.New('%s_sweep_refine_threshold' % self.SWEEP, initial = 0.1, spinbox_decimals = 3, spinbox_step = 0.01)
+        self.settings.New('%s_sweep_refine_levels' % self.SWEEP, int, initial = 2, vmin = 1)
+        self.settings.New('%s_sweep_refine_floor' % self.SWEEP, unit = 'A', si = True, initial = 1e-9)
+        # what to do when a reading hits compliance or is over range, see compliance.ComplianceGuard
+        self.settings.New('%s_sweep_compliance_policy' % self.SWEEP, str, choices = POLICIES, initial = 'warn')
         self.settings.New('V_%s' % self.CONSTANT, unit = 'V', si = True, initial = -0.6, spinbox_decimals = 3, spinbox_step=0.025)
 
         # Define how often to update display during a run
@@ -193,20 +227,39 @@ class GeneralCurveMeasure(Measurement):
         self.ds_plot = self.ds_graph_layout.addPlot(title='Keithley 2400 2')
         self.ds_plot.setLabel('bottom', 'V_%s' % self.SWEEP)
         self.ds_plot.setLabel('left', 'I_DS')
+        self.setup_live_curves()
         
-    def update_display(self):
-        if hasattr(self, 'ds_reading') and hasattr(self, 'g_reading'):
-            
-            if self.doing_return_sweep: #plot only return sweep data
-                self.g_plot.plot(self.voltages[:], self.save_array[:, 1], pen = 'b', clear = True)
-                self.ds_plot.plot(self.voltages[:], self.save_array[:, 3], pen = 'r', clear = True)
-#                self.g_plot.plot(self.voltages[:self.num_steps], self.save_array[:self.num_steps, 1], pen = 'r', clear = False)
-#                self.ds_plot.plot(self.voltages[:self.num_steps], self.save_array[:self.num_steps, 3], pen = 'b', clear = False)
+    def setup_live_curves(self):
+        '''
+        Persistent curves of g_plot and ds_plot, fed from the acquisition thread through self.feed.
+        '''
+        self.feed = PlotFeed()
+        self.shown_version = 0
+        self.g_curve = LiveCurve(self.g_plot, 'r')
+        self.ds_curve = LiveCurve(self.ds_plot, 'b')
 
-            else: #plot only initial sweep
-                self.g_plot.plot(self.voltages[:self.num_steps], self.save_array[:self.num_steps, 1], pen = 'r', clear = True)
-                self.ds_plot.plot(self.voltages[:self.num_steps], self.save_array[:self.num_steps, 3], pen = 'b', clear = True)
-            pg.QtGui.QApplication.processEvents()
+    def update_display(self):
+        version, rows = self.feed.take()
+        if version != self.shown_version: # a new curve
+            self.shown_version = version
+            self.g_curve.clear()
+            self.ds_curve.clear()
+        if rows is None:
+            return # nothing measured since the last redraw
+        g_pen, ds_pen = ('b', 'r') if self.doing_return_sweep else ('r', 'b')
+        # the rows of each run of consecutive row numbers go where they sit in save_array, as points are measured
+        # in row order except the refined points of an adaptive sweep, which are inserted between measured ones
+        for run in np.split(rows, np.flatnonzero(np.diff(rows[:, 0]) != 1) + 1):
+            index = int(run[0, 0])
+            self.g_curve.extend(run[:, 1], run[:, 2], index, g_pen)
+            self.ds_curve.extend(run[:, 1], run[:, 3], index, ds_pen)
+
+    def push_rows(self, start, stop):
+        '''
+        Hand the rows start..stop-1 just measured (row number, V, I_G, I_DS) to update_display.
+        '''
+        rows = self.save_array[start:stop][:, (0, 1, 3)]
+        self.feed.push(np.column_stack((np.arange(start, stop), rows)))
 
     def read_settings(self):
         '''
@@ -233,6 +286,28 @@ class GeneralCurveMeasure(Measurement):
         self.thickness = self.settings['thickness']
         self.num_cycles = self.settings['num_cycles']
         self.is_test_wrapper = False # checks if test GUI calling this or not
+        self.read_sweep_options()
+
+    def read_sweep_options(self):
+        '''
+        Pull values of the sweep settings that have no widget in the ui files.
+        '''
+        self.hardware_sweep = self.settings['%s_sweep_hardware_sweep' % self.SWEEP]
+        self.averaging = self.settings['%s_sweep_averaging' % self.SWEEP]
+        self.synchronized = self.settings['%s_sweep_synchronized' % self.SWEEP]
+        self.adaptive_settle = self.settings['%s_sweep_adaptive_settle' % self.SWEEP] and not self.hardware_sweep
+        self.settle_tolerance = self.settings['%s_sweep_settle_tolerance' % self.SWEEP]
+        self.settle_abs_tolerance = self.settings['%s_sweep_settle_abs_tolerance' % self.SWEEP]
+        self.settle_interval = self.settings['%s_sweep_settle_interval' % self.SWEEP]
+        self.target_rel_error = self.settings['%s_sweep_target_rel_error' % self.SWEEP]
+        self.target_abs_error = self.settings['%s_sweep_target_abs_error' % self.SWEEP]
+        self.min_averages = self.settings['%s_sweep_min_averages' % self.SWEEP]
+        self.max_averages = self.settings['%s_sweep_max_averages' % self.SWEEP]
+        self.adaptive_grid = self.settings['%s_sweep_adaptive_grid' % self.SWEEP] and not self.hardware_sweep
+        self.refine_threshold = self.settings['%s_sweep_refine_threshold' % self.SWEEP]
+        self.refine_levels = self.settings['%s_sweep_refine_levels' % self.SWEEP]
+        self.refine_floor = self.settings['%s_sweep_refine_floor' % self.SWEEP]
+        self.compliance_policy = self.settings['%s_sweep_compliance_policy' % self.SWEEP]
     
     def pre_run(self):
         self.check_filename(".txt")
@@ -244,9 +319,13 @@ class GeneralCurveMeasure(Measurement):
         #to device by which terminals it corresponds to - makes things easier for measurement and saving
         self.g_device = self.g_hw.keithley
         self.ds_device = self.ds_hw.keithley
-        self.g_device.reset()
-        self.ds_device.reset()
+
+        #commands to the two keithleys run concurrently, each on its own thread
+        if hasattr(self, 'io'): self.io.shutdown()
+        self.io = InstrumentExecutor((self.g_device, self.ds_device))
+        self.start_io_stats()
         self.read_settings()
+        if not self.is_test_wrapper: self.open_h5('_%s_curve.h5' % ('output' if self.SWEEP == 'DS' else 'transfer'))
 
         # Check the relay
 #        if TestDeviceMeasure.relay_exists and self.use_relay:
@@ -261,19 +340,6 @@ class GeneralCurveMeasure(Measurement):
 #            
 #            self.set_relay()
 
-
-        #configure keithleys
-        self.constant_device.write_current_compliance(self.constant_current_compliance)
-        self.sweep_device.write_autozero(self.sweep_autozero)
-        self.sweep_device.write_current_compliance(self.sweep_current_compliance)
-        if not self.sweep_autorange:
-            self.sweep_device.measure_current(nplc = self.sweep_nplc, current = self.sweep_manual_range, auto_range = False)
-            # self.constant_device.measure_current(nplc = self.sweep_nplc, current = self.sweep_manual_range, auto_range = False)
-            self.constant_device.measure_current()
-        else:
-            self.sweep_device.measure_current(nplc = self.sweep_nplc)
-            # self.constant_device.measure_current(nplc = self.sweep_nplc)
-            self.constant_device.measure_current()
         
         self.num_steps = np.abs(int(np.ceil(((self.v_sweep_finish - self.v_sweep_start)/self.v_sweep_step_size)))) + 1 #add 1 to account for start voltage
         
@@ -297,23 +363,89 @@ class GeneralCurveMeasure(Measurement):
             
             self.reverse_voltages  = np.flip(self.voltages)
             self.voltages = np.concatenate((self.voltages, self.reverse_voltages))
-            self.save_array = np.zeros(shape=(self.voltages.shape[0], 5))
-            
-        else:
-            self.save_array = np.zeros(shape=(self.voltages.shape[0], 5))
-            
+
+        self.save_columns = ['V_%s' % self.SWEEP, 'I_G (A)', 'I_G Error (A)', 'I_DS (A)', 'I_DS Error (A)']
+        if self.adaptive_settle:
+            self.save_columns.append('Settle Time (s)')
+        if self.averaging == 'adaptive' and not self.hardware_sweep:
+            self.save_columns.append('Samples')
+        if self.adaptive_grid:
+            self.save_columns.append('Refined')
+        if self.compliance_policy != 'off':
+            self.save_columns += ['G Status', 'DS Status'] # status words, see Keithley2400SourceMeter.STATUS_*
+        self.compliance = ComplianceGuard(self.compliance_policy)
+        self.coarse_voltages = self.voltages
+        self.save_array = np.zeros(shape=(self.voltages.shape[0], len(self.save_columns)))
         self.save_array[:,0] = self.voltages
-        #prepare hardware for read
-        self.sweep_device.write_output_on()
-        self.constant_device.write_output_on()
+        #configure keithleys and prepare hardware for read, one program message per keithley
         self.source_voltage = self.v_sweep_start
-        self.sweep_device.source_V(self.source_voltage)
-        self.constant_device.source_V(self.v_constant)
+        for device in (self.g_device, self.ds_device):
+            device.write_status_reporting(self.compliance_policy != 'off')
+        self.io.gather((self.sweep_device, self.prepare_sweep_device),
+                       (self.constant_device, self.prepare_constant_device))
         
         time.sleep(self.first_bias_settle * .001)
         self.doing_return_sweep = False
+        self.first_row = 0 # rows before this were measured before an interruption
+        self.feed.clear()
         
 
+    def start_io_stats(self):
+        '''
+        Record the bus transactions of both keithleys into a fresh IOStats if the io_stats setting is on.
+        '''
+        self.io_stats = IOStats() if self.settings['io_stats'] else None
+        self.g_device.io_stats = self.ds_device.io_stats = self.io_stats
+
+    def prepare_sweep_device(self):
+        '''
+        Reset and configure the sweep keithley, then bias it at the sweep start.
+        '''
+        with self.sweep_device.batch():
+            self.sweep_device.reset()
+            self.configure_sweep_device()
+            self.sweep_device.write_output_on()
+            self.sweep_device.source_V(self.source_voltage)
+
+    def prepare_constant_device(self):
+        '''
+        Reset and configure the constant keithley, then bias it.
+        '''
+        with self.constant_device.batch():
+            self.constant_device.reset()
+            self.configure_constant_device()
+            self.constant_device.write_output_on()
+            self.constant_device.source_V(self.v_constant)
+
+    def configure_sweep_device(self):
+        '''
+        Compliance, range, integration and filter of the sweep keithley.
+        '''
+        self.sweep_device.write_preranging(self.sweep_hw.settings['preranging'])
+        self.sweep_device.write_autozero(self.sweep_autozero)
+        self.sweep_device.write_current_compliance(self.sweep_current_compliance)
+        if not self.sweep_autorange:
+            self.sweep_device.measure_current(nplc = self.sweep_nplc, current = self.sweep_manual_range, auto_range = False)
+        else:
+            self.sweep_device.measure_current(nplc = self.sweep_nplc)
+        self.sweep_device.write_filter(self.filter_count())
+
+    def configure_constant_device(self):
+        '''
+        Compliance, range, integration and filter of the constant keithley.
+        '''
+        self.constant_device.write_preranging(self.constant_hw.settings['preranging'])
+        self.constant_device.write_current_compliance(self.constant_current_compliance)
+        # self.constant_device.measure_current(nplc = self.sweep_nplc, current = self.sweep_manual_range, auto_range = False)
+        self.constant_device.measure_current()
+        self.constant_device.write_filter(self.filter_count())
+
+    def filter_count(self):
+        '''
+        With the filter the instrument averages, otherwise each returned reading is one conversion.
+        '''
+        return int(self.software_averages) if self.averaging == 'filter' else 1
+
     def run(self):
         """
         Runs when measurement is started. Runs in a separate thread from GUI.
@@ -321,29 +453,51 @@ class GeneralCurveMeasure(Measurement):
         focus on data acquisition.
 
         Runs until measurement is interrupted. Data is continuously saved if checkbox checked.
+        If the sweep fails (e.g. ComplianceError under the abort policy) both keithleys are turned off and reset
+        before the error is raised again. post_run, which ScopeFoundry calls once run returns either way, then
+        still saves the points so far; TestDeviceMeasure.run_curve() does the same for the curves of a sequence.
         """
 
         self.finished = False # flag for post-run
-        
-        if self.is_test_wrapper:
-            # Avoids the cycles parameter
-            self.do_sweep()
-            if self.return_sweep: 
-                self.doing_return_sweep = True
-
-        else:
-            self.num_cycles = self.settings['num_cycles']        
-            
-            for cycle in range(self.num_cycles):
+        try:
+            if self.is_test_wrapper:
+                # Avoids the cycles parameter
                 self.do_sweep()
                 if self.return_sweep: 
                     self.doing_return_sweep = True
-                if cycle < self.num_cycles-1: # avoid duplicate final run
-                    self.post_run()
-                self.READ_NUMBER += 1
-            self.READ_NUMBER -= 1 
-            
-        self.finished = True
+
+            else:
+                self.num_cycles = self.settings['num_cycles']        
+                
+                for cycle in range(self.num_cycles):
+                    if cycle: self.feed.clear() # every cycle draws a new curve
+                    self.do_sweep()
+                    if self.return_sweep: 
+                        self.doing_return_sweep = True
+                    if self.compliance.tripped: # skip the remaining cycles too, this curve is saved by post_run
+                        break
+                    if cycle < self.num_cycles-1: # avoid duplicate final run
+                        self.post_run()
+                    self.READ_NUMBER += 1
+                else:
+                    self.READ_NUMBER -= 1 
+        except Exception as err:
+            if isinstance(err, ComplianceError): print('Compliance abort:', err)
+            self.stop_devices()
+            raise
+        finally:
+            self.finished = True
+
+    def stop_devices(self):
+        '''
+        Turn the outputs of both keithleys off and reset them, leaving no device biased after a failed sweep.
+        '''
+        for device in (self.g_device, self.ds_device):
+            try:
+                device.write_output_on(False)
+                device.reset()
+            except Exception as err:
+                print('Could not turn off', device.port, err)
 
     def do_sweep(self):
         '''
@@ -352,40 +506,246 @@ class GeneralCurveMeasure(Measurement):
         num_steps = self.num_steps
         if self.doing_return_sweep: 
             num_steps -= 1
+        self.start_h5_table()
+
+        if self.hardware_sweep:
+            self.do_hardware_sweep()
+            return
+
+        if self.adaptive_grid:
+            self.do_adaptive_sweep()
+            return
 
         for i, v in enumerate(self.voltages):
+            if i < self.first_row:
+                continue
             
-            self.sweep_device.source_V(v)
-            time.sleep(self.preread_delay * .001)
-            current_readings = self.read_currents()
-            self.g_reading = current_readings[0]
-            g_std = current_readings[1]
-            self.ds_reading = current_readings[2]
-            ds_std = current_readings[3]
             save_row = i
             #if self.doing_return_sweep: 
             #    save_row += self.num_steps #to ensure the right row is overwritten in return sweep 
-            self.save_array[save_row, 1] = self.g_reading
-            self.save_array[save_row, 2] = g_std
-            self.save_array[save_row, 3] = self.ds_reading
-            self.save_array[save_row, 4] = ds_std
-            if self.interrupt_measurement_called:
+            self.measure_point(save_row, v)
+            if self.checkpoint is not None: self.checkpoint.add_point(save_row, self.save_array[save_row])
+            if self.interrupt_measurement_called or self.compliance.tripped:
                 break
 
+    def do_adaptive_sweep(self):
+        '''
+        Perform sweep on the coarse grid, then measure the midpoints refine_points() picks, up to refine_levels times.
+        The forward sweep is refined right after its coarse pass, then the return sweep after its own, each in sweep order.
+        Added points are inserted into save_array so each sweep stays sorted, and are flagged in the 'Refined' column.
+        Row numbers shift as points are inserted, so points are not checkpointed: when resuming, a curve left
+        unfinished is measured again from its start (finished curves are still skipped).
+        '''
+        self.save_array = np.zeros(shape=(self.coarse_voltages.shape[0], len(self.save_columns)))
+        self.save_array[:,0] = self.coarse_voltages
+        self.voltages = self.save_array[:,0]
+        n_forward = self.coarse_voltages.shape[0] // 2 if self.return_sweep else self.coarse_voltages.shape[0]
+        self.num_steps = n_forward
+
+        first = 0
+        for n in [n_forward, self.coarse_voltages.shape[0] - n_forward]:
+            if n == 0: break
+            for row in range(first, first + n):
+                self.measure_point(row, self.save_array[row, 0])
+                if self.interrupt_measurement_called or self.compliance.tripped:
+                    return
+            for level in range(self.refine_levels):
+                new_voltages = refine_points(self.save_array[first:first + n, 0], self.save_array[first:first + n, 3],
+                                             self.refine_threshold, self.refine_floor)
+                for v in new_voltages:
+                    row = self.insert_row(first, first + n, v)
+                    n += 1
+                    if first == 0: self.num_steps += 1
+                    self.measure_point(row, v)
+                    if self.interrupt_measurement_called or self.compliance.tripped:
+                        return
+                if len(new_voltages) == 0:
+                    break
+            first += n
+
+    def insert_row(self, first, last, v):
+        '''
+        Insert a refined row for voltage v into rows first..last-1 (one sweep direction), keeping them sorted
+        in sweep order. Returns the index of the new row.
+        '''
+        direction = np.sign(self.save_array[last - 1, 0] - self.save_array[first, 0])
+        row = first + int(np.searchsorted(direction * self.save_array[first:last, 0], direction * v))
+        values = np.zeros(len(self.save_columns))
+        values[0] = v
+        values[self.save_columns.index('Refined')] = 1
+        self.save_array = np.insert(self.save_array, row, values, axis = 0)
+        self.voltages = self.save_array[:,0]
+        return row
+
+    def measure_point(self, row, v):
+        '''
+        Source v on the sweep device, wait for the device to settle and save the averaged readings in row.
+        With adaptive settle the drain current is sampled until it stops changing, for at most preread_delay,
+        and the time that took is saved too.
+        '''
+        self.sweep_device.source_V(v)
+        self.expect_currents(v)
+        if self.adaptive_settle:
+            settle_time, _ = wait_settled(self.ds_device.read_I, self.settle_tolerance, self.settle_abs_tolerance,
+                                          self.settle_interval * .001, self.preread_delay * .001)
+            self.save_array[row, self.save_columns.index('Settle Time (s)')] = settle_time
+        else:
+            time.sleep(self.preread_delay * .001)
+        for device in (self.g_device, self.ds_device):
+            device.clear_status()
+        current_readings = self.read_currents()
+        self.g_reading = current_readings[0]
+        g_std = current_readings[1]
+        self.ds_reading = current_readings[2]
+        ds_std = current_readings[3]
+        self.save_array[row, 1] = self.g_reading
+        self.save_array[row, 2] = g_std
+        self.save_array[row, 3] = self.ds_reading
+        self.save_array[row, 4] = ds_std
+        if 'Samples' in self.save_columns:
+            self.save_array[row, self.save_columns.index('Samples')] = self.samples_used
+        self.save_status(slice(row, row + 1), self.g_device.status_seen, self.ds_device.status_seen)
+        for hw, reading in ((self.g_hw, self.g_reading), (self.ds_hw, self.ds_reading)):
+            hw.range_profile(self.range_profile_key()).record(v, reading)
+        if self.h5 is not None: self.h5.append(self.curve_name(), self.save_array[row])
+        self.push_rows(row, row + 1)
+        self.compliance.check('V_%s = %g V' % (self.SWEEP, v), G = self.g_device.status_seen, DS = self.ds_device.status_seen)
+
+    def save_status(self, rows, g_status, ds_status):
+        '''
+        Save the status words of the readings of rows (a slice of save_array) when reporting status.
+        '''
+        if self.compliance_policy != 'off':
+            self.save_array[rows, self.save_columns.index('G Status')] = g_status
+            self.save_array[rows, self.save_columns.index('DS Status')] = ds_status
+
+    def pixel_name(self):
+        '''
+        Name of the pixel being measured.
+        '''
+        return self.settings['dimension']
+
+    def range_profile_key(self):
+        return (self.pixel_name(), self.SWEEP, round(self.v_constant, 6))
+
+    def expect_currents(self, v):
+        '''
+        Hint each preranging keithley with the current it read at v in earlier sweeps of this pixel.
+        '''
+        for hw in (self.g_hw, self.ds_hw):
+            if hw.keithley.preranging:
+                hw.keithley.expect_current(hw.range_profile(self.range_profile_key()).expected(v))
+
+    def do_hardware_sweep(self):
+        '''
+        Perform sweep with the instrument timing every point. The voltages are loaded into the sweep device,
+        the constant device takes the same number of readings with the same source delay, and all readings
+        come back in one query per device and segment.
+        When synchronized, the sweep device is the trigger link master and the constant device samples on its triggers.
+        One reading is taken per point, so the error columns are saved as NaN.
+        The compliance policy is applied to each segment once it is read, so a skipped sweep stops at a segment end.
+        A resumed sweep starts at first_row, and each segment is recorded in the checkpoint once it is read.
+        With preranging, the sweep device autoranges every point, as no fixed range follows the sweep. The constant
+        device is preranged before each segment, and a segment it reads out of range is swept again with autorange.
+        '''
+        delay = self.preread_delay * .001
+        row = self.first_row
+        if row >= len(self.voltages):
+            return
+        if self.sweep_device.preranging:
+            self.sweep_device.measure_current(**dict(self.sweep_device.current_config, auto_range = True))
+        for segment in self.sweep_device.sweep_segments(self.voltages[row:]):
+            if self.constant_device.preranging:
+                self.constant_device.prerange()
+                self.constant_device.measure_current(**self.constant_device.current_config)
+            while True:
+                n = self.write_hardware_segment(segment, delay)
+                self.constant_device.init()
+                self.sweep_device.init()
+
+                timeout = self.sweep_device.estimate_read_time(n, delay)
+                sweep_readings, constant_readings = self.io.gather((self.sweep_device.fetch_values, timeout, n),
+                                                                   (self.constant_device.fetch_values, timeout, n))
+                if not (self.constant_device.preranging and self.constant_device.out_of_range(constant_readings)):
+                    break
+                self.constant_device.fall_back_to_autorange()
+            if self.constant_device.preranging: self.constant_device.remember_currents(constant_readings)
+            if self.SWEEP == 'DS':
+                g_readings, ds_readings = constant_readings, sweep_readings
+            else:
+                g_readings, ds_readings = sweep_readings, constant_readings
+            g_status, ds_status = self.g_device.status, self.ds_device.status
+
+            self.save_array[row:row + n, 1] = g_readings
+            self.save_array[row:row + n, 2] = np.nan
+            self.save_array[row:row + n, 3] = ds_readings
+            self.save_array[row:row + n, 4] = np.nan
+            self.save_status(slice(row, row + n), g_status, ds_status)
+            if self.h5 is not None: self.h5.append(self.curve_name(), self.save_array[row:row + n])
+            if self.checkpoint is not None: self.checkpoint.add_points(row, self.save_array[row:row + n])
+            self.push_rows(row, row + n)
+            self.g_reading = g_readings[-1]
+            self.ds_reading = ds_readings[-1]
+            if self.io_stats is not None: self.io_stats.mark_point(n)
+            row += n
+            self.compliance.check('V_%s = %g..%g V' % (self.SWEEP, segment[0], segment[-1]), G = g_status, DS = ds_status)
+            if self.interrupt_measurement_called or self.compliance.tripped:
+                break
+
+        self.sweep_device.end_sweep()
+        self.constant_device.end_sweep()
+        self.sweep_device.source_V(self.voltages[row - 1])
+
+    def write_hardware_segment(self, segment, delay):
+        '''
+        Load segment into the sweep device and set the constant device up to read along. Returns the number of points.
+        '''
+        n = self.sweep_device.write_sweep(segment, source_delay = delay)
+        # the master pulses the trigger line ahead of its source delay, so the slave waits the same delay
+        self.constant_device.write_source_delay(delay)
+        self.constant_device.write_trigger_count(n)
+        if self.synchronized:
+            self.sweep_device.write_trigger_link('master', self.sweep_hw.settings['arm_line'], self.sweep_hw.settings['trigger_line'])
+            self.constant_device.write_trigger_link('slave', self.constant_hw.settings['arm_line'], self.constant_hw.settings['trigger_line'])
+        return n
+
     def read_currents(self):
         '''
         Read both sourcemeters, taking software averages.
+        synchronized: both instruments sample at the same instants over trigger link (one filtered reading with 'filter')
+        burst: both instruments take all averages off one trigger, spaced by a trigger delay
+        filter: one reading each, averaged by the instrument's digital filter (no error estimate)
+        software: one query per average with a host sleep in between
+        adaptive: as software, but only until the standard error of I_DS meets the target (never synchronized)
+        The number of readings per instrument is left in self.samples_used.
         '''
-        g_current_read = np.zeros(int(self.software_averages))
-        ds_current_read = np.zeros(int(self.software_averages))
-        for i in range(int(self.software_averages)):
-            g_current_read[i] = self.g_device.read_I()
-            ds_current_read[i] = self.ds_device.read_I()
-            time.sleep(self.delay_between_averages * .001)
+        n = int(self.software_averages)
+        delay = self.delay_between_averages * .001
+        if self.averaging == 'adaptive':
+            g_stats, ds_stats = average_until(lambda: self.io.each('read_I'), self.target_rel_error, self.target_abs_error,
+                                              self.min_averages, self.max_averages, delay, channel = 1)
+            self.samples_used = ds_stats.n
+            if self.io_stats is not None: self.io_stats.mark_point()
+            return [g_stats.mean, g_stats.std, ds_stats.mean, ds_stats.std]
+        if self.synchronized:
+            count = 1 if self.averaging == 'filter' else n
+            g_current_read, ds_current_read = read_synchronized(self.g_hw, self.ds_hw, count, delay, master = self.sweep_hw)
+        elif self.averaging == 'burst':
+            g_current_read, ds_current_read = self.io.each('read_burst', n, delay)
+        elif self.averaging == 'filter':
+            g_current_read, ds_current_read = [np.array([r]) for r in self.io.each('read_I')]
+        else:
+            g_current_read = np.zeros(n)
+            ds_current_read = np.zeros(n)
+            for i in range(n):
+                g_current_read[i], ds_current_read[i] = self.io.each('read_I')
+                time.sleep(delay)
+        if self.io_stats is not None: self.io_stats.mark_point()
+        self.samples_used = len(ds_current_read)
         g_current_avg = np.mean(g_current_read)
         ds_current_avg = np.mean(ds_current_read)
-        g_std = np.std(g_current_read, ddof = 1) #ddof - delta degrees of freedom. set to 1 for sample std
-        ds_std = np.std(ds_current_read, ddof = 1)
+        g_std = sample_std(g_current_read)
+        ds_std = sample_std(ds_current_read)
         return [g_current_avg, g_std, ds_current_avg, ds_std]
 
     def post_run(self):
@@ -396,11 +756,11 @@ class GeneralCurveMeasure(Measurement):
         
             self.g_device.reset()
             self.ds_device.reset()
+
+        for hw in (self.g_hw, self.ds_hw):
+            hw.settings['range_changes'] = hw.keithley.range_changes
             
-        if self.SWEEP == 'DS':
-            append = '_output_curve%g.txt' % self.READ_NUMBER
-        else:
-            append = '_transfer_curve%g.txt' % self.READ_NUMBER
+        append = '_%s.txt' % self.curve_name()
         self.check_filename(append)
         
         v_constant_info = 'V_%s =\t%g' % (self.CONSTANT, self.v_constant)
@@ -409,10 +769,63 @@ class GeneralCurveMeasure(Measurement):
         length_info = 'Length/um=\t%g' % self.dimension_choice[self.dimension][1]
         thickness_info = 'Thickness/nm=\t%g' % self.thickness
         info_footer = v_constant_info + "\n" + avgs_info + "\n" + width_info + "\n" + length_info + "\n" + thickness_info
-        info_header = 'V_%s\tI_G (A)\tI_G Error (A)\tI_DS (A)\tI_DS Error (A)' % (self.SWEEP)
-        np.savetxt(self.app.settings['save_dir']+"/"+ self.app.settings['sample'] + append, 
-                   self.save_array, fmt = '%.10f', delimiter='\t',comments='',
-                   header = info_header, footer = info_footer)
+        info_header = '\t'.join(self.save_columns)
+        if self.settings['save_txt']:
+            self.saver.submit(np.savetxt, self.app.settings['save_dir']+"/"+ self.app.settings['sample'] + append, 
+                              snapshot(self.save_array), fmt = '%.10f', delimiter='\t',comments='',
+                              header = info_header, footer = info_footer)
+        self.save_io_report(append)
+        if self.h5 is not None: self.h5.flush()
+        if self.finished and not self.is_test_wrapper:
+            self.close_h5()
+            self.saver.flush()
+
+    def curve_name(self):
+        '''
+        Name of the curve being measured, e.g. transfer_curve1. Used for its text file and HDF5 table.
+        '''
+        return '%s_curve%g' % ('output' if self.SWEEP == 'DS' else 'transfer', self.READ_NUMBER)
+
+    def open_h5(self, append):
+        '''
+        Start the HDF5 file of this run if save_h5 is on.
+        append -- file name ending, as passed to check_filename()
+        '''
+        self.close_h5()
+        if not self.settings['save_h5']:
+            return
+        self.check_filename(append)
+        self.h5 = H5Sink(self, self.app.settings['save_dir'] + "/" + self.app.settings['sample'] + append)
+
+    def close_h5(self):
+        if self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
+
+    def start_h5_table(self):
+        '''
+        Add a table for the curve about to be measured to the HDF5 file. Points are appended to it as they are
+        measured, so refined points come after the coarse sweep rather than in voltage order.
+        '''
+        if self.h5 is None or self.curve_name() in self.h5.tables:
+            return
+        self.h5.create_table(self.curve_name(), self.save_columns,
+                             **{'V_%s (V)' % self.CONSTANT: self.v_constant,
+                                'Number of Averages': self.software_averages,
+                                'Width (um)': self.dimension_choice[self.dimension][0],
+                                'Length (um)': self.dimension_choice[self.dimension][1],
+                                'Thickness (nm)': self.thickness})
+
+    def save_io_report(self, append):
+        '''
+        Write the bus transaction report of the data file just saved next to it, then start a new one.
+        append -- data file name ending, as passed to check_filename()
+        '''
+        if self.io_stats is None:
+            return
+        self.saver.submit(write_text, self.app.settings['save_dir'] + "/" + self.app.settings['sample'] + append.replace('.txt', '_io.txt'),
+                          self.io_stats.report())
+        self.io_stats.reset()
 
     def check_filename(self, append):
         '''
@@ -0,0 +1,79 @@
+'''
+HDF5 data file written while a measurement runs.
+
+The file is made with ScopeFoundry's h5_io, so the app, hardware and measurement settings are stored as
+attributes. Each table is a resizable, chunked and compressed dataset that rows are appended to as they
+are acquired. Rows are held back until a chunk is full or flush() is called, so a point costs no disk access.
+'''
+import numpy as np
+from ScopeFoundry import h5_io
+
+
+class H5Sink(object):
+    '''
+    One HDF5 file with any number of appendable tables in the measurement's group.
+    '''
+
+    def __init__(self, measurement, fname, chunk_rows = 1024, compression = 'gzip'):
+        '''
+        fname -- full path of the file to create
+        chunk_rows -- rows per HDF5 chunk, also the number of rows held back before writing
+        '''
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        self.filename = fname
+        self.h5_file = h5_io.h5_base_file(app = measurement.app, measurement = measurement, fname = fname)
+        self.group = h5_io.h5_create_measurement_group(measurement = measurement, h5group = self.h5_file)
+        self.tables = {} # name: dataset
+        self.pending = {} # name: rows not written yet
+
+    def create_table(self, name, columns, **attrs):
+        '''
+        Add an empty table with the given column names, and attrs as its attributes.
+        '''
+        table = self.group.create_dataset(name, shape = (0, len(columns)), maxshape = (None, len(columns)),
+                                          chunks = (self.chunk_rows, len(columns)), dtype = 'f8',
+                                          compression = self.compression)
+        table.attrs['columns'] = [c.encode() for c in columns]
+        table.attrs.update(attrs)
+        self.tables[name] = table
+        self.pending[name] = []
+
+    def append(self, name, rows):
+        '''
+        Append one row (a sequence) or a 2D array of rows to table name.
+        '''
+        rows = np.asarray(rows, dtype = float)
+        self.pending[name].append(rows.reshape(-1, self.tables[name].shape[1]))
+        if sum(r.shape[0] for r in self.pending[name]) >= self.chunk_rows:
+            self.write_pending(name)
+
+    def write_pending(self, name):
+        if not self.pending[name]:
+            return
+        rows = np.concatenate(self.pending[name])
+        self.pending[name] = []
+        table = self.tables[name]
+        n = table.shape[0]
+        table.resize(n + rows.shape[0], axis = 0)
+        table[n:] = rows
+
+    def set_attrs(self, path, attrs):
+        '''
+        Store attrs (a dict) as attributes of the group at path inside the measurement group, created if needed.
+        '''
+        group = self.group.require_group(path)
+        for key, value in attrs.items():
+            group.attrs[key] = value
+
+    def flush(self):
+        '''
+        Write all held back rows and flush the file to disk.
+        '''
+        for name in self.tables:
+            self.write_pending(name)
+        self.h5_file.flush()
+
+    def close(self):
+        self.flush()
+        self.h5_file.close()
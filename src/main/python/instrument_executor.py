@@ -0,0 +1,60 @@
+'''
+Overlap commands and queries to different instruments.
+
+Each instrument gets its own single worker thread, so calls to the same instrument still run
+in the order they were submitted while calls to different instruments run concurrently.
+'''
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class InstrumentExecutor(object):
+    '''
+    Runs driver calls on one worker thread per instrument.
+    '''
+
+    def __init__(self, devices):
+        '''
+        devices -- driver objects (e.g. Keithley2400SourceMeter), in the order each() returns results
+        '''
+        self.devices = list(devices)
+        self.workers = {}
+        for device in self.devices:
+            if device not in self.workers:
+                self.workers[device] = ThreadPoolExecutor(max_workers = 1)
+
+    def submit(self, device, fn, *args, **kwargs):
+        '''
+        Queue fn(*args, **kwargs) behind earlier calls to device. Returns a Future.
+        '''
+        return self.workers[device].submit(fn, *args, **kwargs)
+
+    def gather(self, *calls):
+        '''
+        Run calls concurrently and return their results in the same order.
+        Each call is (bound driver method, arg, ...), e.g. (self.g_device.source_V, -0.5),
+        or (device, function, arg, ...) to run any function on that device's worker.
+        Raises the first error once all calls have finished.
+        '''
+        futures = []
+        for call in calls:
+            if call[0] in self.workers:
+                device, fn, args = call[0], call[1], call[2:]
+            else:
+                device, fn, args = call[0].__self__, call[0], call[1:]
+            futures.append(self.submit(device, fn, *args))
+        wait(futures)
+        return [f.result() for f in futures]
+
+    def each(self, method, *args):
+        '''
+        Call the same driver method with the same arguments on every device at once.
+        Returns the results in device order.
+        '''
+        return self.gather(*[(getattr(device, method),) + args for device in self.devices])
+
+    def shutdown(self):
+        '''
+        Finish queued calls and stop the worker threads.
+        '''
+        for worker in self.workers.values():
+            worker.shutdown(wait = True)
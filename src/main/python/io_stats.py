@@ -0,0 +1,142 @@
+'''
+Bus transaction statistics for the sourcemeter driver.
+
+Keithley2400SourceMeter records every write and query into an IOStats when its io_stats attribute is set,
+and skips all bookkeeping when it is None. Records are aggregated as they come in, per instrument,
+transaction kind and command class, into a count, totals and a log spaced latency histogram, so a
+measurement run can keep one open without growing memory or slowing down. Both instruments may record from
+their own InstrumentExecutor worker thread, so IOStats serialises its updates with a lock.
+'''
+import bisect
+import threading
+import time
+import numpy as np
+
+LATENCY_EDGES = list(np.logspace(-5, 1, 25)) # histogram bin edges [sec], 4 bins per decade from 10 us to 10 s
+
+
+def command_class(message):
+    '''
+    Headers of a program message without their arguments, e.g. ':SOUR:VOLT:LEV -0.3;:READ?' -> ':SOUR:VOLT:LEV;:READ?'
+    '''
+    return ';'.join(c.split(' ', 1)[0] for c in (c.strip() for c in message.split(';')) if c)
+
+
+class CommandStats(object):
+    '''
+    Running totals and latency histogram of one command class.
+    '''
+    __slots__ = ('count', 'latency', 'bytes', 'max_latency', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.latency = 0.
+        self.bytes = 0
+        self.max_latency = 0.
+        self.histogram = [0] * (len(LATENCY_EDGES) + 1)
+
+    def add(self, nbytes, latency):
+        self.count += 1
+        self.latency += latency
+        self.bytes += nbytes
+        if latency > self.max_latency: self.max_latency = latency
+        self.histogram[bisect.bisect_right(LATENCY_EDGES, latency)] += 1
+
+    def percentile(self, q):
+        '''
+        Upper edge [sec] of the histogram bin holding the q-th percentile latency, at most the largest latency.
+        '''
+        target = q / 100. * self.count
+        total = 0
+        for i, n in enumerate(self.histogram):
+            total += n
+            if n and total >= target:
+                return min(LATENCY_EDGES[i], self.max_latency) if i < len(LATENCY_EDGES) else self.max_latency
+        return self.max_latency
+
+
+class IOStats(object):
+    '''
+    Aggregates the transactions of one measurement run.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''
+        Drop everything recorded so far and restart the run clock.
+        '''
+        with self.lock:
+            self.commands = {} # (instrument, kind, command class): CommandStats
+            self.points = 0
+            self.t_start = time.perf_counter()
+
+    def record(self, instrument, kind, message, nbytes, latency):
+        '''
+        instrument -- port of the instrument
+        kind -- 'write', 'query' or 'binary' (query with a binary response)
+        message -- program message sent
+        nbytes -- bytes sent and received
+        latency [sec]: time from sending until the response was read, or the write returned
+        '''
+        key = (instrument, kind, command_class(message))
+        with self.lock:
+            stats = self.commands.get(key)
+            if stats is None:
+                stats = self.commands[key] = CommandStats()
+            stats.add(nbytes, latency)
+
+    def mark_point(self, n = 1):
+        '''
+        Count n measured points, for the per point transaction counts of the summary.
+        '''
+        with self.lock:
+            self.points += n
+
+    def summary(self):
+        '''
+        Dict with the run totals:
+        elapsed [sec], points, and per instrument the writes, queries, bus time [sec], bytes,
+        writes and queries per point, and the commands as a list of dicts sorted by total latency.
+        '''
+        with self.lock:
+            elapsed = time.perf_counter() - self.t_start
+            points = self.points
+            commands = [(key, stats.count, stats.latency, stats.bytes, stats.percentile(50), stats.percentile(90),
+                         stats.max_latency) for key, stats in self.commands.items()]
+        instruments = {}
+        for (instrument, kind, command), count, latency, nbytes, p50, p90, max_latency in commands:
+            inst = instruments.setdefault(instrument, {'writes': 0, 'queries': 0, 'bus_time': 0., 'bytes': 0, 'commands': []})
+            inst['writes' if kind == 'write' else 'queries'] += count
+            inst['bus_time'] += latency
+            inst['bytes'] += nbytes
+            inst['commands'].append({'kind': kind, 'command': command, 'count': count,
+                                     'total': latency, 'mean': latency / count, 'p50': p50, 'p90': p90,
+                                     'max': max_latency, 'bytes': nbytes})
+        for inst in instruments.values():
+            inst['commands'].sort(key = lambda c: c['total'], reverse = True)
+            inst['writes_per_point'] = inst['writes'] / points if points else np.nan
+            inst['queries_per_point'] = inst['queries'] / points if points else np.nan
+        return {'elapsed': elapsed, 'points': points, 'instruments': instruments}
+
+    def report(self):
+        '''
+        Summary as tab separated text, one table of commands per instrument.
+        '''
+        summary = self.summary()
+        lines = ['Elapsed (s)\t%.3f' % summary['elapsed'], 'Points\t%d' % summary['points']]
+        for instrument, inst in sorted(summary['instruments'].items()):
+            lines += ['',
+                      'Instrument\t%s' % instrument,
+                      'Writes\t%d\tper point\t%.2f' % (inst['writes'], inst['writes_per_point']),
+                      'Queries\t%d\tper point\t%.2f' % (inst['queries'], inst['queries_per_point']),
+                      'Bus time (s)\t%.3f\tof elapsed\t%.1f%%' % (inst['bus_time'], 100 * inst['bus_time'] / summary['elapsed']),
+                      'Bytes\t%d' % inst['bytes'],
+                      'Kind\tCount\tTotal (s)\tMean (ms)\tp50 (ms)\tp90 (ms)\tMax (ms)\tBytes\tCommand']
+            for c in inst['commands']:
+                lines.append('%s\t%d\t%.4f\t%.3f\t%.3f\t%.3f\t%.3f\t%d\t%s' % (
+                    c['kind'], c['count'], c['total'], 1e3 * c['mean'], 1e3 * c['p50'], 1e3 * c['p90'],
+                    1e3 * c['max'], c['bytes'], c['command']))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,536 @@
+'''
+In-process emulation of a Keithley 2400 for running and benchmarking the measurements without bench hardware.
+
+Keithley2400SourceMeter uses it in place of pyvisa when the port starts with SIM (e.g. 'SIM::1').
+The emulator understands the SCPI subset used by this project: source function, level, mode, list and
+staircase sweeps, sense function, NPLC, ranges, compliance, output, filter, trigger count and delays,
+data format, :READ?/:INIT/:FETC?, the trace buffer and the trigger link. Every transaction costs a configurable
+latency, every reading its NPLC integration time, and currents come from a pluggable device model with noise.
+
+Units on the trigger link couple through INSTRUMENTS: a unit started with ARM:SOUR or TRIG:SOUR TLIN waits for
+the arm pulse (ARM:OUTP TENT) and trigger pulses (TRIG:OUTP DEL) that other units send on its input lines when
+they start. A slave started after its master misses the arm pulse and, like the instrument, holds the bus until
+the query times out. A trigger that arrives while a slave is still measuring is missed.
+
+A device model is any object with measure(sim, t) returning (voltage, current) for instrument sim at
+time t [sec, perf_counter]. Instruments are registered by port in INSTRUMENTS so a model can couple them,
+as OECTModel does for the gate and drain sourcemeters.
+'''
+import bisect
+import time
+import numpy as np
+from pyvisa import constants, errors
+
+INSTRUMENTS = {} # port: SimulatedKeithley2400, shared by all resource managers
+
+OPTIONAL_KEYWORDS = ('LEV', 'IMM', 'AMPL', 'SEQ', 'DC', 'UPP')
+OVERFLOW = 9.9e37 # reading returned when the measurement exceeds a fixed range
+STATUS_OVERFLOW = 1 # status word bits
+STATUS_COMPLIANCE = 8
+AUTO_SOURCE_DELAY = 0.001 # [sec]
+
+# state right after *RST
+DEFAULTS = {'OUTP': 0., 'SOUR:FUNC': 'VOLT',
+            'SOUR:VOLT': 0., 'SOUR:CURR': 0., 'SOUR:VOLT:MODE': 'FIX', 'SOUR:CURR:MODE': 'FIX',
+            'SOUR:VOLT:STAR': 0., 'SOUR:VOLT:STOP': 0., 'SOUR:VOLT:STEP': 0., 'SOUR:LIST:VOLT': [0.],
+            'SOUR:CURR:STAR': 0., 'SOUR:CURR:STOP': 0., 'SOUR:CURR:STEP': 0., 'SOUR:LIST:CURR': [0.],
+            'SOUR:DEL': 0., 'SOUR:DEL:AUTO': 1.,
+            'SENS:FUNC': 'CURR', 'SENS:CURR:NPLC': 1., 'SENS:VOLT:NPLC': 1.,
+            'SENS:CURR:RANG': 1.05e-4, 'SENS:CURR:RANG:AUTO': 1., 'SENS:VOLT:RANG': 21., 'SENS:VOLT:RANG:AUTO': 1.,
+            'SENS:CURR:PROT': 1.05e-4, 'SENS:VOLT:PROT': 21.,
+            'SENS:AVER': 0., 'SENS:AVER:COUN': 10., 'SENS:AVER:TCON': 'REP',
+            'TRIG:COUN': 1., 'TRIG:DEL': 0., 'TRIG:SOUR': 'IMM', 'ARM:SOUR': 'IMM', 'ARM:COUN': 1.,
+            'ARM:ILIN': 1., 'ARM:OLIN': 2., 'ARM:OUTP': 'NONE', 'TRIG:ILIN': 1., 'TRIG:OLIN': 2., 'TRIG:OUTP': 'NONE',
+            'FORM:ELEM': ['VOLT', 'CURR', 'RES', 'TIME', 'STAT'], 'FORM:DATA': 'ASC', 'FORM:BORD': 'NORM',
+            'TRAC:POIN': 100., 'TRAC:FEED': 'SENS', 'TRAC:FEED:CONT': 'NEV', 'SYST:AZER': 1.}
+
+
+def short_form(keyword):
+    '''
+    SCPI short form of a keyword: the first four letters, or three if the fourth is a vowel.
+    '''
+    keyword = keyword.upper()
+    if len(keyword) <= 4:
+        return keyword
+    return keyword[:3] if keyword[3] in 'AEIOU' else keyword[:4]
+
+
+def normalize_header(keywords):
+    '''
+    Key for a header path, with short forms and without optional keywords (e.g. :SOUR:VOLT:LEV:IMM -> SOUR:VOLT).
+    '''
+    keywords = [short_form(k) for k in keywords if k]
+    keywords = [k for i, k in enumerate(keywords) if k not in OPTIONAL_KEYWORDS and not (k == 'STAT' and i > 0)]
+    if keywords[:3] == ['SOUR', 'FUNC', 'MODE']:
+        keywords = keywords[:2]
+    return ':'.join(keywords)
+
+
+def parse_argument(arg):
+    '''
+    Parse a command argument into a float, an upper case string or a list of those.
+    '''
+    values = []
+    for part in arg.split(','):
+        part = part.strip().strip('\'"').upper()
+        if part in ('ON', 'OFF'):
+            values.append(1. if part == 'ON' else 0.)
+            continue
+        try:
+            values.append(float(part))
+        except ValueError:
+            values.append(part)
+    return values if len(values) > 1 else values[0]
+
+
+def format_value(value):
+    if isinstance(value, list):
+        return ','.join(format_value(v) for v in value)
+    if isinstance(value, str):
+        return value
+    return '%g' % value
+
+
+class ResistorModel(object):
+    '''
+    A resistor from the instrument output to ground.
+    '''
+
+    def __init__(self, resistance = 1e6):
+        self.resistance = resistance
+
+    def measure(self, sim, t):
+        if sim.source_function() == 'CURR':
+            i = sim.output_level(t)
+            return i * self.resistance, i
+        v = sim.output_level(t)
+        return v, v / self.resistance
+
+
+class OECTModel(object):
+    '''
+    p-type accumulation mode OECT with the gate on one sourcemeter and the drain on another, source grounded.
+    Drain current follows the square law with a soft threshold, gate current is a leakage resistance.
+    After a bias change the drain current approaches its new steady state with time constant tau, so
+    settling and transient measurements have something to resolve.
+    '''
+
+    def __init__(self, gate_port = 'SIM::1', drain_port = 'SIM::2', k = 2e-3, threshold = -0.3,
+                 smoothing = 0.05, gate_resistance = 1e8, tau = 0.05):
+        '''
+        k [A/V^2]: transconductance parameter
+        threshold [V]: gate voltage where the channel turns on
+        smoothing [V]: width of the subthreshold region
+        gate_resistance [ohm]: gate leakage
+        tau [sec]: drain current time constant
+        '''
+        self.gate_port = gate_port
+        self.drain_port = drain_port
+        self.k = k
+        self.threshold = threshold
+        self.smoothing = smoothing
+        self.gate_resistance = gate_resistance
+        self.tau = tau
+        self.last_current = None
+        self.last_time = None
+
+    def bias(self, port, t):
+        sim = INSTRUMENTS.get(port)
+        if sim is None or sim.source_function() != 'VOLT':
+            return 0.
+        return sim.output_level(t)
+
+    def steady_current(self, v_g, v_d):
+        '''
+        Drain current [A] once settled at gate voltage v_g and drain voltage v_d.
+        '''
+        overdrive = self.smoothing * np.logaddexp(0, (self.threshold - v_g) / self.smoothing)
+        v_eff = min(abs(v_d), overdrive)
+        return np.sign(v_d) * self.k * (overdrive * v_eff - v_eff ** 2 / 2)
+
+    def measure(self, sim, t):
+        if sim.port == self.gate_port:
+            if sim.source_function() == 'CURR':
+                i = sim.output_level(t)
+                return i * self.gate_resistance, i
+            v = sim.output_level(t)
+            return v, v / self.gate_resistance
+
+        v_d = self.bias(self.drain_port, t)
+        i_ss = self.steady_current(self.bias(self.gate_port, t), v_d)
+        if self.last_current is None or self.tau <= 0:
+            i = i_ss
+        else:
+            i = i_ss + (self.last_current - i_ss) * np.exp(-max(t - self.last_time, 0) / self.tau)
+        self.last_current, self.last_time = i, t
+        return v_d, i
+
+
+DEVICE_MODEL = OECTModel()
+
+
+def set_device_model(model):
+    '''
+    Replace the device model used by instruments that were not given one.
+    '''
+    global DEVICE_MODEL
+    DEVICE_MODEL = model
+
+
+class SimulatedKeithley2400(object):
+    '''
+    Stands in for a pyvisa message based resource (write, query, query_binary_values, clear, close, timeout).
+    '''
+
+    def __init__(self, port, latency = 0.002, line_frequency = 60., noise = 1e-10, relative_noise = 1e-4,
+                 model = None, seed = None):
+        '''
+        latency [sec]: bus time of every write or query
+        line_frequency [Hz]: sets the integration time of a reading, NPLC / line_frequency
+        noise [A or V]: absolute rms noise of a reading
+        relative_noise: rms noise relative to the reading
+        model: device model, see module docstring. Defaults to DEVICE_MODEL at measurement time.
+        '''
+        self.port = port
+        self.latency = latency
+        self.line_frequency = line_frequency
+        self.noise = noise
+        self.relative_noise = relative_noise
+        self.model = model
+        self.random = np.random.RandomState(seed)
+        self.timeout = 2000 # [ms], like pyvisa
+        self.busy_until = 0.
+        self.write_count = 0
+        self.query_count = 0
+        self.reset()
+
+    def reset(self):
+        self.values = {k: (list(v) if isinstance(v, list) else v) for k, v in DEFAULTS.items()}
+        self.schedule = ([], []) # start time and level of every point of the last acquisition
+        self.pending = None # measurement times of an acquisition whose readings are not computed yet
+        self.link = None # arm time and trigger pulses received by an acquisition waiting on the trigger link
+        self.readings = []
+        self.trace = []
+        self.t0 = time.perf_counter()
+
+    def get(self, key):
+        return self.values[key]
+
+    def source_function(self):
+        return self.values['SOUR:FUNC']
+
+    def output_level(self, t = None):
+        '''
+        Level at the output terminals at time t [sec, perf_counter], 0 with the output off.
+        During an acquisition this follows the sweep or list being sourced.
+        '''
+        if not self.values['OUTP']:
+            return 0.
+        if t is None:
+            t = time.perf_counter()
+        times, levels = self.schedule
+        if times and times[0] <= t < self.busy_until:
+            return levels[bisect.bisect_right(times, t) - 1]
+        return self.values['SOUR:' + self.source_function()]
+
+    def wait(self):
+        '''
+        Bus latency, plus waiting for a running acquisition since the 2400 does not parse commands meanwhile.
+        '''
+        self.wait_for_link()
+        time.sleep(max(self.busy_until - time.perf_counter(), 0) + self.latency)
+        self.complete()
+
+    def wait_for_link(self):
+        '''
+        Wait until an acquisition waiting on the trigger link has all its pulses. Raises a pyvisa timeout error
+        once the timeout runs out.
+        '''
+        deadline = time.perf_counter() + self.timeout / 1000.
+        while self.link is not None:
+            if time.perf_counter() > deadline:
+                raise errors.VisaIOError(constants.StatusCode.error_timeout)
+            time.sleep(0.001)
+
+    def write(self, message):
+        self.wait()
+        self.write_count += 1
+        self.execute(message)
+        return len(message)
+
+    def query(self, message):
+        self.wait()
+        self.query_count += 1
+        responses = self.execute(message)
+        return ';'.join(responses) + '\n'
+
+    def query_binary_values(self, message, datatype = 'f', is_big_endian = False, container = list,
+                            data_points = 0, **kwargs):
+        '''
+        Readings encoded the way the 2400 sends SREAL data and decoded like pyvisa does.
+        '''
+        self.wait()
+        self.query_count += 1
+        if self.values['FORM:DATA'] != 'SREAL':
+            raise ValueError('Binary query while the data format is {}'.format(self.values['FORM:DATA']))
+        values = self.execute(message, binary = True)[0]
+        byte_order = '<' if self.values['FORM:BORD'] == 'SWAP' else '>'
+        block = np.asarray(values, dtype = byte_order + 'f4').tobytes()
+        decoded = np.frombuffer(block, ('>' if is_big_endian else '<') + datatype)
+        return decoded if container in (np.ndarray, np.array) else container(decoded)
+
+    def clear(self):
+        '''
+        Device clear: abort a running acquisition, including one waiting on the trigger link.
+        '''
+        self.busy_until = 0.
+        self.link = None
+
+    def close(self):
+        if INSTRUMENTS.get(self.port) is self:
+            del INSTRUMENTS[self.port]
+
+    def execute(self, message, binary = False):
+        '''
+        Run every command of a program message. Returns the query responses.
+        '''
+        responses = []
+        path = []
+        for command in message.strip().split(';'):
+            command = command.strip()
+            if not command:
+                continue
+            header, _, arg = command.partition(' ')
+            if header.startswith(':'):
+                header = header[1:]
+                path = []
+            if header.startswith('*'):
+                response = self.common_command(header.upper())
+            else:
+                keywords = path + header.split(':')
+                path = keywords[:-1]
+                query = keywords[-1].endswith('?')
+                keywords[-1] = keywords[-1].rstrip('?')
+                key = normalize_header(keywords)
+                response = self.query_value(key, binary) if query else self.set_value(key, arg)
+            if response is not None:
+                responses.append(response)
+        return responses
+
+    def common_command(self, header):
+        if header == '*RST':
+            self.reset()
+        elif header == '*IDN?':
+            return 'KEITHLEY INSTRUMENTS INC.,MODEL 2400,SIM,' + self.port
+        elif header == '*OPC?':
+            return '1'
+        return None
+
+    def set_value(self, key, arg):
+        if key == 'INIT':
+            self.initiate()
+        elif key == 'ABOR':
+            self.busy_until = 0.
+            self.link = None
+        elif key == 'TRAC:CLE':
+            self.trace = []
+        elif key == 'SYST:TIME:RES':
+            self.t0 = time.perf_counter()
+        elif key in ('STAT:QUE:CLE', 'STAT:PRES'):
+            pass
+        else:
+            value = parse_argument(arg)
+            if key.startswith('SOUR:LIST:') and not isinstance(value, list):
+                value = [value]
+            if key in ('SOUR:VOLT', 'SOUR:CURR'):
+                self.values.pop(key + ':TRIG', None) # the triggered level follows the immediate level
+            if key == 'SOUR:DEL':
+                self.values['SOUR:DEL:AUTO'] = 0. # a manual delay turns auto delay off
+            self.values[key] = value
+        return None
+
+    def query_value(self, key, binary):
+        if key == 'READ':
+            self.initiate()
+            key = 'FETC'
+        if key == 'FETC':
+            self.wait_for_link()
+            time.sleep(max(self.busy_until - time.perf_counter(), 0))
+            self.complete()
+            return self.format_readings(self.readings, binary)
+        if key == 'TRAC:DATA':
+            return self.format_readings(self.trace, binary)
+        if key == 'TRAC:POIN:ACT':
+            return '%d' % len(self.trace)
+        if key == 'STAT:QUE':
+            return '0,"No error"'
+        if key not in self.values:
+            raise ValueError('Undefined header {}'.format(key))
+        return format_value(self.values[key])
+
+    def format_readings(self, readings, binary):
+        elements = self.values['FORM:ELEM']
+        if not isinstance(elements, list):
+            elements = [elements]
+        values = [reading[e] for reading in readings for e in elements]
+        if binary:
+            return values
+        return ','.join('%+.6E' % v for v in values)
+
+    def source_points(self, count):
+        '''
+        Source level of each point of an acquisition, None where the fixed level applies.
+        '''
+        func = self.source_function()
+        mode = self.values['SOUR:%s:MODE' % func]
+        if mode == 'SWE':
+            start, stop, step = [self.values['SOUR:%s:%s' % (func, k)] for k in ('STAR', 'STOP', 'STEP')]
+            points = np.linspace(start, stop, int(round(abs((stop - start) / step))) + 1) if step else [start]
+        elif mode == 'LIST':
+            points = self.values['SOUR:LIST:' + func]
+        else:
+            return [None] * count
+        return [points[k % len(points)] for k in range(count)]
+
+    def initiate(self):
+        '''
+        Start the trigger model: every point sources, waits its delays, integrates and measures.
+        Only the timing and source levels are fixed here. The readings are computed by complete() once
+        the instrument is next addressed, so a model coupling two instruments sees both of their schedules.
+        A unit arming or triggering on the trigger link waits for the pulses of other units, see receive_pulses().
+        '''
+        t = max(time.perf_counter(), self.busy_until)
+        if self.values['ARM:SOUR'] == 'TLIN' or self.values['TRIG:SOUR'] == 'TLIN':
+            self.link = {'armed': None if self.values['ARM:SOUR'] == 'TLIN' else t, 'triggers': []}
+            return
+        self.run_points(t)
+
+    def run_points(self, t, triggers = None):
+        '''
+        Fix the timing and source levels of an acquisition armed at t [sec, perf_counter] and send its
+        trigger link pulses.
+        triggers -- times of the trigger pulses received [sec], None to trigger immediately. Each point waits for
+        the first pulse at or after the end of the previous point.
+        Returns False, leaving the acquisition waiting, if there are fewer usable pulses than points.
+        '''
+        func = self.source_function()
+        count = int(self.values['TRIG:COUN'])
+        source_delay = AUTO_SOURCE_DELAY if self.values['SOUR:DEL:AUTO'] else self.values['SOUR:DEL']
+        sense = 'VOLT' if func == 'CURR' else 'CURR'
+        conversions = int(self.values['SENS:AVER:COUN']) if self.values['SENS:AVER'] and self.values['SENS:AVER:TCON'] == 'REP' else 1
+        integration = self.values['SENS:%s:NPLC' % sense] / self.line_frequency * conversions
+
+        start_times, pulse_times, measure_times = [], [], []
+        for k in range(count):
+            if triggers is not None:
+                next_trigger = bisect.bisect_left(triggers, t)
+                if next_trigger == len(triggers):
+                    return False
+                t = triggers[next_trigger]
+            start_times.append(t)
+            pulse_times.append(t + self.values['TRIG:DEL'])
+            # the reading is taken at the middle of its integration, inside the point so it sees the point's level
+            measure_times.append(t + self.values['TRIG:DEL'] + source_delay + integration / 2)
+            t += self.values['TRIG:DEL'] + source_delay + integration
+
+        triggered = self.values.get('SOUR:%s:TRIG' % func)
+        if triggered is not None:
+            self.values['SOUR:' + func] = triggered
+        fixed = self.values['SOUR:' + func]
+        levels = [fixed if level is None else level for level in self.source_points(count)]
+        self.schedule = (start_times, levels)
+        self.pending = (measure_times, conversions)
+        self.busy_until = t
+        self.link = None
+        self.send_pulses(start_times[0] if count and self.values['ARM:OUTP'] == 'TENT' else None,
+                         pulse_times if 'DEL' in self.outputs('TRIG:OUTP') else [])
+        return True
+
+    def outputs(self, key):
+        value = self.values[key]
+        return value if isinstance(value, list) else [value]
+
+    def send_pulses(self, arm_time, trigger_times):
+        '''
+        Pass the arm pulse (None if not sent) and trigger pulses [sec] on this unit's output lines to the waiting units.
+        '''
+        if arm_time is None and not trigger_times:
+            return
+        for sim in list(INSTRUMENTS.values()):
+            if sim is not self and sim.link is not None:
+                sim.receive_pulses(int(self.values['ARM:OLIN']), arm_time, int(self.values['TRIG:OLIN']), trigger_times)
+
+    def receive_pulses(self, arm_line, arm_time, trigger_line, trigger_times):
+        '''
+        Arm on a pulse on the arm input line, then collect the pulses on the trigger input line, until there are
+        enough for the acquisition to run.
+        '''
+        link = self.link
+        if link['armed'] is None:
+            if arm_time is None or arm_line != int(self.values['ARM:ILIN']):
+                return
+            link['armed'] = arm_time
+        if self.values['TRIG:SOUR'] != 'TLIN':
+            self.run_points(link['armed'])
+        elif trigger_line == int(self.values['TRIG:ILIN']):
+            link['triggers'] += [t for t in trigger_times if t >= link['armed']]
+            self.run_points(link['armed'], link['triggers'])
+
+    def complete(self):
+        '''
+        Compute the readings of a started acquisition.
+        '''
+        if self.pending is None:
+            return
+        measure_times, conversions = self.pending
+        self.pending = None
+        self.readings = []
+        for t in measure_times:
+            reading = self.measure(t, conversions)
+            self.readings.append(reading)
+            if self.values['TRAC:FEED:CONT'] == 'NEXT':
+                self.trace.append(reading)
+                if len(self.trace) >= self.values['TRAC:POIN']:
+                    self.values['TRAC:FEED:CONT'] = 'NEV'
+
+    def measure(self, t, conversions = 1):
+        model = self.model if self.model is not None else DEVICE_MODEL
+        v, i = model.measure(self, t)
+        scale = 1. / np.sqrt(conversions)
+        v += self.random.normal(0, self.noise + self.relative_noise * abs(v)) * scale
+        i += self.random.normal(0, self.noise + self.relative_noise * abs(i)) * scale
+
+        status = 0
+        if self.source_function() == 'VOLT':
+            compliance = self.values['SENS:CURR:PROT']
+            if abs(i) > compliance:
+                i = np.sign(i) * compliance
+                status |= STATUS_COMPLIANCE
+            if not self.values['SENS:CURR:RANG:AUTO'] and isinstance(self.values['SENS:CURR:RANG'], float) \
+                    and abs(i) > self.values['SENS:CURR:RANG']:
+                i = OVERFLOW
+                status |= STATUS_OVERFLOW
+        else:
+            compliance = self.values['SENS:VOLT:PROT']
+            if abs(v) > compliance:
+                v = np.sign(v) * compliance
+                status |= STATUS_COMPLIANCE
+        return {'VOLT': v, 'CURR': i, 'RES': v / i if i else OVERFLOW,
+                'TIME': t - self.t0, 'STAT': float(status)}
+
+
+class SimulatedResourceManager(object):
+    '''
+    Stands in for pyvisa.ResourceManager. Options are passed on to every SimulatedKeithley2400 it opens.
+    '''
+
+    def __init__(self, **options):
+        self.options = options
+
+    def open_resource(self, port):
+        sim = SimulatedKeithley2400(port, **self.options)
+        INSTRUMENTS[port] = sim
+        return sim
+
+    def close(self):
+        pass
@@ -8,6 +8,7 @@ try:
     from keithley2400_sourcemeter_interface import Keithley2400SourceMeter
 except Exception as err:
     print("Cannot load required modules for Keithley SourceMeter:", err)
+from range_profile import RangeProfile
 
 
 class Keithley2400SourceMeterComponent(HardwareComponent): #object-->HardwareComponent
@@ -22,6 +23,9 @@ class Keithley2400SourceMeterComponent(HardwareComponent): #object-->HardwareCom
     CURRENT_COMPLIANCE_DEFAULT = .1
     VOLTAGE_COMPLIANCE_DEFAULT = -.95
     NPLC_DEFAULT = 1
+    SIM_LATENCY_DEFAULT = 2
+    SIM_NOISE_DEFAULT = 1e-10
+    PRERANGING_DEFAULT = False
 
     def setup(self):
         self.debug = True
@@ -42,12 +46,27 @@ class Keithley2400SourceMeterComponent(HardwareComponent): #object-->HardwareCom
         self.current_compliance = self.settings.New('current_compliance', unit='A', initial = self.CURRENT_COMPLIANCE_DEFAULT, spinbox_decimals = 7, spinbox_step=0.000001)
         self.voltage_compliance = self.settings.New('voltage_compliance', unit='V', initial = self.VOLTAGE_COMPLIANCE_DEFAULT, spinbox_decimals = 3, spinbox_step=0.001)
         self.NPLC = self.settings.New('NPLC', initial = self.NPLC_DEFAULT)
+        self.arm_line = self.settings.New('arm_line', int, initial = 1, vmin = 1, vmax = 4)
+        self.trigger_line = self.settings.New('trigger_line', int, initial = 2, vmin = 1, vmax = 4)
+        self.preranging = self.settings.New('preranging', bool, initial = self.PRERANGING_DEFAULT)
+        self.range_changes = self.settings.New('range_changes', int, initial = 0, ro = True)
+        self.range_profiles = {} # RangeProfile per pixel and sweep, kept while the app runs
+
+        #only used with a simulated instrument, port SIM::<n>
+        self.sim_latency = self.settings.New('sim_latency', unit = 'ms', initial = self.SIM_LATENCY_DEFAULT, spinbox_decimals = 3)
+        self.sim_noise = self.settings.New('sim_noise', unit = 'A', initial = self.SIM_NOISE_DEFAULT, spinbox_decimals = 12)
+
+        self.add_operation('verify_state', self.verify_state)
         
     def connect(self):
         if self.debug: print("connecting to keithley sourcemeter")
         
         # Open connection to hardware
-        self.keithley = Keithley2400SourceMeter(port=self.port.val, debug=self.debug_mode.val)
+        resource_manager = None
+        if self.port.val.upper().startswith('SIM'):
+            from keithley2400_sim import SimulatedResourceManager
+            resource_manager = SimulatedResourceManager(latency = self.sim_latency.val * .001, noise = self.sim_noise.val)
+        self.keithley = Keithley2400SourceMeter(port=self.port.val, debug=self.debug_mode.val, resource_manager=resource_manager)
         print('connected to ',self.name)
         
     
@@ -83,4 +102,64 @@ class Keithley2400SourceMeterComponent(HardwareComponent): #object-->HardwareCom
             return self.i_ranges_inv[_range]      
     
     def reset(self):
-        self.keithley.reset()
\ No newline at end of file
+        self.keithley.reset()
+
+    def range_profile(self, key):
+        '''
+        RangeProfile for key (e.g. pixel, sweep and constant bias), created empty on first use.
+        '''
+        if key not in self.range_profiles:
+            self.range_profiles[key] = RangeProfile()
+        return self.range_profiles[key]
+
+    def arm_trigger_link(self, role, count, delay = 0, volt_or_curr = 'CURR'):
+        '''
+        Configure a synchronized burst as 'master' or 'slave', using the trigger link lines from the settings.
+        '''
+        self.keithley.arm_trigger_link(role, count, delay, volt_or_curr,
+                                       self.settings['arm_line'], self.settings['trigger_line'])
+
+    def verify_state(self):
+        '''
+        Compare the driver's shadow of the instrument settings against the instrument.
+        Mismatching settings are re-sent on their next use.
+        '''
+        mismatches = self.keithley.verify_state()
+        for key, (shadow, actual) in mismatches.items():
+            print(self.name, 'state mismatch', key, 'expected', shadow, 'read', actual)
+        return mismatches
+
+
+def read_synchronized(hw_a, hw_b, count, delay = 0, func_a = 'CURR', func_b = 'CURR', master = None):
+    '''
+    Take count readings on two sourcemeters connected by Trigger Link. Both sample at the same instants,
+    spaced by delay [sec], and both buffers are fetched at the end.
+    master -- the component that times the acquisition, hw_a by default. Measurements pick the master they need,
+    e.g. the sweep device, which also is the master of a synchronized hardware sweep.
+    Returns (readings_a, readings_b) as numpy arrays.
+    '''
+    if master is None: master = hw_a
+    slave = hw_b if master is hw_a else hw_a
+
+    hw_a.arm_trigger_link('master' if master is hw_a else 'slave', count, delay, func_a)
+    hw_b.arm_trigger_link('master' if master is hw_b else 'slave', count, delay, func_b)
+    slave.keithley.init() # waits for the master's arm pulse
+    master.keithley.init()
+
+    timeout = master.keithley.estimate_read_time(count, delay)
+    readings_a = hw_a.keithley.fetch_values(timeout, points = count)
+    readings_b = hw_b.keithley.fetch_values(timeout, points = count)
+
+    # a preranging unit that read out of range autoranges, and both take the burst again to stay synchronized
+    checks = [(hw.keithley, readings) for hw, readings, func in ((hw_a, readings_a, func_a), (hw_b, readings_b, func_b))
+              if func == 'CURR' and hw.keithley.preranging]
+    if any(keithley.out_of_range(readings) for keithley, readings in checks):
+        for keithley, readings in checks:
+            if keithley.out_of_range(readings): keithley.fall_back_to_autorange()
+        slave.keithley.init()
+        master.keithley.init()
+        readings_a = hw_a.keithley.fetch_values(timeout, points = count)
+        readings_b = hw_b.keithley.fetch_values(timeout, points = count)
+    for hw, readings, func in ((hw_a, readings_a, func_a), (hw_b, readings_b, func_b)):
+        if func == 'CURR' and hw.keithley.preranging: hw.keithley.remember_currents(readings)
+    return readings_a, readings_b
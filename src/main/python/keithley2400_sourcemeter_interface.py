@@ -6,6 +6,7 @@
 from __future__ import division
 import numpy as np
 import time
+from contextlib import contextmanager
 import pyvisa as pv
 
 
@@ -14,12 +15,75 @@ class Keithley2400SourceMeter(object):
     python wrapper for Keythley Source meter unit.
     '''
     KeithleyBaudRate = 9600
+    LIST_MAX_POINTS = 100 # max length of a source memory list sweep
+    TRACE_MAX_POINTS = 2500 # size of the trace buffer
+    MAX_MESSAGE_LENGTH = 1024 # longest program message sent from a batch, well inside the 2400 input buffer
+
+    # preranging, see prerange()
+    CURRENT_RANGES = (1.05e-6, 1.05e-5, 1.05e-4, 1.05e-3, 1.05e-2, 1.05e-1, 1.05) # [A]
+    RANGE_UP = 0.9 # move up a range above this fraction of full scale
+    RANGE_DOWN = 0.05 # move down a range below this fraction of full scale (half the lower range)
+    UNDER_RANGE = 1e-3 # readings below this fraction of full scale are taken again on autorange
+    OVERFLOW = 9.9e37 # reading returned for an over-range measurement
+
+    # bits of the status word returned with each reading when reporting status, see write_status_reporting()
+    STATUS_OVERFLOW = 1 # measurement over range
+    STATUS_COMPLIANCE = 8 # source held at the compliance limit
+
+    # known part of the instrument state right after *RST
+    RESET_STATE = {'output': False, 'trig_count': 1, 'trigger_link': None, 'form_elem': 'VOLT,CURR,RES,TIME,STAT'}
+
+    TRIGGER_LINK_RELEASE = ':ARM:SOUR IMM;:ARM:OUTP NONE;:TRIG:SOUR IMM;:TRIG:OUTP NONE'
+
+
+    # queries used by verify_state() to read back shadowed settings
+    STATE_QUERIES = {'output': 'OUTP?',
+                     'nplc:CURR': ':SENS:CURR:NPLC?',
+                     'nplc:VOLT': ':SENS:VOLT:NPLC?',
+                     'form_elem': ':FORM:ELEM?',
+                     'source_level:VOLT': ':SOUR:VOLT:LEV?',
+                     'source_level:CURR': ':SOUR:CURR:LEV?',
+                     'trig_count': ':TRIG:COUN?',
+                     'compliance:CURR': ':SENS:CURR:PROT?',
+                     'compliance:VOLT': ':SENS:VOLT:PROT?'}
     
-    def __init__(self, port, debug=False):
+    def __init__(self, port, debug=False, cache_state=True, binary_transfer=True, resource_manager=None, io_stats=None):
+        '''
+        port -- VISA resource name, or SIM::<n> for the in-process emulator (keithley2400_sim)
+        resource_manager -- used to open port instead of a new pyvisa or simulated resource manager
+        cache_state -- if True, keep a shadow of the configured instrument state and only send commands that change it.
+        binary_transfer -- if True, multi-reading queries (ask_values) transfer readings as 32 bit floats instead of ASCII.
+        io_stats -- io_stats.IOStats recording every bus transaction, None to record nothing. Can be swapped at any time.
+        '''
         self.port = port
         self.debug = debug
+        self.cache_state = cache_state
+        self.binary_transfer = binary_transfer
+        self.io_stats = io_stats
+        self.state = {}
+        self.current_config = {} # arguments of the last measure_current(), reused by read_I()
+        self.voltage_config = {} # arguments of the last measure_voltage(), reused by read_V()
+        self.preranging = False # fix the current range ahead of each read_I(), see prerange()
+        self.expected_current = None
+        self.recent_currents = []
+        self.range_changes = 0
+        self.range_fallbacks = 0
+        self.batch_depth = 0
+        self.batch_commands = [] # commands queued by send() inside a batch
+        self.batch_queries = [] # queries deferred with ask_later() inside a batch
+        self.report_status = False # return the status word (STAT) with every reading
+        self.status = np.zeros(0, dtype = int) # status words of the readings of the last query
+        self.status_seen = 0 # status words of all readings since clear_status(), or'ed together
+        self.triggered_levels = {} # function: level of write_triggered_level(), applied by the next :INIT
+        self.firing_levels = {} # function: triggered level of an :INIT whose readings are not fetched yet
         
-        self.resource_manager = pv.ResourceManager()
+        if resource_manager is not None:
+            self.resource_manager = resource_manager
+        elif port.upper().startswith('SIM'):
+            from keithley2400_sim import SimulatedResourceManager
+            self.resource_manager = SimulatedResourceManager()
+        else:
+            self.resource_manager = pv.ResourceManager()
         self.keithley = self.resource_manager.open_resource(port)
 
         self.reset()
@@ -28,18 +92,257 @@ class Keithley2400SourceMeter(object):
     def ask(self, cmd):
         '''
         Writes specified to the device and returns the response.
+        Inside a batch, the commands queued so far go out in the same message, ahead of the query.
         '''
-        resp = self.keithley.query(cmd)
+        if self.batch_commands:
+            messages = self.program_messages(self.batch_commands + [cmd])
+            self.batch_commands = []
+            for message in messages[:-1]:
+                self.write_message(message)
+            cmd = messages[-1]
+        if self.debug: print('ask', cmd)
+        if self.io_stats is None:
+            resp = self.keithley.query(cmd)
+        else:
+            t0 = time.perf_counter()
+            resp = self.keithley.query(cmd)
+            self.io_stats.record(self.port, 'query', cmd, len(cmd) + len(resp), time.perf_counter() - t0)
         if self.debug: print('response')
         return resp
 
     
+    def ask_values(self, cmd, timeout = None, points = 0, binary = None):
+        '''
+        Writes specified query to the device and returns all readings as a flat numpy array.
+        With binary transfer the readings come back as little endian SREAL and are decoded straight
+        into the array, otherwise the ASCII response is split on commas.
+        timeout [sec]: VISA timeout for this query only, for queries that wait on a sweep to finish.
+        points: number of values expected, if known. Lets binary reads end on the byte count rather than
+        a termination character that may also occur in the data (serial).
+        binary: override binary_transfer for this query.
+        '''
+        if binary is None: binary = self.binary_transfer
+        self.write_data_format(binary)
+        if binary: self.flush_commands()
+        if timeout is not None:
+            _timeout = self.keithley.timeout
+            self.keithley.timeout = timeout * 1000
+        if cmd == ':READ?': self.fire_triggered_levels()
+        try:
+            if binary:
+                if self.debug: print('ask binary', cmd)
+                t0 = time.perf_counter()
+                values = self.keithley.query_binary_values(cmd, datatype = 'f', is_big_endian = False,
+                                                           container = np.ndarray, data_points = points)
+                if self.io_stats is not None:
+                    self.io_stats.record(self.port, 'binary', cmd, len(cmd) + values.nbytes, time.perf_counter() - t0)
+            else:
+                values = np.array(self.ask(cmd).strip().split(','), dtype = float)
+        finally:
+            if timeout is not None: self.keithley.timeout = _timeout
+        if self.firing_levels: # the trigger model ran, so the source sits at the triggered levels
+            for func, level in self.firing_levels.items():
+                self.state['source_level:%s' % func] = level
+            self.firing_levels = {}
+        return values
+
+    def ask_readings(self, cmd, timeout = None, points = 0, binary = None):
+        '''
+        ask_values() for a query returning readings of the elements in form_elem, as an array with one row per
+        reading and one column per element. The status words, when reported, are not returned but kept in
+        self.status and or'ed into self.status_seen.
+        points: number of readings expected
+        '''
+        if 'form_elem' not in self.state: # e.g. after invalidate_state(), ask rather than guess the record layout
+            self.state['form_elem'] = self.ask(':FORM:ELEM?').strip().replace('"', '').upper()
+        elements = self.state['form_elem'].split(',')
+        values = self.ask_values(cmd, timeout, points * len(elements), binary).reshape(-1, len(elements))
+        if elements[-1] != 'STAT':
+            self.status = np.zeros(values.shape[0], dtype = int)
+            return values
+        self.status = values[:, -1].astype(int)
+        self.status_seen |= int(np.bitwise_or.reduce(self.status, initial = 0))
+        return values[:, :-1]
+
+    def write_status_reporting(self, on):
+        '''
+        Return the status word with every reading, so compliance and over-range can be checked after each
+        read with in_compliance() and over_range(). Takes effect with the next measurement configuration
+        (measure_current(), measure_voltage(), arm_trace()).
+        '''
+        self.report_status = on
+
+    def form_elements(self, *elements):
+        '''
+        Elements returned for each reading, with the status word last when reporting status.
+        '''
+        elements = ','.join(elements + (('STAT',) if self.report_status else ()))
+        self.write_state(('form_elem', elements, ':FORM:ELEM ' + elements))
+
+    def clear_status(self):
+        self.status_seen = 0
+
+    def in_compliance(self, status = None):
+        '''
+        True if a reading hit the compliance limit. status -- status words to check, default status_seen.
+        '''
+        return bool(np.any(np.bitwise_and(self.status_seen if status is None else status, self.STATUS_COMPLIANCE)))
+
+    def over_range(self, status = None):
+        '''
+        True if a reading was over range. status -- status words to check, default status_seen.
+        '''
+        return bool(np.any(np.bitwise_and(self.status_seen if status is None else status, self.STATUS_OVERFLOW)))
+
+    def write_data_format(self, binary):
+        '''
+        Format of readings returned by :READ?, :FETC? and :TRAC:DATA?.
+        binary -- True for 32 bit floats in little endian byte order (SREAL, swapped), False for ASCII.
+        '''
+        if binary:
+            self.write_state(('form_data', 'SREAL', ':FORM:DATA SREAL;:FORM:BORD SWAP'))
+        else:
+            self.write_state(('form_data', 'ASC', ':FORM:DATA ASC'))
+
     def send(self, cmd):
         '''
         Writes specified commands to the device.
+        Inside a batch the commands are queued and go out with the next query or at the end of the batch.
+        '''
+        if self.batch_depth:
+            self.batch_commands.append(cmd)
+            return
+        self.write_message(cmd)
+
+    def write_message(self, message):
+        if self.debug: print('send', message)
+        if self.io_stats is None:
+            self.keithley.write(message)
+            return
+        t0 = time.perf_counter()
+        self.keithley.write(message)
+        self.io_stats.record(self.port, 'write', message, len(message), time.perf_counter() - t0)
+
+    @contextmanager
+    def batch(self):
+        '''
+        Collect the commands sent inside the with block and write them as few semicolon joined program
+        messages as possible, normally a single one. Yields a list that receives the responses to
+        queries deferred with ask_later(), once the block ends. Batches can be nested; only the
+        outermost one writes.
+
+            with keithley.batch() as responses:
+                keithley.write_source_mode('VOLT')
+                keithley.measure_current(nplc = 1)
+                keithley.ask_later(':SYST:ERR?')
+        '''
+        responses = []
+        self.batch_depth += 1
+        try:
+            yield responses
+        finally:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                responses.extend(self.flush_batch())
+
+    def ask_later(self, cmd):
         '''
-        if self.debug: print('send', cmd)
-        self.keithley.write(cmd)       
+        Inside a batch, defer query cmd to the end of the batch, where all deferred queries are sent
+        with the remaining commands in one message and their responses come back together.
+        Outside a batch, same as ask().
+        '''
+        if not self.batch_depth:
+            return self.ask(cmd).strip()
+        self.batch_queries.append(cmd)
+
+    def flush_commands(self):
+        '''
+        Write the commands queued in a batch so far.
+        '''
+        commands, self.batch_commands = self.batch_commands, []
+        for message in self.program_messages(commands):
+            self.write_message(message)
+
+    def flush_batch(self):
+        '''
+        Write the queued commands followed by the deferred queries. Returns the query responses in order.
+        '''
+        queries, self.batch_queries = self.batch_queries, []
+        if not queries:
+            self.flush_commands()
+            return []
+        messages = self.program_messages(self.batch_commands + queries)
+        self.batch_commands = []
+        # the 2400 separates the responses to a message's queries with ';'
+        responses = []
+        for message in messages:
+            if '?' in message:
+                responses.extend(r.strip() for r in self.ask(message).strip().split(';'))
+            else:
+                self.write_message(message)
+        return responses
+
+    def program_messages(self, commands):
+        '''
+        Join commands into program messages no longer than MAX_MESSAGE_LENGTH, splitting only between
+        commands. Every command starts from the root of the command tree so joining does not change its meaning.
+        '''
+        headers = []
+        for cmd in commands:
+            for header in cmd.split(';'):
+                header = header.strip()
+                if not header: continue
+                headers.append(header if header[0] in ':*' else ':' + header)
+        messages = []
+        for header in headers:
+            if messages and len(messages[-1]) + len(header) + 1 <= self.MAX_MESSAGE_LENGTH:
+                messages[-1] += ';' + header
+            else:
+                messages.append(header)
+        return messages
+
+    def write_state(self, *changes):
+        '''
+        Send only the commands that change the shadowed instrument state, joined into one message.
+        changes -- (key, value, command) tuples. Commands must start with ':'.
+        '''
+        cmds = []
+        for key, value, cmd in changes:
+            if not self.cache_state or key not in self.state or self.state[key] != value:
+                cmds.append(cmd)
+                self.state[key] = value
+        if cmds: self.send(';'.join(cmds))
+
+    def invalidate_state(self):
+        '''
+        Forget the shadowed instrument state, e.g. after the front panel was used.
+        The next configuration call sends all of its commands again.
+        '''
+        self.state = {}
+
+    def verify_state(self):
+        '''
+        Read back the shadowed settings that can be queried and compare them to the shadow.
+        Mismatching settings are dropped from the shadow so they get sent again.
+        Returns a dict of key: (shadow value, instrument value) for every mismatch.
+        '''
+        mismatches = {}
+        for key, value in list(self.state.items()):
+            if key not in self.STATE_QUERIES: continue
+            resp = self.ask(self.STATE_QUERIES[key]).strip()
+            if isinstance(value, bool):
+                actual = bool(float(resp))
+                same = actual == value
+            elif isinstance(value, str):
+                actual = resp.replace('"', '')
+                same = actual.upper() == value.upper()
+            else:
+                actual = float(resp)
+                same = np.isclose(actual, value)
+            if not same:
+                mismatches[key] = (value, actual)
+                del self.state[key]
+        return mismatches
 
     def close(self):
         if (self.read_output_on): self.write_output_on(False) #disable output
@@ -51,19 +354,34 @@ class Keithley2400SourceMeter(object):
         '''
         Set source voltage.
         '''
-        self.send(":SOUR:VOLT:LEV %g" % (V))
+        self.write_level(V, 'VOLT')
 
     def source_I(self, I, mode = 'DC'):
         '''
         Set source current.
         '''
-        self.send(":SOUR:CURR:LEV %g" % (I))
+        self.write_level(I, 'CURR')
+
+    def write_level(self, level, volt_or_curr):
+        '''
+        Set the immediate source level. The triggered level follows it, replacing a pending write_triggered_level().
+        '''
+        key = 'source_level:%s' % volt_or_curr
+        if not self.cache_state or self.state.get(key) != level:
+            self.state.pop('triggered_level:%s' % volt_or_curr, None)
+            self.triggered_levels.pop(volt_or_curr, None)
+        self.write_state((key, level, ':SOUR:%s:LEV %g' % (volt_or_curr, level)))
         
     def reset(self):
         '''
         Reset to factory defaults.
         '''
         self.send("status:queue:clear;*RST;:stat:pres;:*CLS;")
+        self.state = dict(self.RESET_STATE)
+        self.triggered_levels = {}
+        self.firing_levels = {}
+        self.current_config = {}
+        self.voltage_config = {}
            
     def write_range(self, _range, sour_or_sens = 'SOUR', volt_or_curr = 'VOLT'):
         '''
@@ -75,7 +393,8 @@ class Keithley2400SourceMeter(object):
         SOUR corresponds to source; SENS corresponds to measurement.
         VOLT corresponds to voltage; CURR corresponds to current.
         '''
-        self.send(":{0}:{1}:RANG:AUTO 0;:{0}:{1}:RANG {2}".format(sour_or_sens, volt_or_curr, _range).upper())
+        self.write_state(('range:{0}:{1}'.format(sour_or_sens.upper(), volt_or_curr.upper()), _range,
+                          ":{0}:{1}:RANG:AUTO 0;:{0}:{1}:RANG {2}".format(sour_or_sens, volt_or_curr, _range).upper()))
         
             
     def read_range(self, sour_or_sens = 'SOUR', volt_or_curr = 'VOLT'):            
@@ -89,8 +408,8 @@ class Keithley2400SourceMeter(object):
         '''
         Enables/disables source output.
         '''
-        s = {True:'OUTPUT ON',False:'OUTPUT OFF'}[on]
-        self.send(s)
+        s = {True:':OUTPUT ON',False:':OUTPUT OFF'}[on]
+        self.write_state(('output', on, s))
 
 
     def read_output_on(self):
@@ -98,37 +417,150 @@ class Keithley2400SourceMeter(object):
         Returns whether source output is disabled.
         '''
         resp = self.ask("OUTPut?")
-        return bool(float(resp))
+        self.state['output'] = bool(float(resp))
+        return self.state['output']
       
     def read_V(self):
         '''
         Configure device to read voltage and return voltage reading.
         '''
-        self.measure_voltage()
-        resp = self.ask(":READ?")
-        return float(resp)
+        self.measure_voltage(**self.voltage_config)
+        self.write_single_shot()
+        return float(self.ask_readings(":READ?", binary = False)[0, 0])
 
     def measure_voltage(self, nplc=1, voltage=21.0, auto_range=True):
         """ Configures the measurement of voltage.
         :param nplc: Number of power line cycles (NPLC) from 0.01 to 10
         :param voltage: Upper limit of voltage in Volts, from -210 V to 210 V
         :param auto_range: Enables auto_range if True, else uses the set voltage
+        Only settings that differ from the shadowed state are sent. read_V() reuses these arguments.
         """
-        if (self.read_output_on() == False): self.write_output_on()
-        self.send(":SENS:FUNC 'VOLT';"
-                   ":SENS:VOLT:NPLC %f;:FORM:ELEM VOLT;" % nplc)
+        self.voltage_config = dict(nplc=nplc, voltage=voltage, auto_range=auto_range)
+        if 'output' not in self.state: self.read_output_on()
+        if (self.state['output'] == False): self.write_output_on()
+        self.write_state(('sense_func', 'VOLT', ":SENS:FUNC 'VOLT'"),
+                         ('nplc:VOLT', nplc, ":SENS:VOLT:NPLC %f" % nplc))
+        self.form_elements('VOLT')
         if auto_range:
-            self.send(":SENS:VOLT:RANG:AUTO 1;")
+            self.write_state(('range:SENS:VOLT', 'AUTO', ":SENS:VOLT:RANG:AUTO 1"))
         else:
             self.write_range(voltage, "SENS", "VOLT")
     
     def read_I(self):
         '''
         Configure device to read current and return current reading.
+        With preranging on, the range is fixed ahead of the reading by prerange().
         '''
-        self.measure_current()
-        resp = self.ask(":READ?")
-        return float(resp)
+        if self.preranging: self.prerange()
+        self.measure_current(**self.current_config)
+        self.write_single_shot()
+        current = float(self.ask_readings(":READ?", binary = False)[0, 0])
+        if self.preranging: current = self.check_range(current)
+        return current
+
+    def write_preranging(self, on):
+        '''
+        Predict the current range instead of letting the instrument autorange every reading.
+        After turning it off, configure the range again with measure_current().
+        '''
+        self.preranging = on
+        self.recent_currents = []
+        self.expected_current = None
+
+    def expect_current(self, current):
+        '''
+        Hint the current [A] expected at the next read_I(), e.g. from an earlier sweep of the same device.
+        None drops the hint.
+        '''
+        self.expected_current = current
+
+    def predict_current(self):
+        '''
+        Largest of the expected current hint and the geometric extrapolation of the last two readings.
+        None when there is nothing to go on.
+        '''
+        predictions = []
+        if self.expected_current is not None:
+            predictions.append(abs(self.expected_current))
+        if len(self.recent_currents) == 2:
+            previous, last = self.recent_currents
+            # extrapolate at most one decade past the last reading
+            predictions.append(min(last * last / previous, 10 * last) if previous > 0 else last)
+        elif self.recent_currents:
+            predictions.append(self.recent_currents[-1])
+        return max(predictions) if predictions else None
+
+    def current_range_for(self, current, present = None):
+        '''
+        Smallest current range [A] that holds current [A] with headroom. The present range is kept
+        while current is between RANGE_DOWN and RANGE_UP of it, so readings near a range boundary do not toggle it.
+        '''
+        current = abs(current)
+        if present in self.CURRENT_RANGES and self.RANGE_DOWN * present <= current <= self.RANGE_UP * present:
+            return present
+        for _range in self.CURRENT_RANGES:
+            if current <= self.RANGE_UP * _range:
+                return _range
+        return self.CURRENT_RANGES[-1]
+
+    def prerange(self):
+        '''
+        Fix the current measurement range for the predicted current, or autorange with no prediction.
+        Counts every range change in range_changes.
+        '''
+        predicted = self.predict_current()
+        present = self.state.get('range:SENS:CURR')
+        if predicted is None:
+            _range, auto_range = self.current_config.get('current', 1.05e-4), True
+        else:
+            _range, auto_range = self.current_range_for(predicted, present), False
+        if (('AUTO' if auto_range else _range) != present): self.range_changes += 1
+        self.current_config = dict(self.current_config, current = _range, auto_range = auto_range)
+
+    def check_range(self, current):
+        '''
+        Take one autorange reading in place of an over-range or under-range one, and remember the
+        reading for the next prediction. Returns the reading to use.
+        '''
+        if self.out_of_range(current):
+            self.fall_back_to_autorange()
+            current = float(self.ask_readings(":READ?", binary = False)[0, 0])
+        self.remember_currents(current)
+        return current
+
+    def check_burst_range(self, currents, retake):
+        '''
+        check_range() for the readings of a burst: if out of range, autorange and use retake() instead,
+        a function taking the burst again with the trigger setup unchanged.
+        '''
+        if self.out_of_range(currents):
+            self.fall_back_to_autorange()
+            currents = retake()
+        self.remember_currents(currents)
+        return currents
+
+    def out_of_range(self, currents):
+        '''
+        True if currents [A] were read on a range fixed by prerange() and one is over range, or all are
+        under range. Nothing is under-range on the lowest range.
+        '''
+        if self.current_config.get('auto_range', True):
+            return False
+        _range = self.current_config.get('current')
+        currents = np.abs(np.atleast_1d(currents))
+        return bool(np.any(currents >= self.OVERFLOW) or
+                    (np.all(currents < self.UNDER_RANGE * _range) and _range > self.CURRENT_RANGES[0]))
+
+    def fall_back_to_autorange(self):
+        self.range_fallbacks += 1
+        self.range_changes += 1
+        self.measure_current(**dict(self.current_config, auto_range = True))
+
+    def remember_currents(self, currents):
+        '''
+        Keep the largest of currents [A] for the next prediction.
+        '''
+        self.recent_currents = (self.recent_currents + [float(np.max(np.abs(currents)))])[-2:]
 
 
     def measure_current(self, nplc=1, current=1.05e-4, auto_range=True):
@@ -136,12 +568,16 @@ class Keithley2400SourceMeter(object):
         :param nplc: Number of power line cycles (NPLC) from 0.01 to 10
         :param current: Upper limit of current in Amps, from -1.05 A to 1.05 A
         :param auto_range: Enables auto_range if True, else uses the set current
+        Only settings that differ from the shadowed state are sent. read_I() reuses these arguments.
         """
-        if (self.read_output_on() == False): self.write_output_on()
-        self.send(":SENS:FUNC 'CURR';"
-                   ":SENS:CURR:NPLC %f;:FORM:ELEM CURR;" % nplc)
+        self.current_config = dict(nplc=nplc, current=current, auto_range=auto_range)
+        if 'output' not in self.state: self.read_output_on()
+        if (self.state['output'] == False): self.write_output_on()
+        self.write_state(('sense_func', 'CURR', ":SENS:FUNC 'CURR'"),
+                         ('nplc:CURR', nplc, ":SENS:CURR:NPLC %f" % nplc))
+        self.form_elements('CURR')
         if auto_range:
-            self.send(":SENS:CURR:RANG:AUTO 1;")
+            self.write_state(('range:SENS:CURR', 'AUTO', ":SENS:CURR:RANG:AUTO 1"))
         else:
             self.write_range(current, "SENS", "CURR")
 
@@ -152,7 +588,7 @@ class Keithley2400SourceMeter(object):
         integration time, and increases measurement resolution and accuracy, however the trade-off 
         is slower measurement rates. (sets ADC_integration_time to NPLC*0.1/60 sec)
         '''
-        self.send(":SENS:CURR:NPLC %f" % (n))
+        self.write_state(('nplc:CURR', n, ":SENS:CURR:NPLC %f" % (n)))
         
     def read_NPLC(self):
         resp = self.ask(":SENS:CURR:NPLC?")
@@ -162,26 +598,110 @@ class Keithley2400SourceMeter(object):
         '''
         delay [sec]: delay between measurements
         '''
-        self.send(':TRIG:SEQ:DEL %g' % (delay))
+        self.write_state(('trig_delay', delay, ':TRIG:SEQ:DEL %g' % (delay)))
 
     def read_measure_delay(self):
         resp = self.ask(':TRIG:SEQ:DEL?')
         return float(resp)
 
+    def write_single_shot(self):
+        '''
+        One reading per :READ? with no trigger delay, undoing arm_burst() and arm_trigger_link().
+        '''
+        self.write_state(('trig_count', 1, ':TRIG:COUN 1'),
+                         ('trig_delay', 0, ':TRIG:SEQ:DEL 0'),
+                         ('trigger_link', None, self.TRIGGER_LINK_RELEASE))
+
+    def arm_burst(self, count, delay = 0, volt_or_curr = 'CURR'):
+        '''
+        Configure the next :READ? or :INIT to take count readings back to back.
+        delay [sec]: trigger delay before each reading, replaces a host sleep between software averages
+        volt_or_curr: measure current (as read_I) or voltage (as read_V)
+        With preranging on, the current range is fixed ahead of the burst by prerange(). Check the readings with
+        check_burst_range().
+        '''
+        if volt_or_curr == 'CURR':
+            if self.preranging: self.prerange()
+            self.measure_current(**self.current_config)
+        else:
+            self.measure_voltage(**self.voltage_config)
+        self.write_trigger_count(count)
+        self.write_measure_delay(delay)
+
+    def read_burst(self, count, delay = 0, volt_or_curr = 'CURR'):
+        '''
+        Return count raw readings taken off a single :READ? as a numpy array. See arm_burst().
+        To read two instruments at once, arm_burst() and init() both, then fetch_values() both.
+        '''
+        self.arm_burst(count, delay, volt_or_curr)
+        timeout = self.estimate_read_time(count, delay)
+        readings = self.ask_readings(':READ?', timeout, points = count)[:, 0]
+        if self.preranging and volt_or_curr == 'CURR':
+            readings = self.check_burst_range(readings, lambda: self.ask_readings(':READ?', timeout, points = count)[:, 0])
+        return readings
+
+    def write_trigger_link(self, role, arm_line = 1, trigger_line = 2):
+        '''
+        Synchronize this unit with a second 2400 over the Trigger Link cable.
+        'master' runs off its own triggers. It pulses arm_line when it enters the trigger layer and
+        trigger_line at the end of each delay, right before it measures.
+        'slave' arms on arm_line and takes a reading every time trigger_line pulses, so both units
+        sample together and keep their readings until fetched.
+        None returns to immediate triggering.
+        '''
+        if role == 'master':
+            cmd = ':ARM:SOUR IMM;:ARM:OUTP TENT;:ARM:OLIN %d;:TRIG:SOUR IMM;:TRIG:OUTP DEL;:TRIG:OLIN %d' % (arm_line, trigger_line)
+        elif role == 'slave':
+            cmd = ':ARM:SOUR TLIN;:ARM:ILIN %d;:ARM:OUTP NONE;:TRIG:SOUR TLIN;:TRIG:ILIN %d;:TRIG:OUTP NONE' % (arm_line, trigger_line)
+        elif role is None:
+            cmd = self.TRIGGER_LINK_RELEASE
+        else:
+            raise ValueError('Trigger link role must be master, slave or None, not {}'.format(role))
+        self.write_state(('trigger_link', None if role is None else (role, arm_line, trigger_line), cmd))
+
+    def arm_trigger_link(self, role, count, delay = 0, volt_or_curr = 'CURR', arm_line = 1, trigger_line = 2):
+        '''
+        Configure a synchronized burst of count readings, see write_trigger_link().
+        Only the master applies delay [sec]; the slave follows the master's triggers.
+        Start with init() on the slave first, then on the master, and fetch_values() both.
+        '''
+        self.arm_burst(count, delay if role == 'master' else 0, volt_or_curr)
+        self.write_trigger_link(role, arm_line, trigger_line)
+
+    def estimate_read_time(self, count, delay = 0):
+        '''
+        Upper estimate [sec] of how long count readings take, for query timeouts. Assumes a 50 Hz line.
+        delay [sec]: source or trigger delay per reading
+        '''
+        nplc = max(self.current_config.get('nplc', 1), self.voltage_config.get('nplc', 1))
+        return count * (delay + nplc / 50. + 0.05) + 5
+
+    def write_filter(self, count, tcon = 'REP'):
+        '''
+        Digital filter: the instrument averages count conversions into every reading it returns.
+        tcon: 'REP' (repeating, fresh conversions for each reading) or 'MOV' (moving average)
+        A count of 1 or less turns the filter off.
+        '''
+        if count > 1:
+            self.write_state(('filter', (tcon, count), ':SENS:AVER:TCON %s;:SENS:AVER:COUN %d;:SENS:AVER ON' % (tcon, count)))
+        else:
+            self.write_state(('filter', None, ':SENS:AVER OFF'))
+
     def write_autozero(self, on):
         s = {'on': 1, 'off': 0, 'once': 'once'}[on]
-        self.send(':SYST:AZER:STAT ' + str(s))
+        self.write_state(('autozero', s, ':SYST:AZER:STAT ' + str(s)))
 
     def write_source_mode(self, volt_or_curr):
-        self.send(':SOUR:FUNC:MODE %s' % (volt_or_curr.upper()))
-        self.send(':SOUR:%s:MODE FIX' % (volt_or_curr.upper()))
-        self.send(':SOUR:%s:RANG:AUTO 1' % (volt_or_curr.upper()))
+        volt_or_curr = volt_or_curr.upper()
+        self.write_state(('source_func', volt_or_curr, ':SOUR:FUNC:MODE %s' % (volt_or_curr)),
+                         ('source_mode:%s' % volt_or_curr, 'FIX', ':SOUR:%s:MODE FIX' % (volt_or_curr)),
+                         ('range:SOUR:%s' % volt_or_curr, 'AUTO', ':SOUR:%s:RANG:AUTO 1' % (volt_or_curr)))
 
     def write_current_compliance(self, i_compliance):
-        self.send(':SENS:CURR:PROT %g' % i_compliance)
+        self.write_state(('compliance:CURR', i_compliance, ':SENS:CURR:PROT %g' % i_compliance))
 
     def write_voltage_compliance(self, v_compliance):
-        self.send(':SENS:VOLT:PROT %g' % v_compliance)
+        self.write_state(('compliance:VOLT', v_compliance, ':SENS:VOLT:PROT %g' % v_compliance))
 
     def read_is_measuring(self, channel = 'a'):
         resp = self.ask("status:queue?;")[0]
@@ -199,4 +719,147 @@ class Keithley2400SourceMeter(object):
         self.write_range(Vmeasure,'SENS', 'VOLT', 'a')
         self.write_range(Vsource,'SOUR', 'VOLT', 'a')
         self.write_range(Imeasure,'SENS', 'CURR', 'a')
-        self.write_range(Isource,'SENS', 'CURR', 'a')
\ No newline at end of file
+        self.write_range(Isource,'SENS', 'CURR', 'a')
+
+    def write_trigger_count(self, count):
+        '''
+        Number of source-measure cycles taken per :INIT or :READ?.
+        '''
+        self.write_state(('trig_count', count, ':TRIG:COUN %d' % (count)))
+
+    def write_source_delay(self, delay):
+        '''
+        delay [sec]: settling time between sourcing a point and measuring it
+        '''
+        self.write_state(('source_delay', delay, ':SOUR:DEL %g' % (delay)))
+
+    @staticmethod
+    def sweep_segments(voltages):
+        '''
+        Split voltages into pieces that can each be run as one hardware sweep.
+        Evenly spaced monotonic runs become staircase segments; anything else is cut into
+        lists no longer than LIST_MAX_POINTS. A sweep with its return sweep appended becomes two staircases.
+        '''
+        voltages = np.asarray(voltages, dtype = float)
+        segments = []
+        start = 0
+        for i in range(1, voltages.shape[0]):
+            steps = np.diff(voltages[start:i + 1])
+            if not (np.allclose(steps, steps[0]) and steps[0] != 0):
+                segments.append(voltages[start:i])
+                start = i
+        segments.append(voltages[start:])
+
+        # merge single points back into lists so a jagged grid is not run one point at a time
+        merged = []
+        for segment in segments:
+            if merged and (segment.shape[0] == 1 or merged[-1].shape[0] == 1) and \
+                    merged[-1].shape[0] + segment.shape[0] <= Keithley2400SourceMeter.LIST_MAX_POINTS:
+                merged[-1] = np.concatenate((merged[-1], segment))
+            else:
+                merged.append(segment)
+        return merged
+
+    def write_sweep(self, voltages, source_delay = 0):
+        '''
+        Load a voltage sweep into the instrument so all points run off one :INIT or :READ?.
+        Evenly spaced monotonic voltages use the staircase (SWE) mode, anything else is loaded as a LIST.
+        Use sweep_segments() to split longer or mixed sweeps.
+        source_delay [sec]: settling time between sourcing each point and measuring it
+        Returns the number of points in the sweep.
+        '''
+        voltages = np.asarray(voltages, dtype = float)
+        n = voltages.shape[0]
+        steps = np.diff(voltages)
+        if n > 1 and np.allclose(steps, steps[0]) and steps[0] != 0:
+            self.write_state(('source_func', 'VOLT', ':SOUR:FUNC VOLT'),
+                             ('source_mode:VOLT', 'SWE', ':SOUR:VOLT:MODE SWE;:SOUR:SWE:SPAC LIN;:SOUR:SWE:RANG BEST'))
+            self.send(':SOUR:VOLT:STAR %g;:SOUR:VOLT:STOP %g;:SOUR:VOLT:STEP %g' % (voltages[0], voltages[-1], steps[0]))
+        else:
+            if n > self.LIST_MAX_POINTS:
+                raise ValueError('List sweep of {} points is longer than {}'.format(n, self.LIST_MAX_POINTS))
+            self.write_state(('source_func', 'VOLT', ':SOUR:FUNC VOLT'),
+                             ('source_mode:VOLT', 'LIST', ':SOUR:VOLT:MODE LIST'))
+            self.send(':SOUR:LIST:VOLT ' + ','.join('%g' % v for v in voltages))
+        self.write_source_delay(source_delay)
+        self.write_trigger_count(n)
+        return n
+
+    def init(self):
+        '''
+        Start the trigger model without waiting for readings. Collect them with fetch_values().
+        '''
+        self.send(':INIT')
+        self.fire_triggered_levels()
+
+    def fire_triggered_levels(self):
+        '''
+        Book keeping for an :INIT or :READ? just sent: its first source action applies the levels of
+        write_triggered_level(), so the immediate level is unknown until its readings are in.
+        '''
+        for func in self.triggered_levels:
+            self.state.pop('source_level:%s' % func, None)
+        self.firing_levels.update(self.triggered_levels)
+        self.triggered_levels = {}
+
+    def fetch_values(self, timeout = None, points = 0):
+        '''
+        Return all readings of the last :INIT as a numpy array. Blocks until the instrument is done.
+        timeout [sec]: how long to wait for the readings
+        points: number of readings expected, see ask_values()
+        '''
+        return self.ask_readings(':FETC?', timeout, points)[:, 0]
+
+    def write_triggered_level(self, level, volt_or_curr = 'VOLT'):
+        '''
+        Source level applied by the first source action of the next :INIT instead of right away,
+        so a step lands exactly on a trigger boundary. The instrument keeps the level afterwards.
+        The level is shadowed under its own key: the immediate level is only taken to be this level once the
+        readings of that :INIT are fetched, so a source_V() or source_I() before then is always sent.
+        '''
+        self.write_state(('triggered_level:%s' % volt_or_curr, level, ':SOUR:%s:TRIG %g' % (volt_or_curr, level)))
+        self.triggered_levels[volt_or_curr] = level
+
+    def reset_timestamp(self):
+        '''
+        Restart the instrument's clock, the TIME element of every reading [sec].
+        '''
+        self.send(':SYST:TIME:RES')
+
+    def arm_trace(self, count, interval = 0, volt_or_curr = 'CURR'):
+        '''
+        Configure the next :INIT to store count readings, each with its time stamp, in the trace buffer
+        (at most TRACE_MAX_POINTS). interval [sec]: trigger delay before each reading.
+        Configure the measurement first (measure_current() or measure_voltage()). Read with fetch_trace().
+        '''
+        if count > self.TRACE_MAX_POINTS:
+            raise ValueError('Trace of {} points is longer than {}'.format(count, self.TRACE_MAX_POINTS))
+        self.write_trigger_count(count)
+        self.write_measure_delay(interval)
+        self.form_elements(volt_or_curr, 'TIME')
+        self.send(':TRAC:CLE;:TRAC:FEED SENS;:TRAC:POIN %d;:TRAC:FEED:CONT NEXT' % count)
+
+    def fetch_trace(self, timeout = None, points = 0):
+        '''
+        Return (readings, time stamps [sec]) stored by an :INIT armed with arm_trace(), as numpy arrays.
+        Blocks until the instrument is done.
+        timeout [sec]: how long to wait for the readings
+        points: number of readings expected
+        '''
+        values = self.ask_readings(':TRAC:DATA?', timeout, points)
+        return values[:, 0], values[:, 1]
+
+    def read_sweep(self, timeout = None, points = 0):
+        '''
+        Run the loaded sweep and return every reading from a single :READ?.
+        '''
+        return self.ask_readings(':READ?', timeout, points)[:, 0]
+
+    def end_sweep(self):
+        '''
+        Return to fixed-level sourcing with one reading per trigger, as after reset().
+        '''
+        self.write_state(('source_mode:VOLT', 'FIX', ':SOUR:VOLT:MODE FIX'),
+                         ('source_delay', 'AUTO', ':SOUR:DEL:AUTO 1'),
+                         ('trig_count', 1, ':TRIG:COUN 1'),
+                         ('trigger_link', None, self.TRIGGER_LINK_RELEASE))
@@ -0,0 +1,133 @@
+'''
+Live plotting that keeps up with long acquisitions.
+
+The acquisition thread hands data to the display through a PlotFeed under a lock, so the display never reads
+arrays while they are written. Each LiveCurve owns one persistent PlotDataItem that is updated with setData,
+and shows at most two points (the min and the max) per horizontal pixel of the visible range.
+'''
+import threading
+import numpy as np
+
+
+def minmax_decimate(x, y, bins):
+    '''
+    Reduce x, y to the minimum and maximum of y in each of bins runs of equal length, kept in their original
+    order, so peaks and glitches stay visible. Returned unchanged when there are no more than 2 * bins points.
+    '''
+    n = len(y)
+    if n <= 2 * bins:
+        return x, y
+    size = int(np.ceil(n / bins))
+    padded = np.full(-(-n // size) * size, np.nan)
+    padded[:n] = y
+    blocks = padded.reshape(-1, size)
+    offsets = np.arange(0, len(padded), size)
+    lo = offsets + np.argmin(np.where(np.isnan(blocks), np.inf, blocks), axis = 1)
+    hi = offsets + np.argmax(np.where(np.isnan(blocks), -np.inf, blocks), axis = 1)
+    index = np.unique(np.minimum(np.concatenate((lo, hi)), n - 1))
+    return x[index], y[index]
+
+
+class PlotFeed(object):
+    '''
+    Rows handed from the acquisition thread to the display thread: new rows are appended with push() and
+    collected with take(), so each row is copied once however long the curve gets.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.version = 0
+
+    def push(self, rows):
+        '''
+        Queue new rows, a sequence of values or a 2D array. The rows are copied.
+        '''
+        rows = np.array(rows, dtype = float, ndmin = 2)
+        with self.lock:
+            self.pending.append(rows)
+
+    def take(self):
+        '''
+        (version, rows pushed since the last call or None if there are none). The version changes with clear().
+        '''
+        with self.lock:
+            pending, self.pending = self.pending, []
+            version = self.version
+        return version, np.concatenate(pending) if pending else None
+
+    def clear(self):
+        '''
+        Drop the queued rows and start a new version, e.g. for a new curve.
+        '''
+        with self.lock:
+            self.pending = []
+            self.version += 1
+
+
+class LiveCurve(object):
+    '''
+    One persistent curve of a PlotItem.
+
+    Points are either added with extend(), or read from source, an object with a
+    view(x_min, x_max, max_points) method returning x, y for the visible range (see SummaryPyramid). For
+    increasing x, only the visible x range is drawn, min/max decimated to the width of the plot, and the curve
+    is redrawn when the view is panned or zoomed.
+    '''
+
+    def __init__(self, plot_item, pen, source = None):
+        self.plot_item = plot_item
+        self.item = plot_item.plot(pen = pen)
+        self.source = source
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self.monotonic = True
+        plot_item.getViewBox().sigXRangeChanged.connect(self.range_changed)
+
+    def extend(self, x, y, index = None, pen = None):
+        '''
+        Add points after the ones held, or before the point at index (e.g. refined points of an adaptive sweep).
+        x need not be increasing (e.g. a return sweep).
+        '''
+        if pen is not None:
+            self.item.setPen(pen)
+        if len(x) == 0:
+            return
+        x = np.asarray(x, dtype = float)
+        y = np.asarray(y, dtype = float)
+        if index is None or index >= len(self.x):
+            self.monotonic = self.monotonic and bool(np.all(np.diff(x) >= 0)) and not (len(self.x) and x[0] < self.x[-1])
+            self.x = np.concatenate((self.x, x))
+            self.y = np.concatenate((self.y, y))
+        else:
+            self.x = np.insert(self.x, index, x)
+            self.y = np.insert(self.y, index, y)
+            self.monotonic = bool(np.all(np.diff(self.x) >= 0))
+        self.redraw()
+
+    def clear(self):
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self.monotonic = True
+        self.item.setData([], [])
+
+    def range_changed(self, *args):
+        if not self.plot_item.getViewBox().autoRangeEnabled()[0]: # otherwise all points are drawn already
+            self.redraw()
+
+    def redraw(self):
+        view = self.plot_item.getViewBox()
+        pixels = max(int(view.width()), 100)
+        x_range = (None, None) if view.autoRangeEnabled()[0] else view.viewRange()[0]
+        if self.source is not None:
+            x, y = self.source.view(x_range[0], x_range[1], 4 * pixels)
+        elif not self.monotonic:
+            self.item.setData(self.x, self.y)
+            return
+        else:
+            x, y = self.x, self.y
+            if x_range[0] is not None:
+                start = max(np.searchsorted(x, x_range[0]) - 1, 0)
+                stop = np.searchsorted(x, x_range[1], side = 'right') + 1
+                x, y = x[start:stop], y[start:stop]
+        self.item.setData(*minmax_decimate(x, y, pixels))
@@ -0,0 +1,101 @@
+'''
+Queue of pixels to measure one after another through the relay boards, each with its own recipe.
+
+A recipe is a dict of TestDeviceMeasure settings (e.g. V_DS, V_G_start, number_of_transfer_curves, output_V_G)
+that differ from the values in the panel. Jobs are read from a JSON file, a list of objects with a pixel key
+and the recipe, or made for a list of pixels with an empty recipe.
+'''
+import json
+import numpy as np
+
+
+class PixelJob(object):
+    '''
+    One pixel to measure with a recipe, and the outcome once it has been tried.
+    '''
+
+    def __init__(self, pixel, recipe = None):
+        self.pixel = pixel # key of TestDeviceMeasure.pixels, e.g. '2: 800'
+        self.recipe = dict(recipe or {})
+        self.status = 'pending' # then done, interrupted, skipped, rejected (failed screening) or aborted (compliance)
+        self.attempts = 0
+        self.error = ''
+        self.screen = {} # screening results, see screen_values()
+
+
+def parse_pixels(text, pixels):
+    '''
+    Pixel keys for text, a comma separated list of pixel keys or relay numbers, or 'all'.
+    pixels -- dict of pixel key: relay number
+    '''
+    if text.strip().lower() == 'all':
+        return sorted(pixels, key = pixels.get)
+    keys = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        matches = [k for k, n in pixels.items() if item == k or item == str(n)]
+        if not matches:
+            raise ValueError('Unknown pixel %r' % item)
+        keys.append(matches[0])
+    return keys
+
+
+def load_jobs(filename, pixels):
+    '''
+    Jobs from a JSON file: [{"pixel": "2: 800", "V_DS": -0.6, ...}, ...]. The pixel may be a relay number.
+    '''
+    with open(filename) as f:
+        entries = json.load(f)
+    jobs = []
+    for entry in entries:
+        recipe = dict(entry)
+        pixel = parse_pixels(str(recipe.pop('pixel')), pixels)[0]
+        jobs.append(PixelJob(pixel, recipe))
+    return jobs
+
+
+def order_jobs(jobs, pixels, connected = None):
+    '''
+    Order jobs so each pixel is switched to once: all jobs of a pixel run back to back, starting with the
+    pixel already connected, then by relay number. Jobs of the same pixel keep their order.
+    '''
+    def key(job):
+        return (job.pixel != connected, pixels[job.pixel])
+    return sorted(jobs, key = key)
+
+
+def screen_values(i_ds, i_g):
+    '''
+    Figures of a pixel from I_DS and I_G [A] read at a few gate biases: the largest |I_DS| (on current),
+    its ratio to the smallest (on/off ratio, whatever the polarity of the device) and the largest |I_G|.
+    '''
+    i_ds = np.abs(i_ds)
+    return {'on_current': float(np.max(i_ds)),
+            'on_off_ratio': float(np.max(i_ds) / max(np.min(i_ds), 1e-15)),
+            'gate_leakage': float(np.max(np.abs(i_g)))}
+
+
+def screen_reason(values, min_on_current, min_on_off_ratio, max_gate_leakage):
+    '''
+    Why a pixel with screen_values() values fails screening, '' if it passes.
+    '''
+    if values['gate_leakage'] > max_gate_leakage:
+        return 'gate short: I_G %.3g A' % values['gate_leakage']
+    if values['on_current'] < min_on_current:
+        return 'open channel: I_DS %.3g A' % values['on_current']
+    if values['on_off_ratio'] < min_on_off_ratio:
+        return 'no gating: on/off ratio %.3g' % values['on_off_ratio']
+    return ''
+
+
+def write_summary(filename, jobs):
+    '''
+    One tab separated line per job: pixel, status, attempts, error, screening results and recipe.
+    '''
+    with open(filename, 'w') as f:
+        f.write('Pixel\tStatus\tAttempts\tError\tScreen\tRecipe\n')
+        for job in jobs:
+            f.write('%s\t%s\t%d\t%s\t%s\t%s\n' % (job.pixel, job.status, job.attempts, job.error, json.dumps(job.screen),
+                                                json.dumps(job.recipe)))
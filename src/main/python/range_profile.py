@@ -0,0 +1,47 @@
+'''
+Currents seen along a sweep, remembered to prerange the same sweep next time.
+'''
+import bisect
+import numpy as np
+
+
+class RangeProfile(object):
+    '''
+    Magnitude of the current read at each bias of a sweep on one device.
+    '''
+
+    def __init__(self, resolution = 1e-4):
+        '''
+        resolution [V]: biases closer than this count as the same point
+        '''
+        self.resolution = resolution
+        self.keys = [] # sorted bias keys
+        self.currents = {}
+
+    def key(self, v):
+        return int(round(v / self.resolution))
+
+    def record(self, v, current):
+        '''
+        Remember |current| [A] read at bias v [V]. Over-range and NaN readings are ignored.
+        '''
+        if not np.isfinite(current) or abs(current) >= 9.9e37:
+            return
+        k = self.key(v)
+        if k not in self.currents:
+            bisect.insort(self.keys, k)
+        self.currents[k] = abs(current)
+
+    def expected(self, v):
+        '''
+        Current [A] to expect at bias v: the larger of the currents recorded at the nearest biases on
+        either side, or at v itself. None when nothing has been recorded.
+        '''
+        if not self.keys:
+            return None
+        k = self.key(v)
+        if k in self.currents:
+            return self.currents[k]
+        i = bisect.bisect_left(self.keys, k)
+        neighbours = self.keys[max(i - 1, 0):i + 1]
+        return max(self.currents[n] for n in neighbours)
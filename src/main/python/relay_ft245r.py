@@ -31,6 +31,10 @@
 #   18/06/12 vpatron
 #      Made compatible with Windows. Converted to object style. Excludes FT232
 #      boards. See https://github.com/vpatron/relay_ft245r
+#   26/10/18
+#      setmask() sets all 8 relays in one USB transfer and skips the transfer if
+#      they are already in that state. Any object with find() like usb.core
+#      can stand in for PyUSB, see relay_ft245r_sim.
 
 
 """relay_ft245r
@@ -72,8 +76,29 @@ import usb.core
 import usb.util
 import platform
 
+
+def relay_mask(relays):
+    """
+    Returns the relay_state byte with the relays numbered in relays on and all
+    others off.
+
+    @param relays: relay numbers
+    """
+    mask = 0
+    for relay_num in relays:
+        if relay_num < 1 or relay_num > 8:
+            raise ValueError('Relay number {} is invalid'.format(relay_num))
+        mask |= 1 << (relay_num - 1)
+    return mask
+
+
 class FT245R:
-    def __init__(self):
+    def __init__(self, usb_core=None):
+        """
+        @param usb_core: finds the devices, usb.core unless given (e.g.
+        relay_ft245r_sim.SimulatedUSB for boards without hardware)
+        """
+        self.usb_core = usb.core if usb_core is None else usb_core
         self.VID = 0x0403                   # USB Vendor ID of FT245R and FT232
         self.PID = 0x6001                   # USB Product ID of FT245R and FT232
         self.PROD_STR = u'FT245R USB FIFO'  # differentiate from FT232 USB UART
@@ -90,7 +115,7 @@ class FT245R:
         @return: device list
         """
         ret = []
-        for dev in usb.core.find(find_all=True,
+        for dev in self.usb_core.find(find_all=True,
                                  idVendor=self.VID,
                                  idProduct=self.PID):
 
@@ -212,31 +237,47 @@ class FT245R:
         return
 
 
-    def switchoff(self, relay_num):
+    def setmask(self, mask):
         """
-        Switches relay relay_num off.
+        Sets all 8 relays at once, bit n-1 of mask for relay n, in a single
+        transfer. Nothing is written if the relays are in that state already.
 
-        @param relay_num: which relay
+        @param mask: relay state byte, see relay_mask()
+        @return: True if the relays were written
         """
 
         # Check for errors
-        if relay_num < self.RELAY_MIN or relay_num > self.RELAY_MAX:
-            raise ValueError('Relay number {} is invalid'.format(relay_num))
+        if mask < 0 or mask > 0xff:
+            raise ValueError('Relay mask {} is invalid'.format(mask))
         if not self.is_connected:
             raise IOError('Must connect to device first')
-
-        # Clear the bit representing relay_num and mask it into the existing
-        # relay_state
-        buf = [0]
-        buf[0] = self.relay_state & ~(1 << (relay_num - 1))
+        if mask == self.relay_state:
+            return False
 
         # Write status
-        ret = self.dev.write(0x02, buf, 500)
+        ret = self.dev.write(0x02, [mask], 500)
         if ret < 0:
             raise RuntimeError("relayctl: failure to write status")
 
         # Save status
-        self.relay_state = buf[0]
+        self.relay_state = mask
+        return True
+
+
+    def switchoff(self, relay_num):
+        """
+        Switches relay relay_num off.
+
+        @param relay_num: which relay
+        """
+
+        # Check for errors
+        if relay_num < self.RELAY_MIN or relay_num > self.RELAY_MAX:
+            raise ValueError('Relay number {} is invalid'.format(relay_num))
+
+        # Clear the bit representing relay_num and mask it into the existing
+        # relay_state
+        self.setmask(self.relay_state & ~(1 << (relay_num - 1)))
         return
 
 
@@ -250,19 +291,8 @@ class FT245R:
         # Check for errors
         if relay_num < self.RELAY_MIN or relay_num > self.RELAY_MAX:
             raise ValueError('Relay number {} is invalid'.format(relay_num))
-        if not self.is_connected:
-            raise IOError('Must connect to device first')
 
         # Set the bit representing relay_num and mask it into the existing
         # relay_state
-        buf = [0]
-        buf[0] = self.relay_state | (1 << (relay_num - 1))
-
-        # Write status
-        ret = self.dev.write(0x02, buf, 500)
-        if ret < 0:
-            raise RuntimeError("relayctl: failure to write status")
-
-        # Save status
-        self.relay_state = buf[0]
+        self.setmask(self.relay_state | (1 << (relay_num - 1)))
         return
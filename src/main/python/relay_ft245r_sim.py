@@ -0,0 +1,88 @@
+'''
+In-process emulation of FT245R relay boards for running and benchmarking the relay switching without hardware.
+
+FT245R uses it in place of PyUSB when given a SimulatedUSB as usb_core, e.g. FT245R(SimulatedUSB()).
+The emulated board understands the requests relay_ft245r sends: bitbang mode on and off, reading the pins
+and writing all 8 relays. Every USB transfer costs a configurable latency and is counted, so the number of
+transfers a relay change takes can be checked.
+'''
+import time
+
+VID = 0x0403
+PID = 0x6001
+PRODUCT = u'FT245R USB FIFO'
+
+SET_BITMODE = 0x0b # control requests
+READ_PINS = 0x0c
+
+
+class SimulatedFT245R(object):
+    '''
+    Stands in for the usb.core.Device of one relay board.
+    '''
+
+    def __init__(self, product = PRODUCT, latency = 0.001):
+        '''
+        product -- product string, boards other than PRODUCT (e.g. FT232 UARTs) are ignored by FT245R
+        latency [sec]: bus time of every transfer
+        '''
+        self.idVendor = VID
+        self.idProduct = PID
+        self.product = product
+        self.latency = latency
+        self.kernel_driver = True
+        self.bitbang = False
+        self.pins = 0 # relay n is on when bit n-1 is set
+        self.writes = 0 # writes to the relays
+        self.transfers = 0 # all transfers, control ones included
+
+    def is_kernel_driver_active(self, interface):
+        return self.kernel_driver
+
+    def detach_kernel_driver(self, interface):
+        self.kernel_driver = False
+
+    def attach_kernel_driver(self, interface):
+        self.kernel_driver = True
+
+    def set_configuration(self):
+        pass
+
+    def transfer(self):
+        time.sleep(self.latency)
+        self.transfers += 1
+
+    def ctrl_transfer(self, request_type, request, value = 0, index = 0, data = None, timeout = None):
+        self.transfer()
+        if request == SET_BITMODE:
+            self.bitbang = bool(value & 0x0100)
+            return 0
+        if request == READ_PINS:
+            return bytes([self.pins])
+        raise ValueError('Unsupported request 0x{:02x}'.format(request))
+
+    def write(self, endpoint, data, timeout = None):
+        self.transfer()
+        if not self.bitbang:
+            raise IOError('Bitbang mode is off')
+        self.pins = data[-1]
+        self.writes += 1
+        return len(data)
+
+
+class SimulatedUSB(object):
+    '''
+    Stands in for usb.core, finding a number of simulated relay boards.
+    '''
+
+    def __init__(self, boards = 2, **options):
+        '''
+        options -- passed on to every SimulatedFT245R
+        '''
+        self.devices = [SimulatedFT245R(**options) for _ in range(boards)]
+
+    def find(self, find_all = False, idVendor = None, idProduct = None):
+        devices = [dev for dev in self.devices if idVendor in (None, dev.idVendor) and idProduct in (None, dev.idProduct)]
+        if find_all:
+            return devices
+        return devices[0] if devices else None
@@ -0,0 +1,105 @@
+'''
+Write data files on a background thread so acquisition does not wait on the disk.
+
+Measurements hand over save calls with snapshots of their data, which are run in order on one writer thread.
+The queue is bounded: when the disk falls behind, submit() blocks until there is room again, so memory
+stays bounded too. A failed save is raised in the measurement thread at the next submit() or flush().
+'''
+import atexit
+import os
+import queue
+import threading
+import numpy as np
+
+
+def snapshot(array):
+    '''
+    Read-only copy of array to hand to the writer.
+    '''
+    array = np.array(array)
+    array.flags.writeable = False
+    return array
+
+
+def write_text(filename, text):
+    with open(filename, 'w') as f:
+        f.write(text)
+
+
+def free_filename(directory, samplename, append):
+    '''
+    directory/samplename + append, or if that exists the first directory/samplename_<i>_ + append that does not,
+    as check_filename() of the measurements names files. Call it on the writer thread right before writing,
+    so the files still queued count as taken.
+    '''
+    filename = directory + "/" + samplename + append
+    if os.path.exists(filename):
+        for i in range(100): #hard limit of 100 checks
+            candidate = directory + "/" + samplename + '_' + str(i) + '_' + append
+            if not os.path.exists(candidate):
+                return candidate
+    return filename
+
+
+class SaveService(object):
+    '''
+    One writer thread fed by a bounded queue of save calls.
+    '''
+
+    def __init__(self, max_pending = 4):
+        '''
+        max_pending -- saves queued before submit() blocks
+        '''
+        self.queue = queue.Queue(maxsize = max_pending)
+        self.errors = []
+        self.thread = threading.Thread(target = self.work, name = 'SaveService', daemon = True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def work(self):
+        while True:
+            call = self.queue.get()
+            try:
+                if call is None:
+                    return
+                fn, args, kwargs = call
+                fn(*args, **kwargs)
+            except Exception as err:
+                self.errors.append(err)
+            finally:
+                self.queue.task_done()
+
+    def submit(self, fn, *args, **kwargs):
+        '''
+        Queue fn(*args, **kwargs) for the writer thread. The arguments must not change afterwards,
+        pass arrays through snapshot(). Blocks while the queue is full.
+        '''
+        self.check()
+        self.queue.put((fn, args, kwargs))
+
+    def flush(self):
+        '''
+        Wait until everything queued has been written, then raise the first error if any save failed.
+        '''
+        self.queue.join()
+        self.check()
+
+    def check(self):
+        '''
+        Raise the first error of a failed save and forget it.
+        '''
+        if self.errors:
+            err = self.errors.pop(0)
+            raise IOError('Saving data failed: {}'.format(err)) from err
+
+    def close(self):
+        '''
+        Write everything queued and stop the writer thread. Errors are printed rather than raised.
+        '''
+        if not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join()
+        for err in self.errors:
+            print('Saving data failed:', err)
+        self.errors = []
@@ -0,0 +1,48 @@
+'''
+Wait for a reading to settle after a bias step instead of sleeping a fixed delay.
+'''
+import time
+import numpy as np
+
+
+def remaining_change(readings):
+    '''
+    Estimate of how far the reading still has to move, from the means of three equal windows covering the
+    readings. For an exponential decay sampled at regular intervals the window means approach the final
+    value geometrically: each change is q times the one before, and the change still to come is the last
+    one times q / (1 - q). Changes that are not shrinking mean the reading is still moving freely (inf);
+    changes of opposite sign are noise, and the last change is returned.
+    '''
+    n = len(readings) // 3
+    if n == 0:
+        return np.inf
+    means = np.asarray(readings[len(readings) - 3 * n:]).reshape(3, n).mean(axis = 1)
+    previous, last = means[1] - means[0], means[2] - means[1]
+    if last * previous <= 0:
+        return abs(last)
+    q = last / previous
+    if q >= 1:
+        return np.inf
+    return abs(last) * q / (1 - q)
+
+
+def wait_settled(read, tolerance, abs_tolerance = 0, interval = 0, timeout = np.inf):
+    '''
+    Sample read() until it has settled or timeout [sec] has passed.
+    Settled once remaining_change() of the samples so far is within tolerance * |reading| + abs_tolerance,
+    so a slow decay keeps waiting even when its successive steps are small.
+    interval [sec]: minimum time from one sample to the next
+    Returns (settle time [sec], last reading).
+    '''
+    t0 = time.perf_counter()
+    t_sample = t0
+    readings = [read()]
+    while True:
+        elapsed = time.perf_counter() - t0
+        if elapsed >= timeout:
+            return elapsed, readings[-1]
+        time.sleep(max(0, min(interval - (time.perf_counter() - t_sample), timeout - elapsed)))
+        t_sample = time.perf_counter()
+        readings.append(read())
+        if remaining_change(readings) <= tolerance * abs(readings[-1]) + abs_tolerance:
+            return time.perf_counter() - t0, readings[-1]
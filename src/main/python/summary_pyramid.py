@@ -0,0 +1,149 @@
+'''
+Multi-resolution summary of a long trace, for browsing it at any zoom.
+
+Level 1 summarizes every factor raw samples as one row (first and last time, min, max, mean and count of
+the readings), level 2 every factor level 1 rows, and so on. Levels are built as the samples arrive, each in
+its own ChunkedStore, so the summary of a run of any length is always up to date and bounded in memory.
+To draw a time range, the coarsest level that still gives enough points for the plot width is read, and only
+its rows within the range.
+'''
+import threading
+import numpy as np
+from chunked_store import ChunkedStore
+
+COLUMNS = ['t_first', 't_last', 'min', 'max', 'mean', 'count']
+
+
+def summarize(blocks):
+    '''
+    Summary rows of blocks, an array (n, rows per block, len(COLUMNS)) of lower level rows.
+    '''
+    count = blocks[:, :, 5].sum(axis = 1)
+    total = np.where(blocks[:, :, 5] > 0, blocks[:, :, 4] * blocks[:, :, 5], 0).sum(axis = 1)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = np.where(count > 0, total / count, np.nan)
+    return np.column_stack((blocks[:, 0, 0], blocks[:, -1, 1], np.fmin.reduce(blocks[:, :, 2], axis = 1),
+                            np.fmax.reduce(blocks[:, :, 3], axis = 1), mean, count))
+
+
+def envelope(rows):
+    '''
+    Points to draw summary rows: the min at the first time and the max at the last time of each row.
+    '''
+    x = np.empty(2 * rows.shape[0])
+    y = np.empty(2 * rows.shape[0])
+    x[0::2], x[1::2] = rows[:, 0], rows[:, 1]
+    y[0::2], y[1::2] = rows[:, 2], rows[:, 3]
+    return x, y
+
+
+class SummaryPyramid(object):
+    '''
+    Summary levels over the raw rows of a ChunkedStore, whose x_column increases down the table.
+    Filled from the acquisition thread with extend(), read from any thread with view().
+    '''
+
+    def __init__(self, data, x_column, y_column, factor = 8, memory_cap = 64e6, directory = None, on_rows = None):
+        '''
+        data -- ChunkedStore of the raw rows, appended to by the caller
+        factor -- rows of a level summarized by one row of the next
+        memory_cap [bytes], directory -- passed to the ChunkedStore of each level
+        on_rows -- called as on_rows(level, rows) with every batch of new summary rows, e.g. to save them
+        '''
+        self.data = data
+        self.x_column = x_column
+        self.y_column = y_column
+        self.factor = factor
+        self.memory_cap = memory_cap
+        self.directory = directory
+        self.on_rows = on_rows
+        self.levels = [] # ChunkedStore of level 1, 2, ...
+        self.pending = [np.empty((0, len(COLUMNS)))] # rows of each level not summarized by the next level yet
+        self.rows = 0 # raw rows summarized
+        self.x_first = self.x_last = None
+        self.lock = threading.Lock()
+
+    def extend(self, x, y):
+        '''
+        Add raw samples, already appended to data.
+        '''
+        x = np.atleast_1d(np.asarray(x, dtype = float))
+        y = np.atleast_1d(np.asarray(y, dtype = float))
+        if x.shape[0] == 0:
+            return
+        rows = np.column_stack((x, x, y, y, y, ~np.isnan(y)))
+        with self.lock:
+            if self.x_first is None:
+                self.x_first = x[0]
+            self.x_last = x[-1]
+            self.rows += x.shape[0]
+            self.pending[0] = np.concatenate((self.pending[0], rows))
+            level = 0
+            while level < len(self.pending) and self.pending[level].shape[0] >= self.factor:
+                n = self.pending[level].shape[0] // self.factor * self.factor
+                summary = summarize(self.pending[level][:n].reshape(-1, self.factor, len(COLUMNS)))
+                self.pending[level] = self.pending[level][n:]
+                self.add_rows(level + 1, summary)
+                level += 1
+
+    def add_rows(self, level, rows):
+        if level > len(self.levels):
+            self.levels.append(ChunkedStore(len(COLUMNS), block_rows = 1024, memory_cap = self.memory_cap,
+                                            directory = self.directory))
+            self.pending.append(np.empty((0, len(COLUMNS))))
+        self.levels[level - 1].extend(rows)
+        self.pending[level] = np.concatenate((self.pending[level], rows))
+        if self.on_rows is not None:
+            self.on_rows(level, rows)
+
+    def finish(self):
+        '''
+        Summarize the samples left over at the end of the acquisition as one partial row per level, so every
+        level covers the whole trace.
+        '''
+        with self.lock:
+            for level in range(1, len(self.levels) + 1):
+                if self.pending[level - 1].shape[0]:
+                    self.add_rows(level, summarize(self.pending[level - 1][np.newaxis]))
+                    self.pending[level - 1] = self.pending[level - 1][:0]
+
+    def level_for(self, x_min, x_max, max_points):
+        '''
+        Coarsest level with no fewer than max_points / 2 points between x_min and x_max (0 for the raw rows),
+        assuming evenly spaced samples.
+        '''
+        if self.rows < 2 or self.x_last <= self.x_first:
+            return 0
+        visible = self.rows * (min(x_max, self.x_last) - max(x_min, self.x_first)) / (self.x_last - self.x_first)
+        level = int(np.floor(np.log(max(2 * visible / max_points, 1)) / np.log(self.factor)))
+        return min(level, len(self.levels))
+
+    def view(self, x_min = None, x_max = None, max_points = 4000):
+        '''
+        (x, y) to draw the trace between x_min and x_max (all of it for None), from the coarsest level giving
+        at least max_points / 2 points there.
+        '''
+        with self.lock:
+            if self.x_first is None:
+                return np.empty(0), np.empty(0)
+            x_min = self.x_first if x_min is None else x_min
+            x_max = self.x_last if x_max is None else x_max
+            level = self.level_for(x_min, x_max, max_points)
+            if level > 0:
+                sizes = len(self.levels[level - 1])
+                tail = np.concatenate(self.pending[level - 1::-1])
+        if level == 0:
+            rows = self.data.between(self.x_column, x_min, x_max)
+            return rows[:, self.x_column], rows[:, self.y_column]
+        rows = np.concatenate((self.levels[level - 1].between(0, x_min, x_max, rows = sizes), tail))
+        inside = (rows[:, 1] >= x_min) & (rows[:, 0] <= x_max)
+        inside[:-1] |= inside[1:] # keep one row on each side of the range
+        inside[1:] |= inside[:-1].copy()
+        return envelope(rows[inside])
+
+    def close(self):
+        '''
+        Delete the spilled blocks of all levels.
+        '''
+        for store in self.levels:
+            store.close()
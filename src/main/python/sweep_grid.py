@@ -0,0 +1,48 @@
+'''
+Choose where to add points to a measured sweep.
+'''
+import numpy as np
+
+
+def steep_intervals(x, y, threshold):
+    '''
+    Intervals of the curve (x, y), both scaled to a span of 1, to split.
+    An interval is steep when y changes by more than threshold over it, i.e. |dy/dx| > threshold / dx.
+    An interval bends when it ends at a point that is off the straight line through its neighbours by more than
+    threshold, i.e. linear interpolation misses the curve by more than threshold times its span.
+    '''
+    dx = np.diff(x)
+    split = np.abs(np.diff(y)) > threshold
+    bend = np.abs(y[1:-1] - (y[:-2] + (y[2:] - y[:-2]) * dx[:-1] / (dx[:-1] + dx[1:])))
+    curved = bend > threshold
+    split[:-1] |= curved
+    split[1:] |= curved
+    return split
+
+
+def refine_points(voltages, currents, threshold, floor = 0):
+    '''
+    Midpoints of the intervals of a monotonic sweep where the current is steep or bends.
+    Voltages and currents are scaled to the span of the sweep, and an interval is split when steep_intervals()
+    flags it. threshold is the largest change of the current over one interval, and the largest interpolation
+    error, as a fraction of its span: a straight line over n intervals changes by 1/n per interval, so 0.1
+    leaves a 15 point line alone but splits the steep part and the knee of a 15 point transfer curve.
+    floor [A]: if above 0, log10 |I| clipped at floor is checked as well, which picks out the
+    subthreshold region where the current is too small to show on a linear scale.
+    Returns the midpoints in sweep order.
+    '''
+    voltages = np.asarray(voltages, dtype = float)
+    currents = np.asarray(currents, dtype = float)
+    v_span = np.ptp(voltages) if voltages.shape[0] else 0
+    if voltages.shape[0] < 3 or v_span == 0 or not np.all(np.isfinite(currents)):
+        return np.array([])
+    x = (voltages - voltages[0]) / v_span
+    split = np.zeros(voltages.shape[0] - 1, dtype = bool)
+    curves = [currents]
+    if floor > 0:
+        curves.append(np.log10(np.maximum(np.abs(currents), floor)))
+    for y in curves:
+        span = np.ptp(y)
+        if span > 0:
+            split |= steep_intervals(x, y / span, threshold)
+    return (voltages[:-1][split] + voltages[1:][split]) / 2
@@ -14,6 +14,11 @@ from output_curve_measure import OutputCurveMeasure
 from transfer_curve_measure import TransferCurveMeasure
 
 from relay_ft245r import FT245R
+from save_service import SaveService
+from checkpoint import Checkpoint
+from pixel_batch import PixelJob, parse_pixels, load_jobs, order_jobs, write_summary, screen_values, screen_reason
+from instrument_executor import InstrumentExecutor
+from compliance import ComplianceError
 
 class TestDeviceMeasure(GeneralCurveMeasure):
     #class variables determining vhich device's voltage will go through a sweep and which will be constant
@@ -25,6 +30,18 @@ class TestDeviceMeasure(GeneralCurveMeasure):
     READ_NUMBER = 1
     
     SOURCECOM = 'COM6' # USB relay, front
+
+    connected_pixel = None # pixel the relays were last switched to
+
+    connected_shown = None # pixel the relay panel shows, see update_display
+    output_v_g = None # output curve gate voltages of the recipe being run, None for the panel's
+
+    # settings a recipe may set, besides output_V_G (the output curve gate voltages)
+    RECIPE_SETTINGS = ('V_G_start', 'V_G_finish', 'V_G_step_size', 'V_DS', 'G_sweep_preread_delay',
+                       'G_sweep_first_bias_settle', 'G_sweep_software_averages', 'G_sweep_return_sweep',
+                       'number_of_transfer_curves', 'V_DS_start', 'V_DS_finish', 'V_DS_step_size',
+                       'DS_sweep_preread_delay', 'DS_sweep_first_bias_settle', 'DS_sweep_software_averages',
+                       'DS_sweep_return_sweep')
     DRAINCOM = 'COM3' #USB Relay, back
     
     def switch_setting(self):
@@ -69,6 +86,24 @@ class TestDeviceMeasure(GeneralCurveMeasure):
         self.settings.New('dimension', str, choices = self.dimension_choice.keys(), initial = '4000 x 10')
         self.settings.New('thickness', unit = "nm", initial = 50)
         self.settings.New('pixel', str, choices = self.pixels.keys(), initial = '2: 800')
+        self.settings.New('io_stats', bool, initial = False)
+        self.settings.New('save_h5', bool, initial = True)
+        self.settings.New('save_txt', bool, initial = True)
+        self.saver = SaveService() # curves are written off the acquisition thread
+        self.settings.New('batch', bool, initial = False)
+        self.settings.New('batch_pixels', str, initial = 'all') # comma separated pixels or relay numbers
+        self.settings.New('batch_file', dtype = 'file', initial = '') # JSON list of pixels with their recipes
+        self.settings.New('batch_retries', int, initial = 1, vmin = 0)
+        self.settings.New('screen', bool, initial = True) # quick check of the batch pixels before their sequences
+        self.settings.New('screen_V_G', str, initial = '-0.6, 0, 0.6') # gate biases, comma separated [V]
+        self.settings.New('screen_V_DS', unit = 'V', si = True, initial = -0.6, spinbox_decimals = 3, spinbox_step = 0.025)
+        self.settings.New('screen_settle', unit = 'ms', si = True, initial = 50)
+        self.settings.New('screen_NPLC', initial = 0.1, spinbox_decimals = 2)
+        self.settings.New('screen_min_on_current', unit = 'A', si = True, initial = 1e-8)
+        self.settings.New('screen_min_on_off_ratio', initial = 5)
+        self.settings.New('screen_max_gate_leakage', unit = 'A', si = True, initial = 1e-5)
+        self.resuming = False
+        self.add_operation('resume', self.resume)
         self.v_g_spinboxes = self.ui.v_g_groupBox.findChildren(QtGui.QDoubleSpinBox) #array of v_g spinboxes
         self.ui.radioButton_relay.toggled.connect(self.use_relay)
         self.ui.radioButton_manual.toggled.connect(self.use_relay)
@@ -118,41 +153,29 @@ class TestDeviceMeasure(GeneralCurveMeasure):
         """Sets the relay to the manual positions checked """
         if self.relay_exists:
             
-            for n, d in enumerate(self.drain_boxes, 1):
+            self.switch_relays([n for n, d in enumerate(self.drain_boxes, 1) if d.isChecked()],
+                               [n for n, s in enumerate(self.source_boxes, 1) if s.isChecked()])
             
-                if d.isChecked() == True:
-                    self.relay_d.switchon(n)
-                    d.setStyleSheet("font-weight: bold; color: green")
-                else:
-                    self.relay_d.switchoff(n)
-                    d.setStyleSheet("font-weight: normal; color: black")
-                    
-            for n, s in enumerate(self.source_boxes, 1):
-                
-                if s.isChecked() == True:
-                    self.relay_s.switchon(n)
-                    s.setStyleSheet("font-weight: bold; color: green")
+            for box in self.drain_boxes + self.source_boxes:
+            
+                if box.isChecked() == True:
+                    box.setStyleSheet("font-weight: bold; color: green")
                 else:
-                    self.relay_s.switchoff(n)
-                    s.setStyleSheet("font-weight: normal; color: black")
+                    box.setStyleSheet("font-weight: normal; color: black")
                         
         return
 
     def reset_relay(self):
         """Turns all connections on both relays off """
+        self.connected_pixel = None
         if self.relay_exists:
             
-            for n, d in enumerate(self.drain_boxes, 1):
+            for box in self.drain_boxes + self.source_boxes:
                 
-                d.setChecked(False)
-                self.relay_d.switchoff(n)
-                d.setStyleSheet("font-weight: normal; color: black")
-                    
-            for n, s in enumerate(self.source_boxes, 1):
+                box.setChecked(False)
+                box.setStyleSheet("font-weight: normal; color: black")
                 
-                s.setChecked(False)
-                self.relay_s.switchoff(n)
-                s.setStyleSheet("font-weight: normal; color: black")
+            self.switch_relays([], [])
                         
         return
     
@@ -188,6 +211,7 @@ class TestDeviceMeasure(GeneralCurveMeasure):
 
         self.ds_plot = self.graph_layout.addPlot(title='Keithley 2400 2')
         self.ds_plot.setLabel('left', 'I_DS')
+        self.setup_live_curves()
 
         self.graph_layout.window().setWindowFlag(QtCore.Qt.WindowCloseButtonHint, False)
 
@@ -203,6 +227,8 @@ class TestDeviceMeasure(GeneralCurveMeasure):
 
     def update_display(self):
         GeneralCurveMeasure.update_display(self)
+        if self.connected_shown != self.connected_pixel:
+            self.show_connected_pixel()
         if (self.switched):
             self.g_plot.setLabel('bottom', 'V_DS')
             self.ds_plot.setLabel('bottom', 'V_DS')
@@ -211,14 +237,29 @@ class TestDeviceMeasure(GeneralCurveMeasure):
     def pre_run(self):
         '''
         Other pre_run steps are taken care of in run(), since Transfer and Output
-        have their own procedures.
+        have their own procedures. In batch mode the pixel steps are taken for each pixel in run_batch().
         '''
         self.graph_layout.show()
         self.switched = False
+        self.batch = self.settings['batch']
+        self.output_v_g = None
+        if self.batch and not (self.relay_exists and self.use_relay):
+            raise RuntimeError('Batch mode needs the relay boards')
+        if not self.batch:
+            self.start_checkpoint()
+        self.resuming = False
         self.dimension = self.settings['dimension'] = self.ui.dimension_comboBox.currentText()
         self.thickness = self.settings['thickness'] = self.ui.thickness_doubleSpinBox.value()
         self.ds_plot.setLabel('bottom', 'V_G')
         self.g_plot.setLabel('bottom', 'V_G')
+        if not self.batch:
+            self.start_pixel()
+
+    def start_pixel(self):
+        '''
+        Open the HDF5 file of the pixel in the pixel setting and connect the pixel through the relays.
+        '''
+        self.open_h5('_test_device.h5') # one file for all curves of the pixel
         
         # Open the correct Relay port
         # The command is always b'\xFF\x00' and then the last byte is related to the port
@@ -239,46 +280,101 @@ class TestDeviceMeasure(GeneralCurveMeasure):
             #self.relay_d.switchon(self.pixels[self.settings['pixel']])
             #self.relay_s.switchon(self.pixels[self.settings['pixel']])
             
-            self.reset_relay()
-            
-            self.drain_boxes[self.pixels[self.settings['pixel']] - 1].setChecked(True)
-            self.source_boxes[self.pixels[self.settings['pixel']] - 1].setChecked(True)
-            
-            self.set_relay()
+            self.connect_pixel(self.settings['pixel'])
                 
             self.dimension = self.settings['pixel'].split(' ')[-1] + ' x 10'
 
+    def connect_pixel(self, pixel):
+        '''
+        Switch both relay boards to pixel only, unless it is connected already.
+        The relay panel follows in update_display, as this runs on the measurement thread.
+        '''
+        if self.connected_pixel == pixel:
+            return
+        if self.relay_exists:
+            self.switch_relays([self.pixels[pixel]], [self.pixels[pixel]])
+        self.connected_pixel = pixel
+
+    def release_pixel(self):
+        '''
+        Disconnect all pixels.
+        '''
+        if self.relay_exists and self.use_relay:
+            
+            #self.relay_d.switchoff(self.pixels[self.settings['pixel']])
+            #self.relay_s.switchoff(self.pixels[self.settings['pixel']])
+            
+            self.switch_relays([], [])
+            self.connected_pixel = None
+
+        #self.relay_d.disconnect()
+        #self.relay_s.disconnect()
+
+    def show_connected_pixel(self):
+        '''
+        Check the relay panel boxes of the connected pixel only.
+        '''
+        relay = self.pixels.get(self.connected_pixel)
+        for boxes in (self.drain_boxes, self.source_boxes):
+            for n, box in enumerate(boxes, 1):
+                box.setChecked(n == relay)
+                box.setStyleSheet("font-weight: bold; color: green" if n == relay else "font-weight: normal; color: black")
+        self.connected_shown = self.connected_pixel
+
     def run(self):
+        if self.batch:
+            self.run_batch()
+        else:
+            self.run_sequence()
+
+    def run_sequence(self):
+        '''
+        Transfer curves, then output curves, of the connected pixel.
+        Stopping the measurement during the transfer curves skips the rest of them and goes on to the output curves,
+        which a second stop ends. Either way the sequence is left unfinished in the checkpoint.
+        '''
         self.read_settings = self.transfer_read_from_settings #overrides general_curve read_settings
-        self.num_transfer_curves = int(self.ui.num_transfer_curves_doubleSpinBox.value())
+        self.num_transfer_curves = int(self.settings['number_of_transfer_curves'])
         for i in range(self.num_transfer_curves):
+            if self.curve_name() in self.checkpoint.completed:
+                self.READ_NUMBER += 1
+                continue
             GeneralCurveMeasure.pre_run(self)
-            GeneralCurveMeasure.run(self)
-            GeneralCurveMeasure.post_run(self)
+            self.resume_curve()
+            self.run_curve()
+            if self.interrupt_measurement_called:
+                break
+            self.checkpoint.end_curve()
             self.sweep_device.source_V(self.v_sweep_start) #reset to sweep start voltage before running another curve
             self.READ_NUMBER += 1
+        interrupted = self.interrupt_measurement_called
         self.switch_setting() #configure variables for output curve
         self.switched = True
         self.READ_NUMBER = 1 #reset file numbering for output curves
 
         self.read_settings = self.output_read_from_settings
-        self.num_output_curves = self.settings['number_of_output_curves'] = int(self.ui.num_output_curves_doubleSpinBox.value())
-        self.output_v_g_values = self.read_output_v_g_spinboxes()
+        self.num_output_curves = int(self.settings['number_of_output_curves'])
+        self.output_v_g_values = self.read_output_v_g()
         
         if self.interrupt_measurement_called:
             self.interrupt_measurement_called  = False
         
-        print(self.output_v_g_values)
         _v_g_restore = self.output_v_g_values[0]
         for v_g_value in self.output_v_g_values:
+            if self.curve_name() in self.checkpoint.completed:
+                self.READ_NUMBER += 1
+                continue
             
             GeneralCurveMeasure.pre_run(self)
             self.ui.v_g_doubleSpinBox.setValue(v_g_value)
             self.v_constant = self.settings['V_G'] = v_g_value
             self.constant_device.source_V(self.v_constant)
+            self.resume_curve()
             
-            GeneralCurveMeasure.run(self)
-            GeneralCurveMeasure.post_run(self)
+            self.run_curve()
+            if self.interrupt_measurement_called:
+                break
+            self.checkpoint.end_curve()
             self.sweep_device.source_V(self.v_sweep_start)
             time.sleep(self.preread_delay * .001)
             self.source_voltage = self.v_sweep_start
@@ -286,11 +382,26 @@ class TestDeviceMeasure(GeneralCurveMeasure):
         self.settings['V_G'] = _v_g_restore
         self.READ_NUMBER = 1 #reset file numbering
         self.switch_setting() #configure variables for transfer curve again
+        self.sequence_done = not (interrupted or self.interrupt_measurement_called)
+
+    def run_curve(self):
+        '''
+        Measure and save one curve. A curve that fails part way, e.g. with ComplianceError under the abort policy,
+        is saved as far as it got before the error is raised again.
+        '''
+        try:
+            GeneralCurveMeasure.run(self)
+        except Exception:
+            try:
+                GeneralCurveMeasure.post_run(self)
+            except Exception as err: # keep the error that stopped the curve
+                print('Could not save', self.curve_name(), err)
+            raise
+        GeneralCurveMeasure.post_run(self)
 
     def post_run(self):
-        if self.SWEEP == "DS": self.switch_setting() #
-        self.READ_NUMBER = 1
-        self.make_config()
+        if not self.batch:
+            self.finish_pixel()
 
 #        try:
 #            cmd = bytearray(b'')
@@ -301,18 +412,229 @@ class TestDeviceMeasure(GeneralCurveMeasure):
 #            self.serial_device.close()
 #        except:
 #            pass
-        if self.relay_exists and self.use_relay:
-            
-            #self.relay_d.switchoff(self.pixels[self.settings['pixel']])
-            #self.relay_s.switchoff(self.pixels[self.settings['pixel']])
-            
-            self.drain_boxes[self.pixels[self.settings['pixel']]].setChecked(False)
-            self.source_boxes[self.pixels[self.settings['pixel']]].setChecked(False)
-            
-            self.reset_relay()
+        self.release_pixel()
 
-        #self.relay_d.disconnect()
-        #self.relay_s.disconnect()
+    def finish_pixel(self):
+        '''
+        Save the config of the pixel's sequence and close its files. The checkpoint is kept if the sequence
+        did not finish.
+        '''
+        if self.SWEEP == "DS": self.switch_setting() #
+        self.READ_NUMBER = 1
+        try:
+            self.make_config()
+        finally:
+            self.close_h5()
+            self.saver.flush()
+            if self.sequence_done:
+                self.checkpoint.remove()
+            self.checkpoint = None
+
+    def abandon_pixel(self):
+        '''
+        After a failed sequence, restore the transfer configuration, close the pixel's HDF5 file and wait for the
+        saves of its curves. Errors are printed, as the failure of the sequence is the one handled.
+        '''
+        if self.SWEEP == "DS": self.switch_setting()
+        self.READ_NUMBER = 1
+        try:
+            self.close_h5()
+            self.saver.flush()
+        except Exception as err:
+            print('Could not save', self.app.settings['sample'], err)
+        self.checkpoint = None
+
+    def run_batch(self):
+        '''
+        Measure the pixels of batch_jobs() one after another, each pixel switched to once and with its own files
+        (sample name + _pixel<relay number>). A failed pixel is tried again up to batch_retries times, then
+        skipped. A pixel failing with ComplianceError (abort compliance policy) is not retried: its config and files
+        are saved as for an interrupted pixel, and the batch goes on. The outcome of every job is written to
+        <sample>_batch.txt.
+        '''
+        jobs = order_jobs(self.batch_jobs(), self.pixels, self.connected_pixel)
+        panel = self.read_recipe() # values of the panel, for settings a recipe does not change
+        sample = self.app.settings['sample']
+        pixel = self.settings['pixel']
+        try:
+            if self.settings['screen']:
+                self.screen_jobs(jobs)
+                jobs = order_jobs(jobs, self.pixels, self.connected_pixel)
+            for n, job in enumerate(jobs):
+                while job.status == 'pending' and not self.interrupt_measurement_called:
+                    job.attempts += 1
+                    self.app.settings['sample'] = '%s_pixel%d' % (sample, self.pixels[job.pixel])
+                    self.settings['pixel'] = job.pixel
+                    try:
+                        self.apply_recipe(dict(panel, **job.recipe))
+                        self.start_checkpoint()
+                        self.start_pixel()
+                        self.run_sequence()
+                        sequence_done = self.sequence_done
+                        self.finish_pixel()
+                        job.status = 'done' if sequence_done else 'interrupted'
+                    except ComplianceError as err: # the abort compliance policy: not retried, on to the next pixel
+                        job.status = 'aborted'
+                        job.error = str(err)
+                        self.finish_pixel()
+                        self.release_pixel()
+                    except Exception as err:
+                        print('Pixel', job.pixel, 'failed:', err)
+                        job.error = repr(err)
+                        self.abandon_pixel()
+                        self.release_pixel() # switch the relays again for the next attempt
+                        if job.attempts > self.settings['batch_retries']:
+                            job.status = 'skipped'
+                if n + 1 == len(jobs) or jobs[n + 1].pixel != job.pixel:
+                    self.release_pixel()
+                if job.status == 'interrupted' or self.interrupt_measurement_called:
+                    break
+        finally:
+            self.app.settings['sample'] = sample
+            self.settings['pixel'] = pixel
+            self.apply_recipe(panel)
+            self.output_v_g = None
+            write_summary(self.app.settings['save_dir'] + "/" + sample + '_batch.txt', jobs)
+
+    def screen_jobs(self, jobs):
+        '''
+        Read I_G and I_DS of each pixel of jobs at the screen_V_G gate biases, with short settles, and reject the
+        jobs of pixels that fail screen_reason(). Takes seconds for all pixels.
+        '''
+        self.g_device = self.g_hw.keithley
+        self.ds_device = self.ds_hw.keithley
+        if hasattr(self, 'io'): self.io.shutdown()
+        self.io = InstrumentExecutor((self.g_device, self.ds_device))
+        v_g_values = [float(v) for v in self.settings['screen_V_G'].split(',')]
+        settle = self.settings['screen_settle'] * .001
+        self.io.gather((self.g_device, self.prepare_screen_device, self.g_hw, v_g_values[0]),
+                       (self.ds_device, self.prepare_screen_device, self.ds_hw, self.settings['screen_V_DS']))
+        results = {}
+        try:
+            for pixel in sorted(set(job.pixel for job in jobs), key = self.pixels.get):
+                if self.interrupt_measurement_called:
+                    return
+                self.connect_pixel(pixel)
+                i_g = np.zeros(len(v_g_values))
+                i_ds = np.zeros(len(v_g_values))
+                for i, v_g in enumerate(v_g_values):
+                    self.g_device.source_V(v_g)
+                    time.sleep(settle)
+                    i_g[i], i_ds[i] = self.io.each('read_I')
+                results[pixel] = screen_values(i_ds, i_g)
+                print('Screening', pixel, results[pixel])
+        finally:
+            self.io.each('write_output_on', False)
+        for job in jobs:
+            job.screen = results[job.pixel]
+            reason = screen_reason(job.screen, self.settings['screen_min_on_current'],
+                                   self.settings['screen_min_on_off_ratio'], self.settings['screen_max_gate_leakage'])
+            if reason:
+                job.status, job.error = 'rejected', reason
+
+    def prepare_screen_device(self, hw, level):
+        '''
+        Reset a keithley for screening: fast current readings at its compliance, sourcing level [V].
+        '''
+        device = hw.keithley
+        with device.batch():
+            device.reset()
+            device.write_current_compliance(hw.settings['current_compliance'])
+            device.measure_current(nplc = self.settings['screen_NPLC'])
+            device.write_output_on()
+            device.source_V(level)
+
+    def batch_jobs(self):
+        '''
+        Jobs of the batch_file setting if given, otherwise one job per pixel of batch_pixels with the panel's values.
+        '''
+        if self.settings['batch_file']:
+            jobs = load_jobs(self.settings['batch_file'], self.pixels)
+        else:
+            jobs = [PixelJob(pixel) for pixel in parse_pixels(self.settings['batch_pixels'], self.pixels)]
+        for job in jobs:
+            for name in job.recipe:
+                if name not in self.RECIPE_SETTINGS and name != 'output_V_G':
+                    raise ValueError('Unknown recipe setting %r for pixel %s' % (name, job.pixel))
+        return jobs
+
+    def read_recipe(self):
+        '''
+        Recipe of the current settings and output curve gate voltages.
+        '''
+        recipe = {name: self.settings[name] for name in self.RECIPE_SETTINGS}
+        self.num_output_curves = int(self.settings['number_of_output_curves'])
+        recipe['output_V_G'] = [float(v) for v in self.read_output_v_g()]
+        return recipe
+
+    def apply_recipe(self, recipe):
+        '''
+        Put the values of recipe in the settings, which the sequence reads. The panel widgets connected to the
+        settings follow on the GUI thread. Output curve gate voltages are kept in output_v_g, not in the panel.
+        '''
+        for name, value in recipe.items():
+            if name == 'output_V_G':
+                self.settings['number_of_output_curves'] = len(value)
+                self.output_v_g = [float(v) for v in value]
+            else:
+                self.settings[name] = value
+
+    def resume(self):
+        '''
+        Start the measurement again, continuing the sequence left by the last interrupted run.
+        '''
+        self.resuming = True
+        self.start()
+
+    def checkpoint_filename(self):
+        return self.app.settings['save_dir'] + "/test_device_checkpoint.json"
+
+    def start_checkpoint(self):
+        '''
+        Load the checkpoint of the interrupted sequence when resuming, restoring its pixel, number of curves
+        and output gate voltages. Otherwise start a new one from the current settings.
+        '''
+        filename = self.checkpoint_filename()
+        self.sequence_done = False
+        if self.resuming and os.path.exists(filename):
+            self.checkpoint = Checkpoint.load(filename)
+            sequence = self.checkpoint.sequence
+            self.settings['pixel'] = sequence['pixel']
+            self.apply_recipe({'number_of_transfer_curves': sequence['transfer_curves'],
+                               'output_V_G': sequence['output_v_g']})
+            print('Resuming after', ', '.join(self.checkpoint.completed) or 'no complete curve')
+        else:
+            self.num_output_curves = int(self.settings['number_of_output_curves'])
+            self.checkpoint = Checkpoint(filename, pixel = self.settings['pixel'],
+                                         transfer_curves = int(self.settings['number_of_transfer_curves']),
+                                         output_v_g = [float(v) for v in self.read_output_v_g()])
+            self.checkpoint.save()
+
+    def resume_curve(self):
+        '''
+        After GeneralCurveMeasure.pre_run: fill in the points of this curve measured before the interruption,
+        bias at the first missing one, and record the curve as in progress. An adaptive grid curve starts over.
+        '''
+        name = self.curve_name()
+        rows = self.checkpoint.partial_rows(name, self.voltages, self.v_constant)
+        if rows and self.adaptive_grid:
+            # refined points are inserted between measured ones, so an adaptive curve resumes from its start
+            print('Adaptive grid: measuring %s again from its first point' % name)
+            rows = []
+        rows = rows if len(rows) <= self.save_array.shape[0] and \
+            all(len(r) == self.save_array.shape[1] for r in rows) else []
+        if rows:
+            self.save_array[:len(rows)] = rows
+            self.first_row = len(rows)
+            self.push_rows(0, self.first_row)
+            if self.first_row < len(self.voltages):
+                self.source_voltage = self.voltages[self.first_row]
+                self.sweep_device.source_V(self.source_voltage)
+                time.sleep(self.first_bias_settle * .001)
+        self.checkpoint.start_curve(name, self.voltages, self.v_constant, rows)
+
+    def pixel_name(self):
+        return self.settings['pixel']
 
     def transfer_read_from_settings(self):
         self.constant_current_compliance = self.constant_hw.settings['current_compliance'] = self.ui.current_compliance_ds_output_doubleSpinBox.value()
@@ -323,21 +645,18 @@ class TestDeviceMeasure(GeneralCurveMeasure):
         self.sweep_current_compliance = self.sweep_hw.settings['current_compliance'] = self.ui.current_compliance_g_output_doubleSpinBox.value()
         self.sweep_nplc = self.sweep_hw.settings['NPLC'] = self.ui.nplc_g_doubleSpinBox.value()
 
-        self.v_sweep_start = self.settings['V_G_start'] = self.ui.v_g_start_doubleSpinBox.value()
-        self.v_sweep_finish = self.settings['V_G_finish'] = self.ui.v_g_finish_doubleSpinBox.value()
-        self.v_sweep_step_size = self.settings['V_G_step_size'] = self.ui.v_g_step_size_doubleSpinBox.value()
-        self.preread_delay = self.settings['%s_sweep_preread_delay' % self.SWEEP] = self.ui.preread_delay_transfer_doubleSpinBox.value()
-        self.delay_between_averages = self.settings['G_sweep_delay_between_averages'] = self.ui.delay_between_averages_transfer_doubleSpinBox.value()
-        self.software_averages = self.settings['G_sweep_software_averages'] = self.ui.software_averages_transfer_doubleSpinBox.value()
-        self.first_bias_settle = self.settings['G_sweep_first_bias_settle'] = self.ui.first_bias_settle_transfer_doubleSpinBox.value()
-        self.return_sweep = self.settings['G_sweep_return_sweep'] = self.ui.return_sweep_transfer_checkBox.isChecked()
-        self.v_constant = self.settings['V_DS'] = self.ui.v_ds_doubleSpinBox.value()
-        self.num_transfer_curves = self.settings['number_of_transfer_curves'] = int(self.ui.num_transfer_curves_doubleSpinBox.value())
+        self.v_sweep_start = self.settings['V_G_start']
+        self.v_sweep_finish = self.settings['V_G_finish']
+        self.v_sweep_step_size = self.settings['V_G_step_size']
+        self.preread_delay = self.settings['%s_sweep_preread_delay' % self.SWEEP]
+        self.delay_between_averages = self.settings['G_sweep_delay_between_averages']
+        self.software_averages = self.settings['G_sweep_software_averages']
+        self.first_bias_settle = self.settings['G_sweep_first_bias_settle']
+        self.return_sweep = self.settings['G_sweep_return_sweep']
+        self.v_constant = self.settings['V_DS']
+        self.num_transfer_curves = int(self.settings['number_of_transfer_curves'])
         self.is_test_wrapper = True
-
-        self.transfer_preread = self.preread_delay # for config file
-        self.transfer_first_bias_settle = self.first_bias_settle
-        self.transfer_vds = self.v_constant
+        self.read_sweep_options()
 
     def output_read_from_settings(self):
         self.constant_current_compliance = self.constant_hw.settings['current_compliance'] = self.ui.current_compliance_g_output_doubleSpinBox.value()
@@ -348,19 +667,25 @@ class TestDeviceMeasure(GeneralCurveMeasure):
         self.sweep_current_compliance = self.sweep_hw.settings['current_compliance'] = self.ui.current_compliance_ds_output_doubleSpinBox.value()
         self.sweep_nplc = self.sweep_hw.settings['NPLC'] = self.ui.nplc_ds_doubleSpinBox.value()
 
-        self.v_sweep_start = self.settings['V_DS_start'] = self.ui.v_ds_start_doubleSpinBox.value()
-        self.v_sweep_finish = self.settings['V_DS_finish'] = self.ui.v_ds_finish_doubleSpinBox.value()
-        self.v_sweep_step_size = self.settings['V_DS_step_size'] = self.ui.v_ds_step_size_doubleSpinBox.value()
-        self.preread_delay = self.settings['DS_sweep_preread_delay'] = self.ui.preread_delay_output_doubleSpinBox.value()
-        self.delay_between_averages = self.settings['DS_sweep_delay_between_averages'] = self.ui.delay_between_averages_output_doubleSpinBox.value()
-        self.software_averages = self.settings['DS_sweep_software_averages'] = self.ui.software_averages_output_doubleSpinBox.value()
-        self.first_bias_settle = self.settings['DS_sweep_first_bias_settle'] = self.ui.first_bias_settle_output_doubleSpinBox.value()
-        self.return_sweep = self.settings['DS_sweep_return_sweep'] = self.ui.return_sweep_output_checkBox.isChecked()
-        self.v_constant = self.settings['V_G'] = self.ui.v_g1_doubleSpinBox.value()
+        self.v_sweep_start = self.settings['V_DS_start']
+        self.v_sweep_finish = self.settings['V_DS_finish']
+        self.v_sweep_step_size = self.settings['V_DS_step_size']
+        self.preread_delay = self.settings['DS_sweep_preread_delay']
+        self.delay_between_averages = self.settings['DS_sweep_delay_between_averages']
+        self.software_averages = self.settings['DS_sweep_software_averages']
+        self.first_bias_settle = self.settings['DS_sweep_first_bias_settle']
+        self.return_sweep = self.settings['DS_sweep_return_sweep']
+        self.v_constant = self.settings['V_G']
+        self.read_sweep_options()
 
-        self.output_preread = self.preread_delay # for config file
-        self.output_first_bias_settle = self.first_bias_settle
 
+    def read_output_v_g(self):
+        '''
+        Gate voltages of the output curves: those of the recipe being run, otherwise the panel's.
+        '''
+        if self.output_v_g is not None:
+            return np.array(self.output_v_g[:self.num_output_curves])
+        return self.read_output_v_g_spinboxes()
 
     def read_output_v_g_spinboxes(self):
         output_v_g_values = np.zeros(self.num_output_curves)
@@ -415,18 +740,24 @@ class TestDeviceMeasure(GeneralCurveMeasure):
                                 'Length (um)': self.dimension_choice[self.dimension][1],
                                 'Thickness (nm)' : self.thickness}
 
-        config['Transfer'] = {'Preread (ms)': self.transfer_preread,
-                              'First Bias (ms)': self.transfer_first_bias_settle,
-                              'Vds (V)': self.transfer_vds}
+        # from the settings and the checkpoint of the sequence, which are known even if no curve of a phase was run
+        config['Transfer'] = {'Preread (ms)': self.settings['G_sweep_preread_delay'],
+                              'First Bias (ms)': self.settings['G_sweep_first_bias_settle'],
+                              'Vds (V)': self.settings['V_DS']}
     
-        config['Output'] = {'Preread (ms)': self.output_preread,
-                            'First Bias (ms)': self.output_first_bias_settle,
-                            'Output Vgs': len(self.output_v_g_values)}
+        output_v_g_values = self.checkpoint.sequence['output_v_g']
+        config['Output'] = {'Preread (ms)': self.settings['DS_sweep_preread_delay'],
+                            'First Bias (ms)': self.settings['DS_sweep_first_bias_settle'],
+                            'Output Vgs': len(output_v_g_values)}
         
-        for n, o in enumerate(self.output_v_g_values):
+        for n, o in enumerate(output_v_g_values):
             key = 'Vgs (V) ' + str(n)
             config['Output'][key] = str(o)
             
+        if self.h5 is not None:
+            for section in config.sections():
+                self.h5.set_attrs('config/' + section, dict(config[section]))
+
         path = self.app.settings['save_dir']+"/"+ self.app.settings['sample'] + r'_config.cfg'
         with open(path, 'w') as configfile:
             config.write(configfile)
@@ -7,8 +7,23 @@ import numpy as np
 import time
 import os.path
 
+from averaging import sample_std, average_until
+from keithley2400_sourcemeter_hc import read_synchronized
+from instrument_executor import InstrumentExecutor
+from io_stats import IOStats
+from bias_waveform import step_response, load_table, schedule, run_schedule
+from chunked_store import ChunkedStore
+from h5_sink import H5Sink
+from save_service import SaveService, free_filename, write_text
+from live_plot import LiveCurve
+from summary_pyramid import SummaryPyramid, COLUMNS as SUMMARY_COLUMNS
+from compliance import POLICIES, ComplianceGuard
+
 class TransientStepResponseMeasure(Measurement):
 
+    h5 = None # H5Sink of the running measurement, if saving to HDF5
+    pyramid = None # SummaryPyramid of the readings of the last run
+
     def setup(self):
         """
         Runs once during App initialization.
@@ -33,9 +48,29 @@ class TransientStepResponseMeasure(Measurement):
         self.settings.New('setpoint', unit = 'V/A', initial = -0.5, spinbox_decimals = 8, spinbox_step=0.000001)
         self.settings.New('step_time', unit = 's', initial = 10, spinbox_decimals = 1, spinbox_step=1)
         self.settings.New('software_averages', int, initial = 1)
-        self.settings.New('delay_between_averages', unit = 'ms', initial = 100)
+        self.settings.New('averaging', str, choices = ('burst', 'filter', 'software', 'adaptive'), initial = 'burst')
+        # adaptive averaging: stop once the standard error of I_DS is within either target
+        self.settings.New('target_rel_error', initial = 0.001, spinbox_decimals = 4, spinbox_step = 0.001)
+        self.settings.New('target_abs_error', unit = 'A', si = True, initial = 1e-11)
+        self.settings.New('min_averages', int, initial = 2, vmin = 2)
+        self.settings.New('max_averages', int, initial = 20, vmin = 2)
+        self.settings.New('synchronized', bool, initial = False)
+        self.settings.New('delay_between_averages', unit = 'ms', initial = 10)
         self.settings.New('total_measurement_time', unit = 's', initial = 30)
         self.settings.New('num_cycles', int, initial = 1)
+        # waveform table (see bias_waveform.load_table) run instead of the step, num_cycles times
+        self.settings.New('waveform_file', dtype = 'file', initial = '')
+        # buffered: the drain keithley times the samples and stores them in its trace buffer
+        self.settings.New('buffered', bool, initial = False)
+        self.settings.New('sample_interval', unit = 'ms', initial = 1, spinbox_decimals = 3)
+        self.settings.New('trace_points', int, initial = 500, vmin = 1, vmax = 2500)
+        self.settings.New('io_stats', bool, initial = False)
+        # what to do when a reading hits compliance or is over range, see compliance.ComplianceGuard
+        self.settings.New('compliance_policy', str, choices = POLICIES, initial = 'warn')
+        self.settings.New('memory_cap', unit = 'MB', initial = 256) # readings beyond this are kept on disk until saved
+        self.settings.New('save_h5', bool, initial = True)
+        self.settings.New('save_txt', bool, initial = True)
+        self.saver = SaveService()
 
         self.g_hw = self.app.hardware['keithley2400_sourcemeter1']
         self.ds_hw = self.app.hardware['keithley2400_sourcemeter2']
@@ -87,13 +122,17 @@ class TransientStepResponseMeasure(Measurement):
         self.plot = self.graph_layout.addPlot(title="Current vs. Time")
         self.plot.setLabel('bottom', 'Time (ms)')
         self.plot.setLabel('left', 'I_DS')
+        self.curve = LiveCurve(self.plot, 'r') # drawn from self.pyramid, also after the run for browsing
+        self.shown_rows = 0
         
     def update_display(self):
-        
-        self.plot.plot(self.save_array[:self.counts, 0], 
-                       self.save_array[:self.counts, 2], pen='r', clear=True)
-        
-        #self.plot.plot(self.time_array[:self.counts], self.save_array[:self.counts,2], pen = 'r', clear = True)
+        pyramid = self.pyramid
+        if pyramid is None:
+            return
+        if self.curve.source is not pyramid or pyramid.rows != self.shown_rows:
+            self.curve.source = pyramid
+            self.shown_rows = pyramid.rows
+            self.curve.redraw()
 
     def read_settings(self):
         '''
@@ -116,9 +155,20 @@ class TransientStepResponseMeasure(Measurement):
         self.step_time = self.settings['step_time']
         self.setpoint = self.settings['setpoint']
         self.software_averages = self.settings['software_averages']
-        self.delay_between_averages = 10#self.settings['delay_between_averages']
+        self.averaging = self.settings['averaging']
+        self.synchronized = self.settings['synchronized']
+        self.target_rel_error = self.settings['target_rel_error']
+        self.target_abs_error = self.settings['target_abs_error']
+        self.min_averages = self.settings['min_averages']
+        self.max_averages = self.settings['max_averages']
+        self.delay_between_averages = self.settings['delay_between_averages']
         self.total_measurement_time = self.settings['total_measurement_time']
         self.num_cycles = int(self.settings['num_cycles'])
+        self.waveform_file = self.settings['waveform_file']
+        self.buffered = self.settings['buffered']
+        self.sample_interval = self.settings['sample_interval']
+        self.trace_points = int(self.settings['trace_points'])
+        self.compliance_policy = self.settings['compliance_policy']
     
     def pre_run(self):
         self.check_filename(".txt") #check that valid filename has been set
@@ -127,21 +177,81 @@ class TransientStepResponseMeasure(Measurement):
         #to device by which terminals it corresponds to - makes things easier for measurement and saving
         self.g_device = self.g_hw.keithley
         self.ds_device = self.ds_hw.keithley
-        self.g_device.reset()
-        self.ds_device.reset()
-        self.read_settings()
 
-        self.g_device.write_source_mode(self.g_source_mode)
+        #commands to the two keithleys run concurrently, each on its own thread
+        if hasattr(self, 'io'): self.io.shutdown()
+        self.io = InstrumentExecutor((self.g_device, self.ds_device))
+        self.io_stats = IOStats() if self.settings['io_stats'] else None
+        self.g_device.io_stats = self.ds_device.io_stats = self.io_stats
+        self.read_settings()
         
         self.step_gate = self.ui.radioButtonStepGate.isChecked()==True
         print('Stepping Gate?', self.step_gate)
 
-        #configure keithleys
+        self.events, self.duration = schedule(self.waveform() * self.num_cycles, gate_mode = self.g_source_mode)
+        _, self.g_level, self.ds_level, self.g_source_mode = self.events[0]
+
+        #readings are appended as they come, older blocks spill to the save directory past the memory cap
+        if hasattr(self, 'data'): self.saver.submit(self.data.close) # once the last run's data is written
+        self.data = ChunkedStore(len(self.save_columns()), memory_cap = self.settings['memory_cap'] * 1e6,
+                                 directory = self.app.settings['save_dir'])
+        self.t0 = None
+        if self.pyramid is not None: self.pyramid.close()
+        self.pyramid = SummaryPyramid(self.data, 0, 2, memory_cap = self.settings['memory_cap'] * 1e6 / 4,
+                                      directory = self.app.settings['save_dir'], on_rows = self.save_summary)
+        self.open_h5('_current_vs_time.h5')
+        if self.h5 is not None:
+            self.h5.create_table('current_vs_time', self.save_columns(), **{self.bias_name() + ' (V)': self.static_bias})
+
+        #configure keithleys and prepare hardware for read, one program message per keithley
+        self.compliance = ComplianceGuard(self.compliance_policy)
+        for device in (self.g_device, self.ds_device):
+            device.write_status_reporting(self.compliance_policy != 'off')
+        self.io.gather((self.g_device, self.prepare_g_device, self.g_level),
+                       (self.ds_device, self.prepare_ds_device, self.ds_level))
+            
+        time.sleep(self.first_bias_settle * .001)
+
+    def prepare_g_device(self, level):
+        '''
+        Reset and configure the gate keithley, then source level [V, or A when sourcing current].
+        '''
+        with self.g_device.batch():
+            self.g_device.reset()
+            self.configure_g_device()
+            if self.g_source_mode == 'CURR':
+                self.g_device.source_I(level)
+            else:
+                self.g_device.source_V(level)
+            self.g_device.write_output_on()
+
+    def prepare_ds_device(self, level):
+        '''
+        Reset and configure the drain keithley, then source level [V].
+        '''
+        with self.ds_device.batch():
+            self.ds_device.reset()
+            self.configure_ds_device()
+            self.ds_device.source_V(level)
+            self.ds_device.write_output_on()
+
+    def configure_g_device(self):
+        '''
+        Source mode, compliance and filter of the gate keithley.
+        '''
+        self.g_device.write_preranging(self.g_hw.settings['preranging'] and self.g_source_mode == 'VOLT')
+        self.g_device.write_source_mode(self.g_source_mode)
         if self.g_source_mode == 'VOLT':
             self.g_device.write_current_compliance(self.g_current_compliance)
         else:
             self.g_device.write_voltage_compliance(self.g_voltage_compliance)
+        self.g_device.write_filter(self.filter_count())
 
+    def configure_ds_device(self):
+        '''
+        Compliance, range, integration and filter of the drain keithley.
+        '''
+        self.ds_device.write_preranging(self.ds_hw.settings['preranging'])
         self.ds_device.write_autozero(self.ds_autozero)
         self.ds_device.write_current_compliance(self.ds_current_compliance)
         
@@ -149,35 +259,13 @@ class TransientStepResponseMeasure(Measurement):
             self.ds_device.measure_current(nplc = self.ds_nplc, current = self.ds_manual_range, auto_range = False)
         else:
             self.ds_device.measure_current(nplc = self.ds_nplc)
+        self.ds_device.write_filter(self.filter_count())
 
-        self.time_for_avg = self.software_averages * self.delay_between_averages
-        self.time_array = np.arange(start = 0, 
-                                    stop = self.num_cycles * self.total_measurement_time * 1000 + self.time_for_avg, 
-                                    step = 10)
-        self.num_initial = int((self.delay_step * 1000)/self.time_for_avg)
-        self.num_setpoint = int(((self.total_measurement_time - self.delay_step) * 1000)/self.time_for_avg)
-
-        self.save_array = np.zeros(shape=(self.time_array.shape[0], 6))
-        self.save_array[:,0] = self.time_array
-        self.save_array[:self.num_initial, 1] = self.initial_step_setting
-        self.save_array[self.num_initial:, 1] = self.setpoint
-
-
-        if self.step_gate:
-            self.ds_device.source_V(self.static_bias)
-            if self.g_source_mode == 'VOLT':
-                self.g_device.source_V(self.initial_step_setting)
-            else:
-                self.g_device.source_I(self.initial_step_setting)
-        else:
-            self.ds_device.source_V(self.initial_step_setting)
-            self.g_device.source_V(self.static_bias)
-            
-        #prepare hardware for read
-        self.g_device.write_output_on()
-        self.ds_device.write_output_on()
-            
-        time.sleep(self.first_bias_settle * .001)
+    def filter_count(self):
+        '''
+        With the filter the instrument averages, otherwise each returned reading is one conversion.
+        '''
+        return int(self.software_averages) if self.averaging == 'filter' else 1
 
     def run(self):
         """
@@ -187,120 +275,234 @@ class TransientStepResponseMeasure(Measurement):
 
         Runs until measurement is interrupted. Data is continuously saved if checkbox checked.
         """
-#        for i in range(self.num_initial):
+        if self.buffered:
+            self.run_buffered()
+            return
 
-        i = 0
-        
-        self.counts = 0
-        t0 = time.time()
-        for cycle in range(self.num_cycles):
-            
-            start = i
-            t1 = time.time()
-#            self.g_device.source_V(self.initial_gate_setting)
-            if self.step_gate:
-                if self.g_source_mode == 'VOLT':
-                    self.g_device.source_V(self.initial_step_setting)
-                else:
-                    self.g_device.source_I(self.initial_step_setting)
+        def sample(event):
+            for device in (self.g_device, self.ds_device):
+                device.clear_status()
+            ds_reading = self.read_currents()
+            self.save_reading(self.stepped_level(event), ds_reading)
+            self.compliance.check('t = %.3f s' % (self.data.last()[0] * .001), G = self.g_device.status_seen,
+                                  DS = self.ds_device.status_seen)
+
+        run_schedule(self.events, self.duration, self.apply_levels, sample,
+                     lambda: self.interrupt_measurement_called or self.compliance.tripped)
+
+    def waveform(self):
+        '''
+        One cycle of the bias waveform: the table in waveform_file if set, otherwise the step from the settings.
+        '''
+        if self.waveform_file:
+            return load_table(self.waveform_file)
+        return step_response(self.initial_step_setting, self.setpoint, self.delay_step, self.step_time,
+                             self.total_measurement_time, self.static_bias, self.step_gate)
+
+    def stepped_level(self, event):
+        '''
+        Level of the stepped terminal in a schedule event, saved with every reading.
+        '''
+        return event[1] if self.step_gate else event[2]
+
+    def apply_levels(self, event):
+        '''
+        Source the levels of a schedule event that differ from the present ones, both keithleys at once.
+        A change of gate mode reconfigures the gate keithley first.
+        '''
+        _, g_level, ds_level, g_source_mode = event
+        calls = []
+        if g_source_mode != self.g_source_mode or g_level != self.g_level:
+            calls.append((self.g_device, self.source_g_level, g_level, g_source_mode))
+        if ds_level != self.ds_level:
+            calls.append((self.ds_device.source_V, ds_level))
+        self.io.gather(*calls)
+        self.g_level, self.ds_level = g_level, ds_level
+
+    def source_g_level(self, level, g_source_mode):
+        '''
+        Source level on the gate keithley in g_source_mode, switching modes if needed.
+        '''
+        with self.g_device.batch():
+            if g_source_mode != self.g_source_mode:
+                self.g_source_mode = g_source_mode
+                self.configure_g_device()
+            if g_source_mode == 'VOLT':
+                self.g_device.source_V(level)
             else:
-                    self.ds_device.source_V(self.initial_step_setting)
-                    self.g_device.source_V(self.static_bias)
-            
-            while time.time() - t1 < self.delay_step:
-                
-                ds_reading = self.read_currents()
-                self.save_array[i, 0] = (ds_reading[2] - t0)*1000
-                self.save_array[i, 1] = self.initial_step_setting
-                self.save_array[i, 2] = ds_reading[0]
-                self.save_array[i, 3] = ds_reading[1]
-                self.save_array[i, 4] = ds_reading[3]
-                self.save_array[i, 5] = ds_reading[4]
-                i += 1
-                self.counts += 1
-    
-                if self.interrupt_measurement_called:
-                    break
-    
-            t1 = time.time()
-            while time.time() - t1 < (self.step_time):
-                
-                
-                if self.step_gate:
-                    if self.g_source_mode == 'VOLT':
-                        self.g_device.source_V(self.setpoint)
-                    else:
-                        self.g_device.source_I(self.setpoint)
-                else:
-                    self.ds_device.source_V(self.setpoint)
-            
-#                self.g_device.source_V(self.setpoint)
-                ds_reading = self.read_currents()
-                self.save_array[i, 0] = (ds_reading[2] - t0)*1000
-                self.save_array[i, 1] = self.setpoint
-                self.save_array[i, 2] = ds_reading[0]
-                self.save_array[i, 3] = ds_reading[1]
-                self.save_array[i, 4] = ds_reading[3]
-                self.save_array[i, 5] = ds_reading[4]
-                i += 1
-                self.counts += 1
-                
-                if self.interrupt_measurement_called:
-                    break
-            
-            t1 = time.time()
-            while time.time() - t1 < (self.total_measurement_time - self.delay_step - self.step_time):
-    
-#                self.g_device.source_V(self.initial_gate_setting)
-                if self.step_gate:
-                    if self.g_source_mode == 'VOLT':
-                        self.g_device.source_V(self.initial_step_setting)
-                    else:
-                        self.g_device.source_I(self.initial_step_setting)
-                else:
-                        self.ds_device.source_V(self.initial_step_setting)
-                        
-                ds_reading = self.read_currents()
-                self.save_array[i, 0] = (ds_reading[2] - t0)*1000
-                self.save_array[i, 1] = self.initial_step_setting
-                self.save_array[i, 2] = ds_reading[0]
-                self.save_array[i, 3] = ds_reading[1]
-                self.save_array[i, 4] = ds_reading[3]
-                self.save_array[i, 5] = ds_reading[4]
-                i += 1
-                self.counts += 1
-                
-                if self.interrupt_measurement_called:
-                    break
-            
-            self.save_array[:,0] -= self.save_array[0,0]
-            self.time_array[start:i] = self.save_array[start:i,0] #update time
-            
-        self.n_pts = int(i)
-        self.time_array = self.time_array[:i] 
-        self.save_array = self.save_array[:i, :]
-        
+                self.g_device.source_I(level)
+
+    def run_buffered(self):
+        '''
+        Buffered acquisition: the drain keithley takes up to trace_points readings per :INIT, spaced by
+        sample_interval, and stores them with its own time stamps in the trace buffer. Each chunk is fetched
+        and the next one armed as soon as it is done, so only the short gaps between chunks are host timed.
+        Every change of level starts a new chunk whose first trigger applies it (triggered level),
+        so steps land on a trigger boundary.
+        With synchronized, the gate keithley follows the drain's triggers over trigger link, stores its
+        readings at the same instants and steps the same way. Otherwise a gate step is sent right before
+        the chunk starts and the gate columns are NaN.
+        Each row is a single reading, averaged only by the filter, so the error columns are NaN.
+        The compliance policy is applied to each chunk once it is fetched.
+        '''
+        interval = self.sample_interval * .001
+        point_time = self.ds_device.estimate_read_time(1, interval) - 5 # upper guess, then taken from the time stamps
+        spaced = False # point_time measured; until then chunks take two readings at least, to measure it
+
+        if self.synchronized: self.configure_g_trace()
+        self.io.gather((self.ds_device.reset_timestamp,), (self.g_device.reset_timestamp,))
+
+        t0 = None
+        for k, event in enumerate(self.events):
+            _, g_level, ds_level, g_source_mode = event
+            end = self.events[k + 1][0] if k + 1 < len(self.events) else self.duration
+            if g_source_mode != self.g_source_mode:
+                # switching the gate mode reconfigures the gate, which cannot wait for a trigger
+                self.source_g_level(g_level, g_source_mode)
+                self.g_level = g_level
+                if self.synchronized: self.configure_g_trace()
+            levels = (None if g_level == self.g_level else g_level, None if ds_level == self.ds_level else ds_level)
+            self.g_level, self.ds_level = g_level, ds_level
+
+            # each level lasts until its end on the instrument clock, so the gaps between chunks do not add up
+            remaining = end - (0 if t0 is None else self.data.last()[0] * .001 + point_time)
+            while remaining > 0 and not (self.interrupt_measurement_called or self.compliance.tripped):
+                count = int(min(max(np.ceil(remaining / point_time), 1 if spaced else 2), self.trace_points))
+                ds_current, times, g_reading = self.acquire_trace(count, interval, *levels)
+                levels = (None, None)
+                if t0 is None: t0 = times[0]
+                if count > 1: point_time, spaced = (times[-1] - times[0]) / (count - 1), True
+                remaining = end - (times[-1] - t0 + point_time)
+
+                rows = np.full((count, self.data.n_columns), np.nan)
+                rows[:, 0] = (times - t0) * 1000
+                rows[:, 1] = self.stepped_level(event)
+                rows[:, 2] = ds_current
+                if g_reading is not None: rows[:, 4] = g_reading
+                if self.averaging == 'adaptive': rows[:, 6] = 1
+                g_status = self.g_device.status if g_reading is not None else None
+                if self.compliance_policy != 'off':
+                    rows[:, -2] = self.ds_device.status
+                    if g_status is not None: rows[:, -1] = g_status
+                self.data.extend(rows)
+                if self.h5 is not None: self.h5.append('current_vs_time', rows)
+                self.pyramid.extend(rows[:, 0], rows[:, 2])
+                if self.io_stats is not None: self.io_stats.mark_point(count)
+                self.compliance.check('t = %.3f s' % (rows[-1, 0] * .001), G = g_status, DS = self.ds_device.status)
+            if self.interrupt_measurement_called or self.compliance.tripped:
+                break
+
+    def configure_g_trace(self):
+        '''
+        Set the gate keithley to measure as long as the drain, so it keeps up with the drain's triggers.
+        '''
+        if self.g_source_mode == 'VOLT':
+            self.g_device.measure_current(**dict(self.g_device.current_config, nplc = self.ds_nplc))
+        else:
+            self.g_device.measure_voltage(**dict(self.g_device.voltage_config, nplc = self.ds_nplc))
+
+    def acquire_trace(self, count, interval, g_level = None, ds_level = None):
+        '''
+        Take one chunk of count buffered readings, see run_buffered().
+        g_level, ds_level -- if given, new levels applied by the first trigger
+        Returns I_DS, its time stamps [sec] and the gate readings (None unless synchronized) as numpy arrays.
+        '''
+        g_func = 'CURR' if self.g_source_mode == 'VOLT' else 'VOLT'
+        if self.synchronized:
+            # the slave has to wait for the master's arm pulse before the master starts
+            self.start_trace(self.g_device, self.g_hw, count, 0, g_func, g_level, self.g_source_mode, 'slave')
+        elif g_level is not None:
+            self.source_g_level(g_level, self.g_source_mode)
+        self.start_trace(self.ds_device, self.ds_hw, count, interval, 'CURR', ds_level, 'VOLT',
+                         'master' if self.synchronized else None)
+
+        timeout = self.ds_device.estimate_read_time(count, interval)
+        if not self.synchronized:
+            ds_current, times = self.ds_device.fetch_trace(timeout, count)
+            return ds_current, times, None
+        (ds_current, times), (g_reading, _) = self.io.gather((self.ds_device.fetch_trace, timeout, count),
+                                                             (self.g_device.fetch_trace, timeout, count))
+        return ds_current, times, g_reading
+
+    def start_trace(self, device, hw, count, interval, func, level, level_func, role):
+        '''
+        Arm device for a trace of count readings of func and start it, in one program message.
+        level -- applied by the first trigger if not None
+        role -- trigger link role, None for immediate triggering
+        '''
+        with device.batch():
+            if level is not None:
+                device.write_triggered_level(level, level_func)
+            device.arm_trace(count, interval, func)
+            device.write_trigger_link(role, hw.settings['arm_line'], hw.settings['trigger_line'])
+            device.init()
+
+    def save_reading(self, level, reading):
+        '''
+        Append a read_currents() result taken while sourcing level, timed from the first reading.
+        '''
+        if self.t0 is None: self.t0 = reading[2]
+        row = [(reading[2] - self.t0)*1000, level, reading[0], reading[1], reading[3], reading[4]]
+        if self.averaging == 'adaptive':
+            row.append(self.samples_used)
+        if self.compliance_policy != 'off':
+            row += [self.ds_device.status_seen, self.g_device.status_seen]
+        self.data.append(row)
+        if self.h5 is not None: self.h5.append('current_vs_time', row)
+        self.pyramid.extend(row[0], row[2])
+
+    def save_summary(self, level, rows):
+        '''
+        Append new summary rows of the pyramid to their table in the HDF5 file, e.g. current_vs_time_L1.
+        '''
+        if self.h5 is None:
+            return
+        name = 'current_vs_time_L%d' % level
+        if name not in self.h5.tables:
+            self.h5.create_table(name, SUMMARY_COLUMNS, samples_per_row = self.pyramid.factor ** level)
+        self.h5.append(name, rows)
+
     def read_currents(self):
         '''
         Read both sourcemeters, taking software averages.
+        The gate reads voltage instead of current when it is sourcing current.
+        synchronized: both instruments sample at the same instants over trigger link (one filtered reading with 'filter')
+        burst: both instruments take all averages off one trigger, spaced by a trigger delay
+        filter: one reading each, averaged by the instrument's digital filter (no error estimate)
+        software: one query per average with a host sleep in between
+        adaptive: as software, but only until the standard error of I_DS meets the target (never synchronized)
         '''
-        ds_current_read = np.zeros(int(self.software_averages))
-        g_current_read = np.zeros(int(self.software_averages))
-        
-        if self.g_source_mode == 'VOLT':
-            for i in range(int(self.software_averages)):
-                ds_current_read[i] = self.ds_device.read_I()
-                g_current_read[i] = self.g_device.read_I()
-                time.sleep(self.delay_between_averages * .001)
+        n = int(self.software_averages)
+        delay = self.delay_between_averages * .001
+        g_func = 'CURR' if self.g_source_mode == 'VOLT' else 'VOLT'
+        read_g = self.g_device.read_I if g_func == 'CURR' else self.g_device.read_V
+
+        if self.averaging == 'adaptive':
+            ds_stats, g_stats = average_until(lambda: self.io.gather((self.ds_device.read_I,), (read_g,)),
+                                              self.target_rel_error, self.target_abs_error,
+                                              self.min_averages, self.max_averages, delay)
+            self.samples_used = ds_stats.n
+            if self.io_stats is not None: self.io_stats.mark_point()
+            return [ds_stats.mean, ds_stats.std, time.time(), g_stats.mean, g_stats.std]
+        if self.synchronized:
+            count = 1 if self.averaging == 'filter' else n
+            ds_current_read, g_current_read = read_synchronized(self.ds_hw, self.g_hw, count, delay, 'CURR', g_func)
+        elif self.averaging == 'burst':
+            ds_current_read, g_current_read = self.io.gather((self.ds_device.read_burst, n, delay),
+                                                             (self.g_device.read_burst, n, delay, g_func))
+        elif self.averaging == 'filter':
+            ds_current_read, g_current_read = [np.array([r]) for r in self.io.gather((self.ds_device.read_I,), (read_g,))]
         else:
-            for i in range(int(self.software_averages)):
-                ds_current_read[i] = self.ds_device.read_I()
-                g_current_read[i] = self.g_device.read_V()
-                time.sleep(self.delay_between_averages * .001)
+            ds_current_read = np.zeros(n)
+            g_current_read = np.zeros(n)
+            for i in range(n):
+                ds_current_read[i], g_current_read[i] = self.io.gather((self.ds_device.read_I,), (read_g,))
+                time.sleep(delay)
+        if self.io_stats is not None: self.io_stats.mark_point()
         ds_current_avg = np.mean(ds_current_read)
-        ds_std = np.std(ds_current_read, ddof = 1)
-        g_std = np.std(g_current_read, ddof = 1)
-        return [ds_current_avg, ds_std, time.time(), g_current_read, g_std]
+        ds_std = sample_std(ds_current_read)
+        g_std = sample_std(g_current_read)
+        return [ds_current_avg, ds_std, time.time(), np.mean(g_current_read), g_std]
 
     def post_run(self):
         '''
@@ -308,27 +510,67 @@ class TransientStepResponseMeasure(Measurement):
         '''
         self.g_device.reset()
         self.ds_device.reset()
-        append = '_current_vs_time.txt'
-        self.check_filename(append)
-        
-        if self.step_gate:
-            v_ds_info = 'V_DS =\t%g' % self.static_bias
-        else:
-            v_ds_info = 'V_GS =\t%g' % self.static_bias
-            
-        info_footer = v_ds_info            
-        if self.step_gate:
+        for hw in (self.g_hw, self.ds_hw):
+            hw.settings['range_changes'] = hw.keithley.range_changes
+        info_footer = '%s =\t%g' % (self.bias_name(), self.static_bias)
+        info_header = '\t'.join(self.save_columns())
+        self.data.freeze() # pre_run of the next run leaves it to the writer to close
+        self.saver.submit(self.write_files, self.app.settings['save_dir'], self.app.settings['sample'],
+                          self.data if self.settings['save_txt'] else None, info_header, info_footer,
+                          None if self.io_stats is None else self.io_stats.report())
+        self.pyramid.finish()
+        self.close_h5() # written while the text is formatted
 
+    @staticmethod
+    def write_files(directory, samplename, data, header, footer, report):
+        '''
+        Runs on the writer thread: save data (a frozen ChunkedStore, None for none) and the bus transaction report
+        (None for none) under the first free file name at that point, see save_service.free_filename().
+        '''
+        filename = free_filename(directory, samplename, '_current_vs_time.txt')
+        if data is not None:
+            data.savetxt(filename, fmt = '%.10f', delimiter='\t', comments='', header = header, footer = footer)
+        if report is not None:
+            write_text(filename.replace('.txt', '_io.txt'), report)
+
+    def save_columns(self):
+        '''
+        Column names of the saved readings.
+        '''
+        if self.step_gate:
             if self.g_source_mode == 'VOLT':
-                info_header = 'Time (ms)\tV_G (V)\tI_DS (A)\tI_DS error(A)\tI_G (A)\tI_G error(A)'
+                columns = ['Time (ms)', 'V_G (V)', 'I_DS (A)', 'I_DS error(A)', 'I_G (A)', 'I_G error(A)']
             else:
-                info_header = 'Time (ms)\tI_G (A)\tI_DS (A)\tI_DS error(A)\tV_G (V)\tI_G error(A)'
+                columns = ['Time (ms)', 'I_G (A)', 'I_DS (A)', 'I_DS error(A)', 'V_G (V)', 'I_G error(A)']
         else:
-            info_header = 'Time (ms)\tV_D (V)\tI_DS (A)\tI_DS error(A)\tI_G (A)\tI_G error(A)'
-            
-        np.savetxt(self.app.settings['save_dir'] + "/" + self.app.settings['sample'] + append, 
-                   self.save_array[:self.n_pts,:], fmt = '%.10f', delimiter='\t',
-                   comments='', header = info_header, footer = info_footer)
+            columns = ['Time (ms)', 'V_D (V)', 'I_DS (A)', 'I_DS error(A)', 'I_G (A)', 'I_G error(A)']
+        if self.averaging == 'adaptive':
+            columns.append('Samples')
+        if self.compliance_policy != 'off':
+            columns += ['DS Status', 'G Status'] # status words, see Keithley2400SourceMeter.STATUS_*
+        return columns
+
+    def bias_name(self):
+        '''
+        Name of the terminal held at static_bias.
+        '''
+        return 'V_DS' if self.step_gate else 'V_GS'
+
+    def open_h5(self, append):
+        '''
+        Start the HDF5 file of this run if save_h5 is on.
+        append -- file name ending, as passed to check_filename()
+        '''
+        self.close_h5()
+        if not self.settings['save_h5']:
+            return
+        self.check_filename(append)
+        self.h5 = H5Sink(self, self.app.settings['save_dir'] + "/" + self.app.settings['sample'] + append)
+
+    def close_h5(self):
+        if self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
 
     def check_filename(self, append):
         '''
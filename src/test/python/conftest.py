@@ -0,0 +1,277 @@
+'''
+Tests of the modules that run without ScopeFoundry and bench hardware: the helpers, the sourcemeter driver
+against a recording VISA resource (fake_keithley) or the emulator (keithley2400_sim), and the relay boards
+against relay_ft245r_sim.
+The measurements themselves are run on the emulator too when ScopeFoundry and PyQt5 are installed, without a
+GUI: the test_device and transient fixtures stand in for the app, the settings and the panel widgets.
+'''
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'main', 'python'))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+class FakeResource(object):
+    '''
+    VISA resource recording every message sent to it. Queries are answered from responses (query: response,
+    default '0'), binary queries with the next array of readings, encoded as a 2400 sends SREAL data.
+    log -- list shared by several resources, receives (port, message)
+    '''
+
+    def __init__(self, port, log):
+        self.port = port
+        self.log = log
+        self.written = []
+        self.responses = {}
+        self.readings = []
+        self.data_points = [] # data_points of each binary query
+        self.timeout = 10000
+
+    def write(self, message):
+        self.written.append(message)
+        self.log.append((self.port, message))
+        return len(message)
+
+    def query(self, message):
+        self.write(message)
+        return self.responses.get(message, '0') + '\n'
+
+    def query_binary_values(self, message, datatype = 'f', is_big_endian = False, container = list,
+                            data_points = 0, **kwargs):
+        from pyvisa.util import from_ieee_block
+        self.write(message)
+        self.data_points.append(data_points)
+        block = b'#0' + np.asarray(self.readings.pop(0), dtype = '<f4').tobytes() + b'\n' # SREAL, FORM:BORD SWAP
+        return from_ieee_block(block, datatype, is_big_endian, container)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_keithley(monkeypatch):
+    '''
+    Returns a function opening a sourcemeter driver on a FakeResource, reached as driver.keithley.
+    All resources opened by one test share the log attribute of the function.
+    '''
+    import keithley2400_sourcemeter_interface
+
+    def open_resource(port):
+        return FakeResource(port, open_keithley.log)
+
+    def open_keithley(port = 'GPIB0::24::INSTR', **options):
+        k = keithley2400_sourcemeter_interface.Keithley2400SourceMeter(port, **options)
+        k.keithley.written = []
+        return k
+
+    open_keithley.log = []
+    monkeypatch.setattr(keithley2400_sourcemeter_interface.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(keithley2400_sourcemeter_interface.pv, 'ResourceManager',
+                        lambda: types.SimpleNamespace(open_resource = open_resource, close = lambda: None))
+    return open_keithley
+
+
+@pytest.fixture
+def sim_keithley():
+    '''
+    Returns a function opening an emulated sourcemeter on a port with a device model, without latency or noise.
+    The default device model is restored afterwards.
+    '''
+    import keithley2400_sim
+    from keithley2400_sourcemeter_interface import Keithley2400SourceMeter
+    model = keithley2400_sim.DEVICE_MODEL
+    rm = keithley2400_sim.SimulatedResourceManager(latency = 0, noise = 0, relative_noise = 0)
+
+    def open_keithley(port = 'SIM::9', device_model = None):
+        if device_model is not None:
+            keithley2400_sim.set_device_model(device_model)
+        return Keithley2400SourceMeter(port, resource_manager = rm)
+
+    yield open_keithley
+    keithley2400_sim.set_device_model(model)
+
+
+class Settings(dict):
+    '''
+    Stands in for a ScopeFoundry LQCollection: New() only records the initial value.
+    '''
+
+    def New(self, name, dtype = float, initial = None, **kwargs):
+        self[name] = initial
+        return name
+
+
+class Widget(object):
+    '''
+    Stands in for a spin box, combo box or check box of a panel.
+    '''
+
+    def __init__(self, value):
+        self.v = value
+
+    def value(self):
+        return self.v
+
+    def currentText(self):
+        return self.v
+
+    def isChecked(self):
+        return self.v
+
+    def setValue(self, value):
+        self.v = value
+
+    def setChecked(self, value):
+        self.v = value
+
+    def setStyleSheet(self, style):
+        pass
+
+
+class Panel(object):
+    '''
+    Widgets of a panel by name, created on first use with the value of the first prefix in VALUES that matches.
+    '''
+    VALUES = {'current_compliance': 1e-3, 'autozero': 'on', 'autorange': True, 'manual_range': '1 A', 'nplc': 0.01,
+              'dimension': '4000 x 10', 'thickness': 50.}
+
+    def __getattr__(self, name):
+        value = next((v for key, v in self.VALUES.items() if name.startswith(key)), 0.)
+        widget = Widget(value)
+        setattr(self, name, widget)
+        return widget
+
+
+def component(name, keithley):
+    '''
+    Keithley2400SourceMeterComponent with its settings around a connected driver.
+    '''
+    from PyQt5 import QtCore
+    from keithley2400_sourcemeter_hc import Keithley2400SourceMeterComponent
+    hw = Keithley2400SourceMeterComponent.__new__(Keithley2400SourceMeterComponent)
+    QtCore.QObject.__init__(hw)
+    hw.name = name
+    hw.settings = Settings(current_compliance = 1e-3, voltage_compliance = 2., source_mode = 'VOLT', autozero = 'on',
+                           autorange = True, manual_range = '1 A', NPLC = 0.01, preranging = False, arm_line = 1,
+                           trigger_line = 2, range_changes = 0)
+    hw.range_profiles = {}
+    hw.keithley = keithley
+    return hw
+
+
+def sim_component(port, rm):
+    '''
+    component() connected to an emulated sourcemeter.
+    '''
+    from keithley2400_sourcemeter_interface import Keithley2400SourceMeter
+    return component(port, Keithley2400SourceMeter(port, resource_manager = rm))
+
+
+@pytest.fixture
+def test_device(tmp_path):
+    '''
+    Returns a function building a TestDeviceMeasure on two emulated sourcemeters (gate SIM::1, drain SIM::2) and
+    the simulated relay boards, saving into tmp_path as sample 'dev'. Its keyword arguments override settings.
+    Curves have 4 points of 2 averages without delays. Run it with pre_run(), run() and post_run().
+    '''
+    pytest.importorskip('ScopeFoundry')
+    from PyQt5 import QtCore
+    import keithley2400_sim
+    from live_plot import PlotFeed
+    from relay_ft245r_sim import SimulatedUSB
+    from save_service import SaveService
+    from test_device_measure import TestDeviceMeasure
+    from transfer_curve_measure import TransferCurveMeasure
+    from output_curve_measure import OutputCurveMeasure
+    model = keithley2400_sim.DEVICE_MODEL
+    built = []
+
+    def build(device_model = None, **settings):
+        if device_model is not None:
+            keithley2400_sim.set_device_model(device_model)
+        rm = keithley2400_sim.SimulatedResourceManager(latency = 0, noise = 0, relative_noise = 0)
+        m = TestDeviceMeasure.__new__(TestDeviceMeasure)
+        QtCore.QObject.__init__(m)
+        m.app = types.SimpleNamespace(settings = {'save_dir': str(tmp_path), 'sample': 'dev'},
+                                      hardware = {'keithley2400_sourcemeter1': sim_component('SIM::1', rm),
+                                                  'keithley2400_sourcemeter2': sim_component('SIM::2', rm)})
+        m.settings = Settings()
+        m.ui = Panel()
+        TransferCurveMeasure.create_settings(m)
+        m.switch_setting()
+        OutputCurveMeasure.create_settings(m)
+        m.switch_setting()
+        m.pixels = {'2: 800': 2, '3: 2000': 3}
+        m.dimension_choice = {'4000 x 10': [4000, 10], '800 x 10': [800, 10], '2000 x 10': [2000, 10]}
+        defaults = dict(number_of_transfer_curves = 1, number_of_output_curves = 1, dimension = '4000 x 10',
+                        thickness = 50, pixel = '2: 800', io_stats = False, save_h5 = False, save_txt = True,
+                        batch = False, batch_pixels = 'all', batch_file = '', batch_retries = 0, screen = False,
+                        screen_V_G = '-0.6, 0', screen_V_DS = -0.6, screen_settle = 0, screen_NPLC = 0.01,
+                        screen_min_on_current = 1e-8, screen_min_on_off_ratio = 5, screen_max_gate_leakage = 1e-5,
+                        V_G_start = -0.6, V_G_finish = 0., V_G_step_size = 0.2,
+                        V_DS_start = -0.6, V_DS_finish = 0., V_DS_step_size = 0.2)
+        for sweep in ('G', 'DS'):
+            for name, value in dict(preread_delay = 0, delay_between_averages = 0, first_bias_settle = 0,
+                                    software_averages = 2).items():
+                defaults['%s_sweep_%s' % (sweep, name)] = value
+        m.settings.update(defaults, **settings)
+        m.saver = SaveService()
+        m.feed = PlotFeed()
+        m.interrupt_measurement_called = False
+        m.resuming = False
+        m.setup_relay(SimulatedUSB(latency = 0))
+        m.use_relay = True
+        m.v_g_spinboxes = [Widget(-0.2 * i) for i in range(5)]
+        m.graph_layout = types.SimpleNamespace(show = lambda: None)
+        m.g_plot = m.ds_plot = types.SimpleNamespace(setLabel = lambda *args: None)
+        built.append(m)
+        return m
+
+    yield build
+    for m in built:
+        m.saver.close()
+    keithley2400_sim.set_device_model(model)
+
+
+@pytest.fixture
+def transient(tmp_path, monkeypatch):
+    '''
+    Returns a function building a TransientStepResponseMeasure on two emulated sourcemeters (gate SIM::1, drain
+    SIM::2), saving into tmp_path as sample 'dev', with the settings of its setup() and no first bias settle.
+    Its keyword arguments override settings. Run it with pre_run(), run() and post_run().
+    '''
+    pytest.importorskip('ScopeFoundry')
+    from PyQt5 import QtCore
+    import keithley2400_sim
+    import transient_step_response_measure
+    model = keithley2400_sim.DEVICE_MODEL
+    monkeypatch.setattr(transient_step_response_measure, 'load_qt_ui_file', lambda filename: Panel())
+    built = []
+
+    def build(device_model = None, **settings):
+        if device_model is not None:
+            keithley2400_sim.set_device_model(device_model)
+        rm = keithley2400_sim.SimulatedResourceManager(latency = 0, noise = 0, relative_noise = 0)
+        m = transient_step_response_measure.TransientStepResponseMeasure.__new__(
+            transient_step_response_measure.TransientStepResponseMeasure)
+        QtCore.QObject.__init__(m)
+        m.app = types.SimpleNamespace(settings = {'save_dir': str(tmp_path), 'sample': 'dev'},
+                                      appctxt = types.SimpleNamespace(get_resource = lambda name: name),
+                                      hardware = {'keithley2400_sourcemeter1': sim_component('SIM::1', rm),
+                                                  'keithley2400_sourcemeter2': sim_component('SIM::2', rm)})
+        m.settings = Settings()
+        m.setup()
+        m.settings.update(first_bias_settle = 0, save_h5 = False, **settings)
+        m.interrupt_measurement_called = False
+        built.append(m)
+        return m
+
+    yield build
+    for m in built:
+        m.saver.close()
+    keithley2400_sim.set_device_model(model)
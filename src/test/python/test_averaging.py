@@ -0,0 +1,43 @@
+import numpy as np
+
+from averaging import RunningStats, average_until, sample_std
+
+
+def test_running_stats_match_numpy():
+    readings = np.random.RandomState(0).normal(3, 0.5, 50)
+    stats = RunningStats()
+    for x in readings:
+        stats.add(x)
+    assert stats.n == 50
+    assert np.isclose(stats.mean, readings.mean())
+    assert np.isclose(stats.std, sample_std(readings))
+    assert np.isclose(stats.sem, readings.std(ddof = 1) / np.sqrt(50))
+
+
+def test_single_reading_has_no_spread():
+    stats = RunningStats()
+    stats.add(1.)
+    assert np.isnan(stats.std) and np.isnan(stats.sem)
+
+
+def test_quiet_channel_stops_at_min_samples():
+    stats = average_until(lambda: (5., 1e-6), rel_error = 1e-3, min_samples = 3, max_samples = 20, channel = 1)
+    assert [s.n for s in stats] == [3, 3]
+    assert stats[1].mean == 1e-6
+
+
+def test_noisy_channel_stops_at_max_samples():
+    noise = iter(np.random.RandomState(1).normal(1, 0.5, 100))
+    stats = average_until(lambda: (next(noise),), rel_error = 1e-4, max_samples = 12)
+    assert stats[0].n == 12
+
+
+def test_abs_error_ends_sampling_of_small_currents():
+    noise = iter(np.random.RandomState(2).normal(0, 1e-12, 100))
+    stats = average_until(lambda: (next(noise),), rel_error = 1e-4, abs_error = 1e-11, max_samples = 50)
+    assert stats[0].n == 2
+
+
+def test_sample_std():
+    assert np.isclose(sample_std([1., 2., 3.]), 1.)
+    assert np.isnan(sample_std([1.]))
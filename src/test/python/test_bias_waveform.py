@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from bias_waveform import Segment, load_table, pulse_train, ramp, run_schedule, schedule, step_response
+
+
+def test_step_response_schedule():
+    events, duration = schedule(step_response(0, -0.5, 1, 2, 10, -0.6))
+    assert duration == 10
+    assert events == [(0., 0, -0.6, 'VOLT'), (1., -0.5, -0.6, 'VOLT'), (3., 0, -0.6, 'VOLT')]
+
+
+def test_repeated_pulses_merge_unchanged_levels():
+    events, duration = schedule(pulse_train(2, 1., 0., 0.1, 0.5) * 2, gate = 0.)
+    assert duration == pytest.approx(2)
+    assert [e[1] for e in events] == [1., 0.] * 4
+    assert [e[0] for e in events] == pytest.approx([0, 0.1, 0.5, 0.6, 1, 1.1, 1.5, 1.6])
+
+
+def test_ramp_keeps_the_other_terminal():
+    events, duration = schedule(ramp(1., 0., 0.3, 4, terminal = 'drain'), gate = 0.2)
+    assert duration == pytest.approx(1)
+    assert [e[2] for e in events] == pytest.approx([0, 0.1, 0.2, 0.3])
+    assert all(e[1] == 0.2 for e in events)
+
+
+def test_invalid_segments():
+    with pytest.raises(ValueError):
+        Segment(-1)
+    with pytest.raises(ValueError):
+        Segment(1, gate_mode = 'OHM')
+    with pytest.raises(ValueError):
+        pulse_train(1, 1, 0, 2, 1)
+
+
+def test_load_table(tmp_path):
+    table = tmp_path / 'waveform.txt'
+    table.write_text('# duration gate drain mode\n1 0 -0.6\n0.5 1e-6 - curr\n\n2 - 0 -\n')
+    events, duration = schedule(load_table(str(table)))
+    assert duration == 3.5
+    assert events == [(0., 0., -0.6, 'VOLT'), (1., 1e-6, -0.6, 'CURR'), (1.5, 1e-6, 0., 'CURR')]
+    table.write_text('1 0\n')
+    with pytest.raises(ValueError):
+        load_table(str(table))
+
+
+def test_run_schedule_applies_every_event_on_time():
+    events, duration = schedule(pulse_train(3, 1., 0., 0.02, 0.04))
+    applied, sampled = [], []
+    lateness = run_schedule(events, duration, applied.append, lambda e: (sampled.append(e[1]), time.sleep(0.002)))
+    assert applied == events
+    assert max(lateness) < 0.015
+    assert set(sampled) == {0., 1.}
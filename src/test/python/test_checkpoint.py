@@ -0,0 +1,46 @@
+import os
+
+from checkpoint import Checkpoint
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / 'checkpoint.json')
+    checkpoint = Checkpoint(filename, pixel = '2: 800', transfer_curves = 2, output_v_g = [-0.2, 0.])
+    checkpoint.start_curve('transfer1', [0., 0.1, 0.2], -0.6)
+    checkpoint.add_point(0, [0., 1e-9])
+    checkpoint.end_curve()
+    checkpoint.start_curve('transfer2', [0., 0.1, 0.2], -0.6)
+    checkpoint.add_point(0, [0., 2e-9])
+    checkpoint.add_point(1, [0.1, 3e-9])
+
+    loaded = Checkpoint.load(filename)
+    assert loaded.sequence == {'pixel': '2: 800', 'transfer_curves': 2, 'output_v_g': [-0.2, 0.]}
+    assert loaded.completed == ['transfer1']
+    assert loaded.partial_rows('transfer2', [0., 0.1, 0.2], -0.6) == [[0., 2e-9], [0.1, 3e-9]]
+    assert not os.path.exists(filename + '.tmp')
+
+
+def test_partial_rows_need_the_same_curve(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'))
+    assert checkpoint.partial_rows('transfer1', [0.], 0) == []
+    checkpoint.start_curve('transfer1', [0., 0.1], -0.6, rows = [[0., 1.]])
+    assert checkpoint.partial_rows('transfer1', [0., 0.1], -0.6) == [[0., 1.]]
+    assert checkpoint.partial_rows('transfer2', [0., 0.1], -0.6) == []
+    assert checkpoint.partial_rows('transfer1', [0., 0.2], -0.6) == []
+    assert checkpoint.partial_rows('transfer1', [0., 0.1], -0.4) == []
+
+
+def test_segments_replace_rows_from_their_start(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'))
+    checkpoint.start_curve('output1', [0., 0.1, 0.2, 0.3], 0.)
+    checkpoint.add_points(0, [[0., 1.], [0.1, 2.], [0.2, 3.]])
+    checkpoint.add_points(2, [[0.2, 4.], [0.3, 5.]])
+    assert checkpoint.curve['rows'] == [[0., 1.], [0.1, 2.], [0.2, 4.], [0.3, 5.]]
+
+
+def test_remove(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'))
+    checkpoint.save()
+    checkpoint.remove()
+    checkpoint.remove()
+    assert not os.listdir(str(tmp_path))
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pytest
+
+from chunked_store import ChunkedStore
+
+
+def filled_store(tmp_path, n = 100):
+    # 8 rows per block and room for 2 completed blocks in memory
+    store = ChunkedStore(2, block_rows = 8, memory_cap = 2 * 8 * 2 * 8, directory = str(tmp_path))
+    rows = np.column_stack((np.arange(n, dtype = float), np.arange(n) ** 2.))
+    store.extend(rows[:n // 2])
+    for row in rows[n // 2:]:
+        store.append(row)
+    return store, rows
+
+
+def test_rows_come_back_in_order(tmp_path):
+    store, rows = filled_store(tmp_path)
+    assert len(store) == 100
+    assert np.array_equal(store.array(), rows)
+    assert np.array_equal(store.array([1]), rows[:, [1]])
+    assert np.array_equal(store.last(), rows[-1])
+
+
+def test_old_blocks_spill_to_disk(tmp_path):
+    store, rows = filled_store(tmp_path)
+    assert store.in_memory == 2
+    assert sum(isinstance(b, str) for b in store.blocks) == len(store.blocks) - 2
+    spill_dir = store.spill_dir
+    assert os.listdir(spill_dir)
+    store.close()
+    assert len(store) == 0 and not os.path.exists(spill_dir)
+
+
+def test_between_adds_a_row_on_each_side(tmp_path):
+    store, rows = filled_store(tmp_path)
+    assert np.array_equal(store.between(0, 20.5, 30.5), rows[20:32])
+    assert np.array_equal(store.between(0, -5, 2), rows[:4])
+    assert np.array_equal(store.between(0, 97.5, 200), rows[97:])
+    assert np.array_equal(store.between(0, 20.5, 30.5, rows = 25), rows[20:25])
+    assert store.between(0, 0, 10, rows = 0).shape == (0, 2)
+
+
+def test_savetxt_matches_numpy(tmp_path):
+    store, rows = filled_store(tmp_path)
+    store.savetxt(str(tmp_path / 'store.txt'), header = 'a\tb', footer = 'end')
+    np.savetxt(str(tmp_path / 'numpy.txt'), rows, fmt = '%.10f', delimiter = '\t', header = 'a\tb', footer = 'end', comments = '')
+    assert (tmp_path / 'store.txt').read_text() == (tmp_path / 'numpy.txt').read_text()
+
+
+def test_frozen_store_refuses_rows(tmp_path):
+    store, rows = filled_store(tmp_path)
+    store.freeze()
+    with pytest.raises(ValueError):
+        store.append(rows[0])
+    with pytest.raises(ValueError):
+        store.extend(rows)
+    assert np.array_equal(store.array(), rows)
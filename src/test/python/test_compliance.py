@@ -0,0 +1,38 @@
+import pytest
+
+from compliance import ComplianceError, ComplianceGuard, status_problems
+from keithley2400_sourcemeter_interface import Keithley2400SourceMeter
+
+COMPLIANCE = Keithley2400SourceMeter.STATUS_COMPLIANCE
+OVERFLOW = Keithley2400SourceMeter.STATUS_OVERFLOW
+
+
+def test_status_problems():
+    assert status_problems('DS', [0, 0]) == []
+    assert status_problems('DS', [0, COMPLIANCE]) == ['DS in compliance']
+    assert status_problems('G', COMPLIANCE | OVERFLOW) == ['G in compliance', 'G over range']
+
+
+def test_off_and_warn_keep_measuring(capsys):
+    ComplianceGuard('off').check('V_G = 0.6 V', DS = COMPLIANCE)
+    assert capsys.readouterr().out == ''
+    guard = ComplianceGuard('warn')
+    guard.check('V_G = 0 V', DS = 0, G = None)
+    guard.check('V_G = 0.4 V', DS = COMPLIANCE, G = None)
+    guard.check('V_G = 0.6 V', DS = COMPLIANCE, G = None)
+    assert capsys.readouterr().out == 'Compliance: DS in compliance at V_G = 0.4 V\n' # once per curve
+    assert not guard.tripped
+
+
+def test_skip_sweep_trips():
+    guard = ComplianceGuard('skip sweep')
+    guard.check('V_G = 0 V', DS = 0)
+    assert not guard.tripped
+    guard.check('V_G = 0.6 V', G = OVERFLOW, DS = 0)
+    assert guard.tripped
+
+
+def test_abort_raises():
+    guard = ComplianceGuard('abort')
+    with pytest.raises(ComplianceError, match = 'DS in compliance, G over range at t = 1.000 s'):
+        guard.check('t = 1.000 s', G = OVERFLOW, DS = [0, COMPLIANCE])
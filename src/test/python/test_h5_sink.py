@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+pytest.importorskip('ScopeFoundry')
+import h5_sink
+
+
+@pytest.fixture
+def sink(tmp_path, monkeypatch):
+    # a plain file and group in place of the ScopeFoundry ones, which need a running app
+    monkeypatch.setattr(h5_sink.h5_io, 'h5_base_file', lambda app, measurement, fname: h5py.File(fname, 'w'))
+    monkeypatch.setattr(h5_sink.h5_io, 'h5_create_measurement_group',
+                        lambda measurement, h5group: h5group.create_group('measurement/test'))
+    sink = h5_sink.H5Sink(SimpleNamespace(app = None), str(tmp_path / 'test.h5'), chunk_rows = 4)
+    yield sink
+    if sink.h5_file:
+        sink.close()
+
+
+def test_rows_are_held_back_until_a_chunk_is_full(sink):
+    sink.create_table('curve', ['V', 'I'], sweep = 'G')
+    sink.append('curve', [0., 1.])
+    sink.append('curve', np.ones((2, 2)))
+    assert sink.tables['curve'].shape == (0, 2)
+    sink.append('curve', [3., 4.])
+    assert sink.tables['curve'].shape == (4, 2)
+    sink.append('curve', [5., 6.])
+    sink.flush()
+    assert sink.tables['curve'].shape == (5, 2)
+    assert np.array_equal(sink.tables['curve'][-1], [5., 6.])
+    assert sink.tables['curve'].attrs['sweep'] == 'G'
+
+
+def test_close_writes_everything(sink):
+    sink.create_table('curve', ['V', 'I'])
+    sink.append('curve', np.arange(6.).reshape(3, 2))
+    sink.set_attrs('config/Transfer', {'Vds (V)': -0.6})
+    sink.close()
+    with h5py.File(sink.filename, 'r') as f:
+        assert np.array_equal(f['measurement/test/curve'][:], np.arange(6.).reshape(3, 2))
+        assert f['measurement/test/config/Transfer'].attrs['Vds (V)'] == -0.6
@@ -0,0 +1,52 @@
+import threading
+import time
+
+import pytest
+
+from instrument_executor import InstrumentExecutor
+
+
+class Device(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = []
+
+    def call(self, n, duration = 0.):
+        time.sleep(duration)
+        self.calls.append(n)
+        return self.name, n
+
+
+def test_calls_to_one_device_keep_their_order():
+    a = Device('a')
+    io = InstrumentExecutor((a,))
+    futures = [io.submit(a, a.call, n, 0.001 * (n % 3)) for n in range(20)]
+    assert [f.result() for f in futures] == [('a', n) for n in range(20)]
+    assert a.calls == list(range(20))
+    io.shutdown()
+
+
+def test_calls_to_different_devices_overlap():
+    a, b = Device('a'), Device('b')
+    io = InstrumentExecutor((a, b))
+    started = threading.Event()
+    # on one thread the wait would time out before the set
+    assert io.gather((a, started.wait, 5), (b, started.set)) == [True, None]
+    t0 = time.perf_counter()
+    assert io.each('call', 1, 0.2) == [('a', 1), ('b', 1)]
+    assert time.perf_counter() - t0 < 0.35
+    io.shutdown()
+
+
+def test_gather_raises_once_all_calls_are_done():
+    a, b = Device('a'), Device('b')
+    io = InstrumentExecutor((a, b))
+
+    def fail():
+        raise ValueError('no response')
+
+    with pytest.raises(ValueError, match = 'no response'):
+        io.gather((a, fail), (b.call, 1, 0.1))
+    assert b.calls == [1]
+    io.shutdown()
@@ -0,0 +1,68 @@
+import threading
+
+import numpy as np
+
+from io_stats import LATENCY_EDGES, CommandStats, IOStats, command_class
+
+
+def test_command_class_drops_arguments():
+    assert command_class(':SOUR:VOLT:LEV -0.3;:READ?') == ':SOUR:VOLT:LEV;:READ?'
+
+
+def test_latencies_are_binned_by_decade_quarters():
+    stats = CommandStats()
+    for latency in (2e-5, 2e-5, 2e-5, 5e-3):
+        stats.add(10, latency)
+    assert sum(stats.histogram) == 4
+    assert stats.histogram[2] == 3 # 1.78e-5 .. 3.16e-5
+    assert stats.histogram[11] == 1 # 3.16e-3 .. 5.62e-3
+    assert stats.percentile(50) == LATENCY_EDGES[2]
+    assert stats.percentile(90) == 5e-3 # capped at the largest latency
+    assert stats.bytes == 40 and np.isclose(stats.latency, 5.06e-3)
+
+
+def test_counts_are_normalised_per_point():
+    stats = IOStats()
+    for i in range(6):
+        stats.record('SIM::1', 'write', ':SOUR:VOLT:LEV %g' % i, 20, 1e-3)
+    for i in range(3):
+        stats.record('SIM::1', 'query', ':READ?', 20, 2e-3)
+    stats.record('SIM::2', 'binary', ':READ?', 20, 2e-3)
+    stats.mark_point(3)
+    summary = stats.summary()
+    assert summary['points'] == 3
+    one = summary['instruments']['SIM::1']
+    assert (one['writes'], one['queries']) == (6, 3)
+    assert (one['writes_per_point'], one['queries_per_point']) == (2, 1)
+    assert np.isclose(one['bus_time'], 12e-3)
+    assert [c['command'] for c in one['commands']] == [':SOUR:VOLT:LEV', ':READ?']
+    assert summary['instruments']['SIM::2']['queries_per_point'] == 1 / 3.
+    assert 'Instrument\tSIM::2' in stats.report()
+
+
+def test_records_from_worker_threads_all_count():
+    stats = IOStats()
+
+    def record(port):
+        for i in range(2000):
+            stats.record(port, 'query', ':READ?', 10, 1e-3)
+            stats.mark_point()
+
+    threads = [threading.Thread(target = record, args = ('SIM::%d' % (i % 2), )) for i in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    summary = stats.summary()
+    assert summary['points'] == 8000
+    assert [summary['instruments'][port]['queries'] for port in ('SIM::0', 'SIM::1')] == [4000, 4000]
+
+
+def test_driver_records_every_transaction(sim_keithley):
+    k = sim_keithley()
+    k.io_stats = IOStats()
+    before = k.keithley.write_count + k.keithley.query_count
+    k.measure_current(nplc = 0.01)
+    k.write_output_on()
+    k.source_V(0.1)
+    k.read_I()
+    instrument = k.io_stats.summary()['instruments'][k.port]
+    assert instrument['writes'] + instrument['queries'] == k.keithley.write_count + k.keithley.query_count - before
@@ -0,0 +1,87 @@
+import time
+
+import numpy as np
+import pytest
+from pyvisa.errors import VisaIOError
+
+from keithley2400_sim import OVERFLOW, ResistorModel, OECTModel, normalize_header, short_form
+
+
+def test_headers_normalize_to_short_forms():
+    assert short_form('VOLTAGE') == 'VOLT'
+    assert short_form('SOURCE') == 'SOUR'
+    assert normalize_header(['SOURCE', 'VOLTAGE', 'LEVEL', 'IMMEDIATE']) == 'SOUR:VOLT'
+
+
+def test_single_reading_follows_ohms_law(sim_keithley):
+    k = sim_keithley(device_model = ResistorModel(1e6))
+    k.measure_current(nplc = 0.01)
+    k.write_output_on()
+    k.source_V(0.5)
+    assert np.isclose(k.read_I(), 0.5e-6)
+
+
+def test_sweep_readings_take_their_own_levels(sim_keithley):
+    k = sim_keithley(device_model = ResistorModel(1e6))
+    k.measure_current(nplc = 0.01)
+    k.write_output_on()
+    for levels in ([0.1, 0.2, 0.3, 0.4], [0.1, 0.3, 0.2]):
+        n = k.write_sweep(levels)
+        assert np.allclose(k.read_sweep(points = n), np.array(levels) * 1e-6)
+
+
+def test_fixed_range_overflows(sim_keithley):
+    k = sim_keithley(device_model = ResistorModel(1e3))
+    k.measure_current(nplc = 0.01, current = 1.05e-6, auto_range = False)
+    k.write_output_on()
+    k.source_V(1)
+    assert k.read_I() >= OVERFLOW
+
+
+def test_oect_turns_on_below_threshold():
+    model = OECTModel()
+    off = abs(model.steady_current(0.4, -0.6))
+    on = abs(model.steady_current(-0.6, -0.6))
+    assert off < 1e-9 < 1e-5 < on
+
+
+class ClockModel(object):
+    '''
+    Current proportional to the time of the reading, so readings taken at the same instant are equal.
+    '''
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+
+    def measure(self, sim, t):
+        return 0., (t - self.t0) * 1e-6
+
+
+def linked_pair(sim_keithley, count, delay):
+    master, slave = sim_keithley('SIM::1', ClockModel()), sim_keithley('SIM::2')
+    for k in (master, slave):
+        k.measure_current(nplc = 0.1)
+        k.write_output_on()
+    master.arm_trigger_link('master', count, delay)
+    slave.arm_trigger_link('slave', count)
+    return master, slave
+
+
+def test_slave_samples_on_the_masters_triggers(sim_keithley):
+    master, slave = linked_pair(sim_keithley, 4, 0.01)
+    slave.init()
+    master.init()
+    readings = master.fetch_values(points = 4)
+    assert np.all(np.diff(readings) > 0.9e-8)
+    assert np.array_equal(slave.fetch_values(points = 4), readings)
+
+
+def test_slave_started_after_the_master_misses_the_arm_pulse(sim_keithley):
+    master, slave = linked_pair(sim_keithley, 4, 0)
+    master.init()
+    slave.init()
+    slave.keithley.timeout = 50
+    with pytest.raises(VisaIOError):
+        slave.fetch_values(points = 4)
+    slave.keithley.clear()
+    master.fetch_values(points = 4)
@@ -0,0 +1,214 @@
+import numpy as np
+import pytest
+
+from conftest import component
+
+
+def transactions(k):
+    return k.keithley.write_count + k.keithley.query_count
+
+
+def sent(k):
+    return ';'.join(k.keithley.written)
+
+
+def test_even_steps_load_a_staircase(fake_keithley):
+    k = fake_keithley()
+    assert k.write_sweep([0, 0.1, 0.2, 0.3], source_delay = 0.01) == 4
+    assert ':SOUR:VOLT:MODE SWE' in sent(k)
+    assert ':SOUR:VOLT:STAR 0;:SOUR:VOLT:STOP 0.3;:SOUR:VOLT:STEP 0.1' in sent(k)
+    assert ':SOUR:DEL 0.01' in sent(k) and ':TRIG:COUN 4' in sent(k)
+
+
+def test_uneven_steps_load_a_list(fake_keithley):
+    k = fake_keithley()
+    assert k.write_sweep([0, 0.3, 0.1]) == 3
+    assert ':SOUR:VOLT:MODE LIST' in sent(k) and ':SOUR:LIST:VOLT 0,0.3,0.1' in sent(k)
+    with pytest.raises(ValueError):
+        k.write_sweep(np.random.rand(k.LIST_MAX_POINTS + 1))
+
+
+def test_sweep_and_return_split_into_two_staircases(fake_keithley):
+    k = fake_keithley()
+    segments = k.sweep_segments([0, 0.1, 0.2, 0.2, 0.1, 0])
+    assert [list(segment) for segment in segments] == [[0, 0.1, 0.2], [0.2, 0.1, 0]]
+
+
+def test_only_changed_state_is_sent(fake_keithley):
+    k = fake_keithley()
+    k.write_state(('a', 1, ':A 1'), ('b', 2, ':B 2'))
+    k.write_state(('a', 1, ':A 1'), ('b', 3, ':B 3'))
+    assert k.keithley.written == [':A 1;:B 2', ':B 3']
+    k.invalidate_state()
+    k.write_state(('a', 1, ':A 1'))
+    assert k.keithley.written[-1] == ':A 1'
+
+
+def test_ranges_are_shadowed_per_function(fake_keithley):
+    k = fake_keithley()
+    k.write_range(1e-3, 'SENS', 'CURR')
+    k.write_range(2, 'SOUR', 'VOLT')
+    k.write_range(1e-3, 'SENS', 'CURR')
+    k.write_range(2, 'SOUR', 'VOLT')
+    assert k.keithley.written == [':SENS:CURR:RANG:AUTO 0;:SENS:CURR:RANG 0.001', ':SOUR:VOLT:RANG:AUTO 0;:SOUR:VOLT:RANG 2']
+
+
+def test_verify_state_drops_mismatches(fake_keithley):
+    k = fake_keithley()
+    k.write_trigger_count(5)
+    k.keithley.responses[':FORM:ELEM?'] = '"VOLT,CURR,RES,TIME,STAT"' # as after *RST
+    k.keithley.responses[':TRIG:COUN?'] = '1'
+    assert k.verify_state() == {'trig_count': (5, 1.)}
+    k.write_trigger_count(5)
+    assert k.keithley.written[-1] == ':TRIG:COUN 5'
+
+
+def test_readings_come_back_as_sreal(fake_keithley):
+    k = fake_keithley()
+    k.keithley.readings.append([1e-6, -2e-6, 3.5])
+    values = k.ask_values(':READ?', points = 3)
+    assert np.allclose(values, [1e-6, -2e-6, 3.5])
+    assert k.keithley.data_points == [3] # the read ends on the byte count
+    assert ':FORM:DATA SREAL;:FORM:BORD SWAP' in sent(k)
+
+
+def test_ascii_readings_are_split_on_commas(fake_keithley):
+    k = fake_keithley(binary_transfer = False)
+    k.keithley.responses[':READ?'] = '+1.000000E-06,-2.000000E-06'
+    assert np.allclose(k.ask_values(':READ?'), [1e-6, -2e-6])
+    assert ':FORM:DATA ASC' in sent(k)
+
+
+def test_burst_is_one_read(fake_keithley):
+    k = fake_keithley()
+    k.keithley.responses[':FORM:ELEM?'] = 'CURR'
+    k.measure_current(nplc = 0.1)
+    for burst in range(2):
+        k.keithley.readings.append([1e-6, 2e-6, 3e-6])
+        k.keithley.written = []
+        assert np.allclose(k.read_burst(3, delay = 0.01), [1e-6, 2e-6, 3e-6])
+        assert k.keithley.written[-1].endswith(':READ?')
+    assert k.keithley.written == [':READ?'] # the second burst is configured already
+    messages = [message for port, message in fake_keithley.log]
+    assert ':TRIG:COUN 3' in messages and ':TRIG:SEQ:DEL 0.01' in messages
+
+
+def test_filter_is_turned_on_and_off(fake_keithley):
+    k = fake_keithley()
+    k.write_filter(4)
+    k.write_filter(4, 'MOV')
+    k.write_filter(1)
+    k.write_filter(0)
+    assert k.keithley.written == [':SENS:AVER:TCON REP;:SENS:AVER:COUN 4;:SENS:AVER ON',
+                                  ':SENS:AVER:TCON MOV;:SENS:AVER:COUN 4;:SENS:AVER ON', ':SENS:AVER OFF']
+
+
+def test_trigger_link_roles(fake_keithley):
+    k = fake_keithley()
+    k.write_trigger_link('master', 1, 2)
+    assert ':ARM:OUTP TENT;:ARM:OLIN 1' in sent(k) and ':TRIG:OUTP DEL;:TRIG:OLIN 2' in sent(k)
+    k.write_trigger_link('slave', 3, 4)
+    assert ':ARM:SOUR TLIN;:ARM:ILIN 3' in sent(k) and ':TRIG:SOUR TLIN;:TRIG:ILIN 4' in sent(k)
+    k.write_single_shot()
+    assert k.keithley.written[-1].endswith(k.TRIGGER_LINK_RELEASE)
+    with pytest.raises(ValueError):
+        k.write_trigger_link('boss')
+
+
+@pytest.mark.parametrize('master', ['a', 'b'])
+def test_synchronized_read_starts_the_slave_first(fake_keithley, master):
+    hc = pytest.importorskip('keithley2400_sourcemeter_hc')
+    hw = {name: component(name, fake_keithley(name)) for name in 'ab'}
+    for name in 'ab':
+        hw[name].keithley.keithley.responses[':FORM:ELEM?'] = 'CURR'
+        hw[name].keithley.keithley.readings.append([1., 2.] if name == 'a' else [3., 4.])
+    readings = hc.read_synchronized(hw['a'], hw['b'], 2, 0.01, master = hw[master])
+    assert [list(r) for r in readings] == [[1., 2.], [3., 4.]]
+    starts = [port for port, message in fake_keithley.log if message.endswith(':INIT')]
+    assert starts == ['b', 'a'] if master == 'a' else ['a', 'b']
+    slave = hw['b' if master == 'a' else 'a'].keithley
+    assert ':TRIG:SOUR TLIN' in sent(slave) and ':TRIG:SEQ:DEL 0.01' not in sent(slave)
+
+
+def test_batch_sends_one_program_message(sim_keithley):
+    k = sim_keithley()
+    before = transactions(k)
+    with k.batch() as responses:
+        k.write_source_mode('VOLT')
+        k.measure_current(nplc = 0.1)
+        k.write_current_compliance(1e-3)
+        k.ask_later(':SENS:CURR:NPLC?')
+    assert transactions(k) - before == 1
+    assert float(responses[0]) == 0.1
+
+
+def test_unchanged_configuration_is_not_sent_again(sim_keithley):
+    k = sim_keithley()
+    k.measure_current(nplc = 0.1)
+    before = transactions(k)
+    k.measure_current(nplc = 0.1)
+    assert transactions(k) == before
+    k.measure_current(nplc = 1)
+    assert transactions(k) == before + 1
+    assert np.isclose(float(k.ask(':SENS:CURR:NPLC?')), 1)
+
+
+def test_level_set_before_the_trigger_is_sent(sim_keithley):
+    k = sim_keithley()
+    k.source_V(0.2)
+    k.write_triggered_level(0.5)
+    k.source_V(0.5)
+    assert float(k.ask(':SOUR:VOLT?')) == 0.5
+
+
+def test_triggered_level_is_the_level_once_fetched(sim_keithley):
+    k = sim_keithley()
+    k.measure_current(nplc = 0.01)
+    k.write_output_on()
+    k.source_V(0.2)
+    k.write_triggered_level(0.5)
+    k.arm_trace(3)
+    k.init()
+    assert 'source_level:VOLT' not in k.state
+    k.fetch_trace(points = 3)
+    before = transactions(k)
+    k.source_V(0.5)
+    assert transactions(k) == before
+    assert float(k.ask(':SOUR:VOLT?')) == 0.5
+
+
+def test_trace_stores_time_stamped_readings(sim_keithley):
+    from keithley2400_sim import ResistorModel
+    k = sim_keithley(device_model = ResistorModel(1e6))
+    k.measure_current(nplc = 0.01)
+    k.write_output_on()
+    k.source_V(0.5)
+    k.reset_timestamp()
+    k.arm_trace(5, interval = 0.002)
+    k.init()
+    currents, times = k.fetch_trace(points = 5)
+    assert np.allclose(currents, 0.5e-6)
+    assert np.all(np.diff(times) >= 0.002) and times[0] < 1
+    with pytest.raises(ValueError):
+        k.arm_trace(k.TRACE_MAX_POINTS + 1)
+
+
+def test_status_words_are_split_off_the_readings(sim_keithley):
+    from keithley2400_sim import ResistorModel
+    k = sim_keithley(device_model = ResistorModel(100))
+    k.write_status_reporting(True)
+    k.write_current_compliance(1e-3)
+    k.measure_current(nplc = 0.01)
+    k.write_output_on()
+    k.source_V(0.05)
+    assert np.allclose(k.read_burst(3), 0.5e-3)
+    assert k.status.shape == (3,) and not k.in_compliance()
+    k.source_V(0.5)
+    assert np.allclose(k.read_burst(3), 1e-3)
+    assert k.in_compliance(k.status) and k.in_compliance() and not k.over_range()
+    k.clear_status()
+    assert not k.in_compliance()
+    k.write_status_reporting(False)
+    k.measure_current(nplc = 0.01)
+    assert np.allclose(k.read_burst(2), 1e-3)
+    assert not k.in_compliance(k.status)
@@ -0,0 +1,74 @@
+import numpy as np
+
+from live_plot import LiveCurve, PlotFeed, minmax_decimate
+
+
+class Signal(object):
+    def connect(self, slot):
+        pass
+
+
+class ViewBox(object):
+    sigXRangeChanged = Signal()
+
+    def autoRangeEnabled(self):
+        return (True, True)
+
+    def width(self):
+        return 100
+
+
+class DataItem(object):
+    def setData(self, x, y):
+        self.data = (np.asarray(x), np.asarray(y))
+
+    def setPen(self, pen):
+        self.pen = pen
+
+
+class PlotItem(object):
+    '''
+    Just what LiveCurve uses of a pyqtgraph PlotItem.
+    '''
+
+    def plot(self, pen = None):
+        return DataItem()
+
+    def getViewBox(self):
+        return ViewBox()
+
+
+def test_decimation_keeps_the_extremes():
+    x = np.arange(10000.)
+    y = np.sin(x / 100)
+    y[5000] = 10
+    xd, yd = minmax_decimate(x, y, 100)
+    assert len(yd) <= 200 and yd.max() == 10 and xd[np.argmax(yd)] == 5000
+    assert np.all(np.diff(xd) > 0)
+
+
+def test_feed_hands_over_each_row_once():
+    feed = PlotFeed()
+    feed.push([0, 1.])
+    rows = np.array([[1, 2.], [2, 3.]])
+    feed.push(rows)
+    rows[0, 0] = 99 # pushed rows are copies
+    version, taken = feed.take()
+    assert taken.tolist() == [[0, 1], [1, 2], [2, 3]]
+    assert feed.take() == (version, None)
+    feed.push([3, 4.])
+    feed.clear()
+    assert feed.take() == (version + 1, None)
+
+
+def test_curve_appends_and_inserts():
+    curve = LiveCurve(PlotItem(), 'r')
+    curve.extend([0., 1., 2.], [0., 10., 20.])
+    curve.extend([1.5], [15.], index = 2)
+    curve.extend([3.], [30.])
+    assert curve.x.tolist() == [0, 1, 1.5, 2, 3]
+    assert curve.item.data[1].tolist() == [0, 10, 15, 20, 30]
+    curve.extend([2.5, 0.5], [25., 5.]) # a return sweep
+    assert not curve.monotonic and len(curve.item.data[0]) == 7
+    curve.clear()
+    assert len(curve.x) == 0 and curve.monotonic
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from pixel_batch import PixelJob, parse_pixels, load_jobs, order_jobs, screen_values, screen_reason, write_summary
+
+PIXELS = {'1: 400': 1, '2: 800': 2, '3: 1600': 3}
+
+
+def test_parse_pixels():
+    assert parse_pixels('all', PIXELS) == ['1: 400', '2: 800', '3: 1600']
+    assert parse_pixels('3, 2: 800,', PIXELS) == ['3: 1600', '2: 800']
+    with pytest.raises(ValueError):
+        parse_pixels('4', PIXELS)
+
+
+def test_load_jobs(tmp_path):
+    filename = str(tmp_path / 'jobs.json')
+    with open(filename, 'w') as f:
+        json.dump([{'pixel': 2, 'V_DS': -0.6}, {'pixel': '1: 400'}], f)
+    jobs = load_jobs(filename, PIXELS)
+    assert [job.pixel for job in jobs] == ['2: 800', '1: 400']
+    assert jobs[0].recipe == {'V_DS': -0.6}
+    assert jobs[1].recipe == {}
+    assert jobs[0].status == 'pending'
+
+
+def test_order_jobs_starts_with_the_connected_pixel():
+    jobs = [PixelJob('3: 1600'), PixelJob('1: 400', {'V_DS': -0.2}), PixelJob('2: 800'),
+            PixelJob('1: 400', {'V_DS': -0.4})]
+    ordered = order_jobs(jobs, PIXELS, connected = '2: 800')
+    assert [job.pixel for job in ordered] == ['2: 800', '1: 400', '1: 400', '3: 1600']
+    assert [job.recipe.get('V_DS') for job in ordered[1:3]] == [-0.2, -0.4]
+
+
+def test_screening():
+    values = screen_values([-1e-9, -1e-6, -1e-4], [1e-10, -2e-10, 0.])
+    assert values == pytest.approx({'on_current': 1e-4, 'on_off_ratio': 1e5, 'gate_leakage': 2e-10})
+    assert screen_reason(values, 1e-6, 100, 1e-8) == ''
+    assert screen_reason(values, 1e-6, 100, 1e-10).startswith('gate short')
+    assert screen_reason(values, 1e-3, 100, 1e-8).startswith('open channel')
+    assert screen_reason(values, 1e-6, 1e6, 1e-8).startswith('no gating')
+
+
+def test_write_summary(tmp_path):
+    job = PixelJob('2: 800', {'V_DS': -0.6})
+    job.status = 'rejected'
+    job.attempts = 1
+    job.screen = {'on_current': 1e-12}
+    filename = str(tmp_path / 'summary.tsv')
+    write_summary(filename, [job])
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    assert lines[0].split('\t') == ['Pixel', 'Status', 'Attempts', 'Error', 'Screen', 'Recipe']
+    fields = lines[1].split('\t')
+    assert fields[:4] == ['2: 800', 'rejected', '1', '']
+    assert json.loads(fields[4]) == {'on_current': 1e-12}
+    assert json.loads(fields[5]) == {'V_DS': -0.6}
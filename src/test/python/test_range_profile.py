@@ -0,0 +1,51 @@
+import numpy as np
+
+from keithley2400_sim import ResistorModel
+from range_profile import RangeProfile
+
+
+def test_profile_expects_the_larger_neighbour():
+    profile = RangeProfile()
+    assert profile.expected(0.1) is None
+    profile.record(0.1, -2e-6)
+    profile.record(0.3, 5e-6)
+    assert profile.expected(0.1) == 2e-6
+    assert profile.expected(0.2) == 5e-6
+    assert profile.expected(-1) == 2e-6
+    assert profile.expected(1) == 5e-6
+
+
+def test_profile_ignores_overflow_and_nan():
+    profile = RangeProfile()
+    profile.record(0, 9.9e37)
+    profile.record(0, np.nan)
+    assert profile.expected(0) is None
+
+
+def test_preranged_read_falls_back_to_autorange(sim_keithley):
+    k = sim_keithley(device_model = ResistorModel(1e6))
+    k.measure_current(nplc = 0.01)
+    k.write_output_on()
+    k.write_preranging(True)
+    k.source_V(0.1)
+    k.read_I()
+    assert np.isclose(k.read_I(), 1e-7)
+    assert not k.current_config['auto_range']
+    k.source_V(10)
+    assert np.isclose(k.read_I(), 1e-5)
+    assert k.range_fallbacks == 1
+
+
+def test_preranged_burst_falls_back_to_autorange(sim_keithley):
+    k = sim_keithley(device_model = ResistorModel(1e6))
+    k.measure_current(nplc = 0.01)
+    k.write_output_on()
+    k.write_preranging(True)
+    k.source_V(0.1)
+    assert np.allclose(k.read_burst(3), 1e-7) and np.allclose(k.read_burst(3), 1e-7)
+    assert k.current_config['current'] == 1.05e-6 and not k.current_config['auto_range']
+    k.source_V(10)
+    assert np.allclose(k.read_burst(3), 1e-5)
+    assert k.range_fallbacks == 1
+    assert np.allclose(k.read_burst(3), 1e-5)
+    assert k.current_config['current'] >= 1e-5 and not k.current_config['auto_range']
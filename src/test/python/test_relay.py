@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip('usb')
+
+from relay_ft245r import FT245R, relay_mask
+from relay_ft245r_sim import SimulatedUSB
+
+
+def connected_board(boards = 1):
+    core = SimulatedUSB(boards = boards, latency = 0)
+    board = FT245R(core)
+    board.connect(board.list_dev()[0])
+    return board
+
+
+def test_relay_mask():
+    assert relay_mask([]) == 0
+    assert relay_mask([1]) == 0x01
+    assert relay_mask([2, 8]) == 0x82
+    with pytest.raises(ValueError):
+        relay_mask([0])
+    with pytest.raises(ValueError):
+        relay_mask([9])
+
+
+def test_list_dev_ignores_uarts():
+    core = SimulatedUSB(boards = 3, latency = 0)
+    core.devices[1].product = u'FT232R USB UART'
+    assert FT245R(core).list_dev() == [core.devices[0], core.devices[2]]
+
+
+def test_setmask_writes_all_relays_once():
+    board = connected_board()
+    dev = board.dev
+    assert dev.bitbang and not dev.kernel_driver
+    assert board.setmask(relay_mask([3]))
+    assert dev.pins == 0x04 and dev.writes == 1
+    assert not board.setmask(relay_mask([3]))
+    assert dev.writes == 1
+    assert board.setmask(relay_mask([5]))
+    assert dev.pins == 0x10 and dev.writes == 2
+    assert board.getstatus(5) == 1 and board.getstatus(3) == 0
+    with pytest.raises(ValueError):
+        board.setmask(0x100)
+
+
+def test_switch_single_relays():
+    board = connected_board()
+    board.switchon(2)
+    board.switchon(4)
+    board.switchoff(2)
+    assert board.dev.pins == 0x08
+    board.switchoff(2)
+    assert board.dev.writes == 3
+
+
+def test_disconnect():
+    board = connected_board()
+    board.disconnect()
+    assert not board.is_connected
+    assert not board.dev.bitbang and board.dev.kernel_driver
+    with pytest.raises(IOError):
+        board.setmask(0)
@@ -0,0 +1,77 @@
+import threading
+
+import numpy as np
+import pytest
+
+from chunked_store import ChunkedStore
+from save_service import SaveService, free_filename, snapshot, write_text
+
+
+def test_saves_run_in_order_off_the_calling_thread(tmp_path):
+    saver = SaveService()
+    threads, order = [], []
+
+    def save(n):
+        threads.append(threading.current_thread())
+        order.append(n)
+
+    for n in range(10):
+        saver.submit(save, n)
+    saver.submit(write_text, str(tmp_path / 'report.txt'), 'done\n')
+    saver.flush()
+    saver.close()
+    assert order == list(range(10))
+    assert threading.current_thread() not in threads
+    assert (tmp_path / 'report.txt').read_text() == 'done\n'
+
+
+def test_failed_save_is_raised_at_flush():
+    saver = SaveService()
+
+    def fail():
+        raise ValueError('disk full')
+
+    saver.submit(fail)
+    with pytest.raises(IOError, match = 'disk full'):
+        saver.flush()
+    saver.flush() # raised once only
+    saver.close()
+
+
+def test_snapshot_is_a_read_only_copy():
+    data = np.zeros(3)
+    copy = snapshot(data)
+    data[0] = 1
+    assert copy[0] == 0
+    with pytest.raises(ValueError):
+        copy[0] = 2
+
+
+def test_free_filename_numbers_taken_names(tmp_path):
+    directory = str(tmp_path)
+    assert free_filename(directory, 'dev', '_a.txt') == directory + '/dev_a.txt'
+    (tmp_path / 'dev_a.txt').write_text('')
+    (tmp_path / 'dev_0__a.txt').write_text('')
+    assert free_filename(directory, 'dev', '_a.txt') == directory + '/dev_1__a.txt'
+
+
+def test_transient_files_are_named_when_written(tmp_path):
+    transient = pytest.importorskip('transient_step_response_measure')
+    write_files = transient.TransientStepResponseMeasure.write_files
+    saver = SaveService()
+    block = threading.Event()
+    saver.submit(block.wait) # hold the writer as a slow disk would
+    stores = []
+    for run in range(2):
+        store = ChunkedStore(2, block_rows = 4, memory_cap = 64, directory = str(tmp_path))
+        store.extend(np.full((20, 2), run, dtype = float))
+        store.freeze()
+        if stores: saver.submit(stores[-1].close) # as the next pre_run does
+        saver.submit(write_files, str(tmp_path), 'dev', store, 'a\tb', '', 'report %d\n' % run)
+        stores.append(store)
+    block.set()
+    saver.flush()
+    saver.close()
+    for run, name in enumerate(('dev_current_vs_time', 'dev_0__current_vs_time')):
+        assert np.array_equal(np.loadtxt(str(tmp_path / (name + '.txt')), skiprows = 1), np.full((20, 2), run))
+        assert (tmp_path / (name + '_io.txt')).read_text() == 'report %d\n' % run
@@ -0,0 +1,35 @@
+import numpy as np
+
+from settling import remaining_change, wait_settled
+
+
+def test_remaining_change_of_exponential_decay():
+    t = np.arange(30)
+    readings = 1 + np.exp(-t / 10.)
+    # the window means approach 1 geometrically, so what is left is the distance of the last mean from 1
+    last_mean = readings[20:].mean()
+    assert np.isclose(remaining_change(readings), last_mean - 1, rtol = 0.05)
+
+
+def test_remaining_change_of_noise_is_small():
+    readings = 1 + 1e-4 * np.array([1, -1] * 15)
+    assert remaining_change(readings) < 1e-3
+
+
+def test_remaining_change_still_moving():
+    assert remaining_change(np.arange(30.) ** 2) == np.inf
+    assert remaining_change([1., 2.]) == np.inf
+
+
+def test_wait_settled_stops_once_settled():
+    values = iter(1 + np.exp(-np.arange(1000) / 5.))
+    settle_time, reading = wait_settled(lambda: next(values), tolerance = 1e-3)
+    assert abs(reading - 1) < 2e-3
+    assert settle_time < 1
+
+
+def test_wait_settled_times_out():
+    values = iter(np.arange(1000.))
+    settle_time, reading = wait_settled(lambda: next(values), tolerance = 1e-6, interval = 0.01, timeout = 0.05)
+    assert 0.05 <= settle_time < 0.5
+    assert reading < 100
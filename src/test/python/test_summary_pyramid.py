@@ -0,0 +1,55 @@
+import numpy as np
+
+from chunked_store import ChunkedStore
+from summary_pyramid import SummaryPyramid, summarize
+
+
+def trace(n = 1000):
+    t = np.arange(n) * 0.001
+    y = np.sin(2 * np.pi * t) + 0.01 * np.random.RandomState(0).normal(size = n)
+    y[500] = 5. # a glitch
+    return t, y
+
+
+def filled_pyramid(t, y, chunk = 97):
+    data = ChunkedStore(2, block_rows = 64)
+    pyramid = SummaryPyramid(data, 0, 1, factor = 4)
+    for start in range(0, len(t), chunk):
+        rows = np.column_stack((t[start:start + chunk], y[start:start + chunk]))
+        data.extend(rows)
+        pyramid.extend(rows[:, 0], rows[:, 1])
+    return pyramid
+
+
+def test_summarize_skips_empty_rows():
+    rows = np.array([[[0, 0, 1, 1, 1, 1], [1, 1, 3, 3, 3, 1], [2, 2, np.nan, np.nan, np.nan, 0]]])
+    assert np.allclose(summarize(rows)[0], [0, 2, 1, 3, 2, 2])
+
+
+def test_levels_keep_extremes_and_mean():
+    t, y = trace()
+    pyramid = filled_pyramid(t, y)
+    pyramid.finish()
+    for store in pyramid.levels:
+        rows = store.array()
+        assert rows[:, 5].sum() == len(t)
+        assert rows[:, 3].max() == 5. and rows[:, 2].min() == y.min()
+        assert np.isclose((rows[:, 4] * rows[:, 5]).sum() / len(t), y.mean())
+        assert rows[0, 0] == t[0] and rows[-1, 1] == t[-1]
+
+
+def test_view_uses_a_coarse_level_for_the_whole_trace():
+    t, y = trace()
+    pyramid = filled_pyramid(t, y)
+    x, v = pyramid.view(max_points = 100)
+    assert 50 <= len(x) < len(t) / 2
+    assert v.max() == 5.
+    assert x[0] == t[0] and x[-1] == t[-1]
+
+
+def test_view_of_a_narrow_range_reads_raw_rows():
+    t, y = trace()
+    pyramid = filled_pyramid(t, y)
+    x, v = pyramid.view(0.2, 0.21, max_points = 100)
+    assert np.allclose(x, t[199:212])
+    assert np.allclose(v, y[199:212])
@@ -0,0 +1,46 @@
+import numpy as np
+
+from keithley2400_sim import OECTModel
+from sweep_grid import refine_points, steep_intervals
+
+
+def test_straight_line_is_not_refined():
+    v = np.linspace(0, 1, 15)
+    assert len(refine_points(v, 1e-6 * v, 0.1)) == 0
+
+
+def test_threshold_sets_the_steepness():
+    v = np.linspace(0, 1, 11)
+    i = np.maximum(v - 0.5, 0)
+    # the ramp changes by 0.2 of the span per interval
+    assert np.allclose(refine_points(v, i, 0.15), [0.55, 0.65, 0.75, 0.85, 0.95])
+    assert len(refine_points(v, i, 0.25)) == 0
+
+
+def test_steep_interval_is_split():
+    x = np.linspace(0, 1, 6)
+    y = np.array([0, 0.1, 0.2, 0.8, 0.9, 1.])
+    assert list(steep_intervals(x, y, 0.5)) == [False, False, True, False, False]
+
+
+def test_bend_splits_both_sides():
+    x = np.linspace(0, 1, 4)
+    y = np.array([0, 0, 0, 1.])
+    assert list(steep_intervals(x, y, 0.3)) == [False, True, True]
+    assert list(steep_intervals(x, y, 1.)) == [False, False, False]
+
+
+def test_refined_points_follow_a_descending_sweep():
+    v = np.linspace(0.4, -0.6, 15)
+    model = OECTModel()
+    i = np.array([model.steady_current(g, -0.6) for g in v])
+    new = refine_points(v, i, 0.1, floor = 1e-9)
+    assert 0 < len(new) < len(v) - 1
+    assert np.all(np.diff(new) < 0)
+    assert np.all((new < v[0]) & (new > v[-1]))
+
+
+def test_nothing_to_refine():
+    assert len(refine_points([0, 1], [0, 1], 0.1)) == 0
+    assert len(refine_points([0, 0.5, 1], [0, np.nan, 1], 0.1)) == 0
+    assert len(refine_points([1, 1, 1], [0, 1, 2], 0.1)) == 0
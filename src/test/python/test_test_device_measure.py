@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+import pytest
+
+from keithley2400_sim import INSTRUMENTS, OECTModel, ResistorModel
+
+
+class StopAfter(object):
+    '''
+    OECTModel that stops the measurement m after a number of readings.
+    '''
+
+    def __init__(self, m, readings):
+        self.m = m
+        self.readings = readings
+        self.oect = OECTModel()
+
+    def measure(self, sim, t):
+        self.readings -= 1
+        if self.readings == 0:
+            self.m.interrupt_measurement_called = True
+        return self.oect.measure(sim, t)
+
+
+class DeadPixel(object):
+    '''
+    Settled OECTModel whose channel is open at one pixel of the relay boards of m.
+    '''
+
+    def __init__(self, m, pixel):
+        self.m = m
+        self.pixel = pixel
+        self.oect = OECTModel(tau = 0)
+
+    def measure(self, sim, t):
+        v, i = self.oect.measure(sim, t)
+        if self.m.connected_pixel == self.pixel:
+            return v, 0.
+        return v, i
+
+
+def run(m):
+    m.pre_run()
+    try:
+        m.run()
+    finally:
+        m.post_run()
+
+
+def test_sequence_saves_every_curve(test_device, tmp_path):
+    m = test_device(OECTModel(), number_of_transfer_curves = 2)
+    run(m)
+    assert sorted(os.listdir(tmp_path)) == ['dev_config.cfg', 'dev_output_curve1.txt', 'dev_transfer_curve1.txt',
+                                            'dev_transfer_curve2.txt']
+    data = np.loadtxt(tmp_path / 'dev_transfer_curve1.txt', skiprows = 1, max_rows = 8) # forward and return sweeps
+    assert np.allclose(data[:, 0], [-0.6, -0.4, -0.2, 0, 0, -0.2, -0.4, -0.6])
+    assert np.all(data[:, 3] < 0)
+    assert not INSTRUMENTS['SIM::1'].values['OUTP'] and not INSTRUMENTS['SIM::2'].values['OUTP']
+
+
+def test_abort_saves_the_curve(test_device, tmp_path):
+    m = test_device(ResistorModel(100), G_sweep_compliance_policy = 'abort')
+    m.pre_run()
+    with pytest.raises(Exception, match = 'compliance'):
+        m.run()
+    m.post_run()
+    files = os.listdir(tmp_path)
+    assert 'dev_transfer_curve1.txt' in files and 'dev_config.cfg' in files
+    assert 'dev_output_curve1.txt' not in files
+    assert not INSTRUMENTS['SIM::1'].values['OUTP'] and not INSTRUMENTS['SIM::2'].values['OUTP']
+    assert os.path.exists(m.checkpoint_filename()) # the sequence can be resumed
+
+
+def test_batch_moves_on_after_an_abort(test_device, tmp_path):
+    m = test_device(ResistorModel(100), G_sweep_compliance_policy = 'abort', batch = True, batch_pixels = '2, 3')
+    run(m)
+    for pixel in (2, 3):
+        assert os.path.exists(tmp_path / ('dev_pixel%d_transfer_curve1.txt' % pixel))
+        assert os.path.exists(tmp_path / ('dev_pixel%d_config.cfg' % pixel))
+    summary = open(tmp_path / 'dev_batch.txt').read().splitlines()[1:]
+    assert [line.split('\t')[1] for line in summary] == ['aborted', 'aborted']
+
+
+def test_stop_in_the_transfer_curves_runs_the_output_curves(test_device, tmp_path):
+    model = StopAfter(None, 4)
+    m = model.m = test_device(model, number_of_transfer_curves = 2)
+    run(m)
+    files = os.listdir(tmp_path)
+    assert 'dev_transfer_curve1.txt' in files and 'dev_transfer_curve2.txt' not in files
+    assert 'dev_output_curve1.txt' in files
+    assert not m.sequence_done
+    assert os.path.exists(m.checkpoint_filename())
+
+
+def test_screening_rejects_a_dead_pixel(test_device, tmp_path):
+    model = DeadPixel(None, '3: 2000')
+    m = model.m = test_device(model, batch = True, batch_pixels = '2, 3', screen = True)
+    run(m)
+    summary = {line.split('\t')[0]: line.split('\t') for line in open(tmp_path / 'dev_batch.txt').read().splitlines()[1:]}
+    assert summary['2: 800'][1] == 'done'
+    assert summary['3: 2000'][1] == 'rejected' and summary['3: 2000'][3].startswith('open channel')
+    assert os.path.exists(tmp_path / 'dev_pixel2_output_curve1.txt')
+    assert not os.path.exists(tmp_path / 'dev_pixel3_transfer_curve1.txt')
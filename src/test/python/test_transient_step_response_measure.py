@@ -0,0 +1,42 @@
+import numpy as np
+
+from keithley2400_sim import OECTModel
+
+
+def run(m):
+    m.pre_run()
+    try:
+        m.run()
+    finally:
+        m.post_run()
+    m.saver.flush()
+
+
+def readings(tmp_path):
+    return np.loadtxt(str(tmp_path / 'dev_current_vs_time.txt'), skiprows = 1, comments = 'V_') # footer: V_GS =
+
+
+def test_buffered_drain_step_lands_on_a_trigger(transient, tmp_path):
+    m = transient(OECTModel(tau = 0), buffered = True, sample_interval = 1, trace_points = 40, static_bias = -0.6,
+                  initial_step_setting = 0, setpoint = -0.5, delay_step = 0.05, step_time = 0.1,
+                  total_measurement_time = 0.2)
+    run(m)
+    data = readings(tmp_path)
+    t, v_d, i_ds = data[:, 0], data[:, 1], data[:, 2]
+    assert np.all(np.diff(t) >= 1) and t[0] == 0 # instrument time stamps, 1 ms apart at least
+    assert abs(t[-1] - 200) < 20
+    step = np.flatnonzero(v_d == -0.5)
+    assert len(step) > 10 and np.all(np.diff(step) == 1)
+    assert abs(t[step[0]] - 50) < 10 and abs(t[step[-1] + 1] - 150) < 10 # within a point and a chunk gap
+    assert np.all(i_ds[v_d == 0] == 0) and np.all(i_ds[step] < -1e-5) # each level from its first reading on
+    assert np.all(np.isnan(data[:, 4])) # gate not read
+
+
+def test_buffered_gate_follows_the_drain_triggers(transient, tmp_path):
+    m = transient(OECTModel(tau = 0), buffered = True, synchronized = True, sample_interval = 1, trace_points = 40,
+                  static_bias = -0.6, initial_step_setting = 0, setpoint = -0.5, delay_step = 0.05, step_time = 0.05,
+                  total_measurement_time = 0.15)
+    run(m)
+    data = readings(tmp_path)
+    assert np.allclose(data[:, 4], -0.6 / 1e8) # I_G through the gate leakage at every drain reading
+    assert np.all(data[data[:, 1] == -0.5, 2] < -1e-5)